@@ -0,0 +1,210 @@
+"""
+    Checkpoint module for ChimeraCL.
+    Saves the state of the simulation, so it can be stopped and
+    continued exactly: the spectral fields of the solvers with the
+    gradients history, the grids positions of the moving frame, the
+    particles of the species with their sorting and random generator
+    states, and the iteration of the loop.
+
+    Each checkpoint is one uncompressed numpy archive (".npz") named
+    by the iteration (e.g. "checkpoint_000001000.npz"), where the
+    arrays are named by their owner (e.g. "solver_0/Ex_fb_m0",
+    "species_1/x"). The subdomains of Decomposition write their own
+    files (e.g. "checkpoint_000001000_sub1.npz") in parallel. Files
+    are written under a temporary name and renamed when complete,
+    so an interrupted write does not replace the last checkpoint.
+
+    Example:
+      checkpoint = Checkpoint({'Interval': 2000}, solvers=[solver, ],
+                              species=[eons, ions])
+      loop = PIC_loop(solvers=[solver, ], species=[eons, ions],
+                      frames=[frame, ], diags=[checkpoint, diag])
+
+      if restart:
+          checkpoint.restore(loop)
+      while loop.it < Nsteps:
+          loop.step()
+
+    On the restart, the objects should be created with the same
+    configurations, and the state they got at the initialization
+    (e.g. the laser) is replaced by the restored one.
+"""
+
+import numpy as np
+import os
+import atexit
+
+from .record_writer import RecordWriter
+
+class Checkpoint:
+    def __init__(self, configs_in, solvers=[], species=[],
+                 path='checkpoints'):
+
+        self.Args = configs_in
+        self.solvers = solvers
+        self.species = species
+
+        self.path = os.getcwd() + '/' + path + '/'
+
+        self._process_configs()
+
+        if os.path.exists(self.path) == False:
+            os.makedirs(self.path, exist_ok=True)
+
+        # checkpoint of the restored iteration is not written again
+        self.it_last = None
+
+        # as in Diagnostics, the data is copied from the device without
+        # blocking, and in the asynchronous mode the file is written in
+        # the background. Only one checkpoint may wait for the writer,
+        # since the buffers hold a copy of the whole state
+        self._writer = RecordWriter(self._write_record,
+                                    asynchronous=self.Args['Asynchronous'],
+                                    max_pending=1)
+        if self.Args['Asynchronous']:
+            atexit.register(self.finish)
+
+    def _process_configs(self):
+        if 'Interval' not in self.Args:
+            self.Args['Interval'] = None
+
+        if 'Asynchronous' not in self.Args:
+            self.Args['Asynchronous'] = True
+
+        # number of the last checkpoints kept (all with None)
+        if 'Keep' not in self.Args:
+            self.Args['Keep'] = 2
+        if self.Args['Keep'] is not None and self.Args['Keep'] < 1:
+            print("Keep {} is less than 1, the last checkpoint is kept".
+                  format(self.Args['Keep']))
+            self.Args['Keep'] = 1
+
+    def make_record(self, it):
+        self._writer.raise_error()
+        if self.Args['Interval'] is None \
+          or np.mod(it, self.Args['Interval']) != 0:
+            return
+        self.write(it)
+
+    def write(self, it):
+        """
+        Save the state of the simulation at the iteration it, i.e.
+        before the loop makes the step it
+        """
+        if it == self.it_last:
+            return
+
+        self.record = self._writer.new_record(it)
+        self.record['data'] = {'iteration': np.array(it)}
+
+        for i_obj, obj in enumerate(self.solvers + self.species):
+            if i_obj < len(self.solvers):
+                owner = 'solver_' + str(i_obj) + '/'
+            else:
+                owner = 'species_' + str(i_obj-len(self.solvers)) + '/'
+
+            state_dev, state_host = obj.get_state()
+            for key in state_dev.keys():
+                self.record['data'][owner + key] = self._writer.stage(
+                    self.record, obj, owner + key, state_dev[key])
+            for key in state_host.keys():
+                self.record['data'][owner + key] = np.array(state_host[key])
+
+        # spectral fields current for the diagnostics of this iteration
+        for i_solver, solver in enumerate(self.solvers):
+            owner = 'solver_' + str(i_solver) + '/'
+            state = solver.fields_state
+            if state['it'] == it and \
+              all(part in self.species for part in state['species']):
+                self.record['data'][owner + 'fields_current'] = \
+                    np.array(state['fb'], dtype=str)
+                self.record['data'][owner + 'fields_species'] = np.array(
+                    [self.species.index(part) for part in state['species']],
+                    dtype=np.int64)
+
+        self.it_last = it
+        self._writer.submit(self.record)
+
+    def finish(self):
+        """
+        Wait until all checkpoints are written
+        """
+        self._writer.finish()
+
+    def restore(self, loop=None, it=None):
+        """
+        Load the state of the simulation from the checkpoint of the
+        iteration it (the last one if None), set the iteration of the
+        loop, and return it
+        """
+        self.finish()
+
+        if it is None:
+            its = self.list_iterations()
+            if len(its) == 0:
+                raise FileNotFoundError("No checkpoints in " + self.path)
+            it = its[-1]
+
+        states = {}
+        with np.load(self._get_fname(it)) as data:
+            for key in data.files:
+                if '/' not in key:
+                    continue
+                owner, arg = key.split('/', 1)
+                if owner not in states:
+                    states[owner] = {}
+                states[owner][arg] = data[key]
+
+        for i_solver, solver in enumerate(self.solvers):
+            state = states['solver_' + str(i_solver)]
+            solver.set_state(state)
+
+            if 'fields_current' in state:
+                species = [self.species[i_part]
+                           for i_part in state['fields_species']]
+                solver.mark_fields(list(state['fields_current']), 'fb', it,
+                                   species=species)
+            else:
+                solver.mark_fields([], 'fb', it)
+
+        for i_part, part in enumerate(self.species):
+            part.set_state(states['species_' + str(i_part)])
+
+        self.it_last = it
+        if loop is not None:
+            loop.it = it
+        return it
+
+    def list_iterations(self):
+        """
+        Get the sorted iterations of the complete checkpoints
+        """
+        its = []
+        for fname in os.listdir(self.path):
+            it_str = fname[len('checkpoint_'):][:9]
+            if not it_str.isdigit():
+                continue
+            if self.path + fname == self._get_fname(int(it_str)):
+                its.append(int(it_str))
+        return sorted(its)
+
+    def _get_fname(self, it):
+        it_str = str(it)
+        while len(it_str)<9: it_str = '0' + it_str
+
+        fname = self.path + 'checkpoint_' + it_str
+        if len(self.solvers) > 0 and 'Subdomain' in self.solvers[0].Args:
+            fname += '_sub' + str(self.solvers[0].Args['Subdomain'])
+        return fname + '.npz'
+
+    def _write_record(self, record):
+        # called by the writer when the copies of the record are complete
+        fname = self._get_fname(record['iteration'])
+        with open(fname + '.tmp', 'wb') as file:
+            np.savez(file, **record['data'])
+        os.replace(fname + '.tmp', fname)
+
+        if self.Args['Keep'] is not None:
+            its = self.list_iterations()
+            for it in its[:max(len(its) - self.Args['Keep'], 0)]:
+                os.remove(self._get_fname(it))
@@ -0,0 +1,231 @@
+import numpy as np
+from threading import Thread, Barrier
+from pyopencl import wait_for_events
+
+# coordinates limits of the particles owned by the edge subdomains
+x_lim = np.finfo(np.double).max
+
+
+class Decomposition:
+    """
+    Longitudinal decomposition of the grid and particles into Nsub
+    subdomains, each simulated by its own Solver and Particles on its
+    own device. The neighbour subdomains overlap by 2*Guards cells,
+    where the deposited sources are summed and the fields of the guard
+    cells are taken from the neighbour, so the spectral solve is local.
+    Subdomains are run by the threads of one process ('threads'), or
+    by the processes of MPI ('MPI', requires mpi4py).
+
+    Example:
+      decomp = Decomposition({'Nsub': 2, 'Guards': 32})
+
+      def run_subdomain(rank):
+          comm = Communicator(answers=[0, rank])
+          solver = Solver(decomp.split_configs(grid_in, rank), comm)
+          ...
+          loop = PIC_loop(solvers=[solver, ], species=species,
+                          frames=[frame, ])
+
+      decomp.run(run_subdomain)
+    """
+    def __init__(self, configs_in):
+        self._process_configs(configs_in)
+
+        if self.Args['Transport'] == 'MPI':
+            # mpi4py is an optional dependency used only here
+            try:
+                from mpi4py.MPI import COMM_WORLD
+            except ImportError:
+                raise ImportError("Transport 'MPI' requires mpi4py")
+            self.comm_mpi = COMM_WORLD
+            self.Args['Nsub'] = COMM_WORLD.size
+        else:
+            self._barrier = Barrier(self.Args['Nsub'])
+            self._mail = {}
+
+    def _process_configs(self, configs_in):
+        self.Args = configs_in
+
+        if 'Nsub' not in self.Args:
+            self.Args['Nsub'] = 1
+
+        if 'Guards' not in self.Args:
+            self.Args['Guards'] = 32
+
+        if 'Transport' not in self.Args:
+            self.Args['Transport'] = 'threads'
+        if self.Args['Transport'] not in ['threads', 'MPI']:
+            print("Transport {} is not known, 'threads' is used".
+                  format(self.Args['Transport']))
+            self.Args['Transport'] = 'threads'
+
+    def run(self, target):
+        """
+        Run the function target(rank) for all subdomains, as the
+        threads or as the MPI process of this rank
+        """
+        if self.Args['Transport'] == 'MPI':
+            target(self.comm_mpi.rank)
+            return
+
+        threads = [Thread(target=target, args=(rank, ))
+                   for rank in range(self.Args['Nsub'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def split_configs(self, configs_in, rank):
+        """
+        Get the grid configurations of the subdomain from the global
+        ones. The nodes are split evenly, and the subdomain is extended
+        by Guards nodes on the sides with the neighbours
+        """
+        Nsub = self.Args['Nsub']
+        G = self.Args['Guards']
+        Nx = configs_in['Nx']
+        dx = (configs_in['Xmax'] - configs_in['Xmin']) / (Nx - 1)
+
+        ix_min = (rank * Nx) // Nsub - G * (rank > 0)
+        ix_max = ((rank+1) * Nx) // Nsub + G * (rank < Nsub-1)
+
+        configs = dict(configs_in)
+        configs['Nx'] = ix_max - ix_min
+        configs['Xmin'] = configs_in['Xmin'] + ix_min * dx
+        configs['Xmax'] = configs['Xmin'] + (configs['Nx'] - 1) * dx
+        configs['Decomposition'] = self
+        configs['Subdomain'] = rank
+        return configs
+
+    def get_guards(self, grid):
+        # numbers of the guard nodes on the left and right
+        rank = grid.Args['Subdomain']
+        G = self.Args['Guards']
+        return G * (rank > 0), G * (rank < self.Args['Nsub']-1)
+
+    def is_right_edge(self, grid):
+        return grid.Args['Subdomain'] == self.Args['Nsub'] - 1
+
+    def get_own_limits(self, grid):
+        """
+        Get the interval of the coordinates of the particles owned by
+        the subdomain, which follows the grid
+        """
+        G_l, G_r = self.get_guards(grid)
+        xmin, xmax = -x_lim, x_lim
+
+        if G_l > 0:
+            xmin = grid.Args['Xmin'] + G_l * grid.Args['dx']
+        if G_r > 0:
+            xmax = grid.Args['Xmin'] + (grid.Args['Nx']-G_r) \
+                   * grid.Args['dx']
+        return xmin, xmax
+
+    def exchange_sources(self, grid, flds=['rho', 'J']):
+        """
+        Sum the deposited sources (real space fields, e.g. after
+        depose_charge) in the nodes shared with the neighbours
+        """
+        flds_m = []
+        for fld in flds:
+            comps = [''] if fld == 'rho' else grid.Args['vec_comps']
+            for comp in comps:
+                for m in range(grid.Args['M']+1):
+                    flds_m.append(grid.DataDev[fld + comp + '_m' + str(m)])
+
+        G_l, G_r = self.get_guards(grid)
+        Nx = grid.Args['Nx']
+
+        self._exchange_columns(grid, flds_m,
+                               send=[(0, 2*G_l), (Nx-2*G_r, 2*G_r)],
+                               recv=[(0, 2*G_l), (Nx-2*G_r, 2*G_r)],
+                               add=True)
+
+    def exchange_guards(self, grid, stack):
+        """
+        Replace the guard nodes of the fields (with x along the last
+        axis of the stack) by the neighbour values
+        """
+        G_l, G_r = self.get_guards(grid)
+        Nx = grid.Args['Nx']
+
+        self._exchange_columns(grid, [stack, ],
+                               send=[(G_l, G_l), (Nx-2*G_r, G_r)],
+                               recv=[(0, G_l), (Nx-G_r, G_r)])
+
+    def _exchange_columns(self, grid, arrs, send, recv, add=False):
+        # columns (ix0, ncols) of all arrays sent to and received from
+        # the left and right neighbours are packed into one device
+        # buffer per side, and each buffer is copied to the host and
+        # back by a single transfer. Both copies to the host are
+        # enqueued before the host waits for them
+        G_l, G_r = self.get_guards(grid)
+
+        to_sides, evnts = [None, None], []
+        for side, G in enumerate((G_l, G_r)):
+            if G == 0:
+                continue
+            buff = grid.pack_columns(arrs, *send[side])
+            to_sides[side] = np.empty(buff.size, dtype=np.double)
+            evnts.append(grid.get_async(buff, to_sides[side]))
+        wait_for_events(evnts)
+
+        from_sides = self.sendrecv(grid.Args['Subdomain'], *to_sides)
+
+        for side, data in enumerate(from_sides):
+            if data is None:
+                continue
+            buff = grid.dev_arr(dtype=np.double, shape=data.shape)
+            grid.set_from_host(buff, data)
+            grid.unpack_columns(arrs, buff, *recv[side], add=add)
+
+    def migrate_particles(self, species, grid):
+        """
+        Move the particles, which left the subdomain, to the
+        neighbours. The species lists of all subdomains should
+        follow the same order
+        """
+        xmin, xmax = self.get_own_limits(grid)
+
+        to_left, to_right = [], []
+        for parts in species:
+            data_left, data_right = parts.extract_parts(xmin, xmax)
+            to_left.append(data_left)
+            to_right.append(data_right)
+
+        from_left, from_right = self.sendrecv(grid.Args['Subdomain'],
+                                              to_left, to_right)
+
+        for data_sides in (from_left, from_right):
+            if data_sides is None:
+                continue
+            for parts, data in zip(species, data_sides):
+                parts.insert_parts(data)
+
+    def sendrecv(self, rank, to_left, to_right):
+        """
+        Send the data to the left and right neighbours, and get the
+        data from them (None on the edges of the domain)
+        """
+        Nsub = self.Args['Nsub']
+        from_left, from_right = None, None
+
+        if self.Args['Transport'] == 'MPI':
+            if rank > 0:
+                from_left = self.comm_mpi.sendrecv(to_left, dest=rank-1,
+                                                   source=rank-1)
+            if rank < Nsub-1:
+                from_right = self.comm_mpi.sendrecv(to_right, dest=rank+1,
+                                                    source=rank+1)
+            return from_left, from_right
+
+        # the data is posted by all threads before it is read,
+        # and read by all before it is posted again
+        self._mail[rank] = (to_left, to_right)
+        self._barrier.wait()
+        if rank > 0:
+            from_left = self._mail[rank-1][1]
+        if rank < Nsub-1:
+            from_right = self._mail[rank+1][0]
+        self._barrier.wait()
+        return from_left, from_right
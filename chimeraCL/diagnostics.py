@@ -7,6 +7,14 @@
         position of a given species in the list of species=[])
       - complementary simulation information is in "/data/info/"
 
+    With Layout='files' each record is a file named by the iteration,
+    and with Layout='series' all records are the groups of one file
+    "series.h5", where the iteration is added to the path (e.g.
+    "/data/1000/fields/rho"). Datasets can be compressed ('gzip' or
+    'lzf', and chunked by the field components), and with Append=True
+    the existing output is kept (e.g. on the restart), while the
+    repeated iterations are overwritten.
+
     NB: Electic and magnetic fields are in dimensionaless units;
         Charge density is normalised to critical density for the
           space normalisation length;
@@ -17,6 +25,11 @@
 import numpy as np
 import h5py
 import os
+import atexit
+from functools import partial
+
+from .methods.particles_methods_cl import part_record_comps
+from .record_writer import RecordWriter
 
 class Diagnostics:
     def __init__(self, configs_in, solver, species=[], frame=None,
@@ -39,12 +52,23 @@ class Diagnostics:
 
         self.path = os.getcwd() + '/' + path + '/'
 
+        self._process_configs()
+
         if os.path.exists(self.path) == False:
             os.makedirs(self.path)
-        else:
+        elif self.Args['Append'] == False:
             for fl in os.listdir(self.path):
                 os.remove(self.path+fl)
 
+        # data is copied from the device without blocking, and in the
+        # asynchronous mode the records are written in the background
+        self._writer = RecordWriter(self._write_record,
+                                    asynchronous=self.Args['Asynchronous'],
+                                    max_pending=self.Args['MaxPending'])
+        if self.Args['Asynchronous']:
+            atexit.register(self.finish)
+
+    def _process_configs(self):
         if 'ScalarFields' not in self.Args:
             self.Args['ScalarFields'] = []
 
@@ -54,88 +78,191 @@ class Diagnostics:
         if 'Species' not in self.Args:
             self.Args['Species'] = {'Components':[],}
 
+        if 'Asynchronous' not in self.Args:
+            self.Args['Asynchronous'] = False
+
+        if 'MaxPending' not in self.Args:
+            self.Args['MaxPending'] = 2
+
+        if 'Layout' not in self.Args:
+            self.Args['Layout'] = 'files'
+        if self.Args['Layout'] not in ['files', 'series']:
+            print("Layout {} is not known, 'files' is used".
+                  format(self.Args['Layout']))
+            self.Args['Layout'] = 'files'
+
+        if 'Append' not in self.Args:
+            self.Args['Append'] = False
+
+        if 'Compression' not in self.Args:
+            self.Args['Compression'] = None
+        if self.Args['Compression'] not in [None, 'gzip', 'lzf']:
+            print("Compression {} is not known, no compression is used".
+                  format(self.Args['Compression']))
+            self.Args['Compression'] = None
+
+        # level of gzip (0-9) and the byte shuffle filter
+        if 'CompressionLevel' not in self.Args:
+            self.Args['CompressionLevel'] = 4
+
+        if 'Shuffle' not in self.Args:
+            self.Args['Shuffle'] = True
+
     def make_record(self, it):
+        self._writer.raise_error()
         if np.mod(it, self.Args['Interval']) != 0:
             return
 
-        it_str = str(it)
-        while len(it_str)<9: it_str = '0' + it_str
-
-        self.record = h5py.File(self.path + it_str + '.h5', 'w')
-
-        self.record[self.base_str + self.info_str + 'iteration'] = it
+        self.record = self._writer.new_record(it)
+        self.record['writers'] = []
 
         self.add_generic_info()
 
-        for fld in self.Args['ScalarFields']:
-            self.add_field(fld)
-
+        flds = list(self.Args['ScalarFields'])
         for fld in self.Args['VectorFields']:
             for comp in ['x', 'y', 'z']:
-                self.add_field(fld+comp)
+                flds.append(fld+comp)
+
+        # fields are deposited and transformed only if they are
+        # not current for this iteration
+        self.solver.update_fields(flds, it, species=self.species)
+        for fld in flds:
+            self.add_field(fld)
 
         self.add_species()
-        self.record.close()
+        self._writer.submit(self.record)
+
+    def finish(self):
+        """
+        Wait until all records are written
+        """
+        self._writer.finish()
 
     def add_species(self):
         for species_index in np.arange(len(self.species)):
             part = self.species[species_index]
             specie_name = 'species_' + str(species_index) + '/'
-            h5_path = self.base_str + self.parts_str + specie_name
+            h5_path = self.parts_str + specie_name
+
             if 'Selections' in self.Args['Species']:
-                select_mask = np.ones(part.Args['Np'], dtype=np.uint8)
-                for select in  self.Args['Species']['Selections']:
-                    comp_select, vmin, vmax = select
-                    comp_val = part.DataDev[comp_select].get()
-                    if vmin is not None:
-                        select_mask *= (comp_val>vmin).astype(np.uint8)
-                    if vmax is not None:
-                        select_mask *= (comp_val<vmax).astype(np.uint8)
-                indx = np.nonzero(select_mask)
+                selections = self.Args['Species']['Selections']
             else:
-                indx = None
+                selections = []
 
-            for part_comp in self.Args['Species']['Components']:
-                if part.Args['Np']==0:
-                    comp_vals = np.array([], dtype=self.dtype_parts)
-                elif indx is None:
-                    comp_vals = part.DataDev[part_comp].\
-                        get().astype(self.dtype_parts)
-                else:
-                    comp_vals = part.DataDev[part_comp].\
-                        map_to_host()[indx].astype(self.dtype_parts)
+            comps = self.Args['Species']['Components']
 
-                if part_comp =='w':
-                    comp_vals *= self.dtype_parts(self.Args['w2pC'])
+            if part.Args['Np'] == 0:
+                comps_host = None
+            elif len(selections) > 0:
+                # selected particles are compacted on the device
+                data_sel = self._stage(part, specie_name + 'selected',
+                    part.select_parts(comps, selections))
+                comps_host = {comp: data_sel[i_comp]
+                              for i_comp, comp in enumerate(comps)}
+            elif part.Args['Layout'] == 'AoS':
+                # packed records are copied at once
+                Nc = len(part_record_comps)
+                recs = self._stage(part, specie_name + 'rec',
+                                   part.DataDev['rec']).reshape(-1, Nc)
+                comps_host = {comp: recs[:, part_record_comps.index(comp)]
+                              for comp in comps}
+            else:
+                comps_host = {comp: self._stage(part, specie_name + comp,
+                                                part.DataDev[comp])
+                              for comp in comps}
 
-                self.record[h5_path+part_comp] = comp_vals
+            self.record['writers'].append(partial(self._write_species,
+                h5_path, comps_host, part.Args['w2pC']))
 
     def add_generic_info(self):
-        h5_path = self.base_str + self.info_str
+        h5_path = self.info_str
+        info = {'iteration': self.record['iteration']}
         for key in self.generic_keys:
-            self.record[h5_path + key] = self.solver.Args[key]
+            info[key] = np.copy(self.solver.Args[key])
         if self.frame is None:
-            self.record[h5_path + 'FrameVelocity'] = 0.
+            info['FrameVelocity'] = 0.
         else:
-            self.record[h5_path + 'FrameVelocity'] = self.frame.Args['Velocity']
+            info['FrameVelocity'] = self.frame.Args['Velocity']
+
+        self.record['writers'].append(partial(self._write_values,
+                                              h5_path, info))
 
     def add_field(self, fld):
-        h5_path = self.base_str + self.flds_str + fld
+        h5_path = self.flds_str + fld
+
+        fld_modes = []
+        for m in range(self.solver.Args['M']+1):
+            fld_arg = fld + '_m' + str(m)
+            fld_modes.append(self._stage(self.solver, fld_arg,
+                                         self.solver.DataDev[fld_arg]))
+
+        self.record['writers'].append(partial(self._write_field,
+                                              h5_path, fld_modes))
 
-        if fld=='rho' or fld[0]=='J':
-            self.solver.depose_charge(self.species)
-            self.solver.fb_transform(scals=[fld, ], dir=0)
-            self.solver.fields_smooth(flds=[fld, ])
+    def _stage(self, owner, name, arr):
+        return self._writer.stage(self.record, owner, name, arr)
 
-        self.solver.fb_transform(scals=[fld, ], dir=1)
+    def _write_record(self, record):
+        # called by the writer when the copies of the record are complete
+        if self.Args['Layout'] == 'series':
+            fname = self.path + 'series.h5'
+            file_mode = 'a'
+            group_str = self.base_str + str(record['iteration'])
+        else:
+            it_str = str(record['iteration'])
+            while len(it_str)<9: it_str = '0' + it_str
+            fname = self.path + it_str + '.h5'
+            file_mode = 'w'
+            group_str = self.base_str
+
+        with h5py.File(fname, file_mode) as h5_file:
+            if group_str in h5_file:
+                del h5_file[group_str]
+            h5_group = h5_file.create_group(group_str)
+            for writer in record['writers']:
+                writer(h5_group)
+
+    def _create_dataset(self, h5_group, h5_path, shape, dtype,
+                        chunks=True, data=None):
+        # filters require chunks, and the empty datasets are not filtered
+        opts = {}
+        if self.Args['Compression'] is not None and np.prod(shape) > 0:
+            opts['chunks'] = chunks
+            opts['compression'] = self.Args['Compression']
+            opts['shuffle'] = self.Args['Shuffle']
+            if self.Args['Compression'] == 'gzip':
+                opts['compression_opts'] = self.Args['CompressionLevel']
+
+        return h5_group.create_dataset(h5_path, shape, dtype,
+                                       data=data, **opts)
 
-        fld_m = self.solver.DataDev[fld + '_m0'].get()[None,:] # mod
-        fld_stack = [fld_m.astype(self.dtype_flds), ]
+    def _write_values(self, h5_path, values, h5_group):
+        for key in values.keys():
+            h5_group[h5_path + key] = values[key]
+
+    def _write_field(self, h5_path, fld_modes, h5_group):
+        # modes are written into the components [m0, m1.real, m1.imag, ...]
+        # one by one, and each of them is a chunk
+        Nr, Nx = fld_modes[0].shape
+        fld_set = self._create_dataset(h5_group, h5_path,
+                                       (2*len(fld_modes)-1, Nr, Nx),
+                                       self.dtype_flds, chunks=(1, Nr, Nx))
+
+        fld_set[0] = fld_modes[0]
+        for m, fld_m in enumerate(fld_modes[1:]):
+            fld_set[2*m+1] = fld_m.real
+            fld_set[2*m+2] = fld_m.imag
+
+    def _write_species(self, h5_path, comps_host, w2pC, h5_group):
+        for part_comp in self.Args['Species']['Components']:
+            if comps_host is None:
+                comp_vals = np.array([], dtype=self.dtype_parts)
+            else:
+                comp_vals = comps_host[part_comp].astype(self.dtype_parts)
 
-        for m in range(1, self.solver.Args['M']+1, 1):
-            fld_m = self.solver.DataDev[fld + '_m' + str(m)]\
-                    .get()[None,:] # mod
-            fld_stack.append(fld_m.real.astype(self.dtype_flds))
-            fld_stack.append(fld_m.imag.astype(self.dtype_flds))
+            if part_comp =='w':
+                comp_vals *= self.dtype_parts(w2pC)
 
-        self.record[h5_path] = np.concatenate(fld_stack, axis=0)
+            self._create_dataset(h5_group, h5_path+part_comp,
+                                 comp_vals.shape, self.dtype_parts,
+                                 data=comp_vals)
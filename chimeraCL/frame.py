@@ -30,7 +30,12 @@ class Frame():
                     store[arg] += x_shift
 
     def inject_plasma(self, species, grid, steps=None):
-
+        """
+        Add the plasma to the right of the species. The particles
+        are generated on the device after the present ones, and then
+        all particles are sorted on the shifted grid, so the ones which
+        left it are removed.
+        """
         if steps is None:
             steps = self.Args['Steps']
         x_shift = steps * self.Args['dt'] * self.Args['Velocity']
@@ -39,26 +44,31 @@ class Frame():
             if specie.Args['Np'] == 0:
                 specie.Args['right_lim'] = grid.Args['Xmax'] - x_shift
 
+            # with the decomposition, plasma enters the rightmost subdomain
+            if 'Decomposition' in grid.Args and \
+              not grid.Args['Decomposition'].is_right_edge(grid):
+                continue
+
             inject_domain = {}
             inject_domain['Xmin'] = specie.Args['right_lim']
-            inject_domain['Xmax'] = inject_domain['Xmin'] + x_shift
+            # particles are sorted only below the last cell of the grid
+            inject_domain['Xmax'] = grid.Args['Xmax'] - grid.Args['dx']
             inject_domain['Rmin'] = grid.Args['Rmin']*(grid.Args['Rmin']>0)
             inject_domain['Rmax'] = grid.Args['Rmax']
 
-            specie.make_new_domain(inject_domain,
-                density_profiles=self.Args['DensityProfiles'])
-
             if 'InjectorSource' in specie.Args.keys():
-                specie.add_new_particles(specie.Args['InjectorSource'])
+                source = specie.Args['InjectorSource']
             else:
-                specie.add_new_particles()
+                source = None
 
+            specie.inject_new_domain(inject_domain,
+                density_profiles=self.Args['DensityProfiles'],
+                source=source)
+
+        # particles outside the shifted grid are removed by the sorting,
+        # which is needed also for the species without injection
         for specie in species:
             specie.free_added()
+            specie.flag_sorted = False
             specie.sort_parts(grid=grid)
             specie.align_parts()
-
-            Num_ppc = np.int32(np.prod(specie.Args['Nppc'])+1)
-            x_max = specie.DataDev['x'][-Num_ppc:].get().max()
-
-            specie.Args['right_lim'] = x_max + 0.5*specie.Args['ddx']
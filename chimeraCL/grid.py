@@ -25,6 +25,8 @@ class Grid(GridMethodsCL):
             self.set_to(self.DataDev['rho_m'+str(m)], 0)
 
         for parts in species:
+            if parts.Args['Np'] == 0:
+                continue
             self.depose_scalar(parts, 'w', 'rho',
                                charge=parts.Args['charge'])
 
@@ -45,7 +47,7 @@ class Grid(GridMethodsCL):
             self.set_to(self.DataDev[arg], 0)
 
         for parts in species:
-            if 'Immobile' in parts.Args.keys():
+            if 'Immobile' in parts.Args.keys() or parts.Args['Np'] == 0:
                 continue
             self.depose_vector(parts, momentum_args_str,
                                ['g_inv', 'w'], 'J',
@@ -60,7 +62,7 @@ class Grid(GridMethodsCL):
 
         for parts in species:
 
-            if 'Immobile' in parts.Args.keys():
+            if 'Immobile' in parts.Args.keys() or parts.Args['Np'] == 0:
                 continue
 
             self._gather_and_push(parts, ['E', 'B'])
@@ -97,9 +99,53 @@ class Grid(GridMethodsCL):
         self.Args['NxNr'] = self.Args['Nr'] * self.Args['Nx']
         self.Args['Nxm1Nrm1'] = (self.Args['Nr']-1) * (self.Args['Nx']-1)
         self.Args['NxNrm1'] = (self.Args['Nr']-1) * self.Args['Nx']
-        self.Args['NxNr_4'] = (self.Args['Nr'])//2 * (self.Args['Nx'])//2
 
-        self.Args['dont_send'] = []
+        # particles shapes of the order 1 (linear), 2 (quadratic) or
+        # 3 (cubic) are projected onto ShapeNodes nodes in each direction
+        # starting from the node ShapeOffset relative to the particle cell
+        if 'ShapeOrder' not in self.Args:
+            self.Args['ShapeOrder'] = 1
+        if self.Args['ShapeOrder'] not in [1, 2, 3]:
+            raise ValueError("ShapeOrder {} is not supported, use 1, 2 "
+                             "or 3".format(self.Args['ShapeOrder']))
+
+        if self.Args['ShapeOrder'] == 1:
+            self.Args['ShapeNodes'] = 2
+            self.Args['ShapeOffset'] = 0
+        else:
+            self.Args['ShapeNodes'] = 4
+            self.Args['ShapeOffset'] = -1
+
+        # cells are deposed in turns within the groups of
+        # ShapeNodes x ShapeNodes cells
+        self.Args['NxNr_4'] = \
+            int(np.ceil(self.Args['Nr'] / self.Args['ShapeNodes'])) * \
+            int(np.ceil(self.Args['Nx'] / self.Args['ShapeNodes']))
+
+        # tile-based deposition uses work-groups of TileNr x TileNx cells,
+        # and the tiles are extended by TileGL nodes below and on the left
+        # and TileGU nodes above and on the right
+        if 'DepositTiles' not in self.Args:
+            self.Args['DepositTiles'] = True
+
+        self.Args['TileNx'] = min(16, self.WGS)
+        self.Args['TileNr'] = self.WGS // self.Args['TileNx']
+        self.Args['NTilesX'] = int(np.ceil((self.Args['Nx']-1) \
+                                           / self.Args['TileNx']))
+        self.Args['NTilesR'] = int(np.ceil((self.Args['Nr']-1) \
+                                           / self.Args['TileNr']))
+
+        self.Args['TileGL'] = -self.Args['ShapeOffset']
+        self.Args['TileGU'] = self.Args['ShapeNodes'] - 1 \
+                              + self.Args['ShapeOffset']
+        tile_ghosts = self.Args['TileGL'] + self.Args['TileGU']
+        self.Args['TileHalo'] = tile_ghosts * (self.Args['TileNx'] + \
+            tile_ghosts + self.Args['TileNr'])
+
+        self.Args['dont_send'] = ['TileNx', 'TileNr', 'NTilesX', 'NTilesR',
+                                  'TileGL', 'TileGU', 'TileHalo',
+                                  'ShapeOrder', 'ShapeNodes', 'ShapeOffset',
+                                  'Subdomain']
         self.Args['dont_keep'] = []
 
 
@@ -125,3 +171,21 @@ class Grid(GridMethodsCL):
                 self.DataDev[arg+str(m)] = self.dev_arr(
                     val=0, dtype=np.complex128,
                     shape=(self.Args['Nr'], self.Args['Nx']))
+
+        if self.Args['DepositTiles']:
+            self._init_tiles_halo_on_dev(['rho', ] + \
+                ['J' + comp for comp in self.Args['vec_comps']])
+
+    def _init_tiles_halo_on_dev(self, flds_str):
+        halo_shape = (self.Args['NTilesR'] * self.Args['NTilesX'],
+                      self.Args['TileHalo'])
+
+        # halos follow the fields precision (see fld_precision_types)
+        for arg in flds_str:
+            arg += '_m'
+            self.DataDev[arg+'0_halo'] = self.dev_arr(
+                dtype=self.fld_dtype, shape=halo_shape)
+
+            for m in range(1, self.Args['M']+1):
+                self.DataDev[arg+str(m)+'_halo'] = self.dev_arr(
+                    dtype=self.fld_cdtype, shape=halo_shape)
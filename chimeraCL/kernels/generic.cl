@@ -98,10 +98,11 @@ __kernel void ab_dot_x(
    }
 }
 
-// Cast a double-type array to a complex-type one
+// Cast a complex-type array to a double-type one
+// (used on the stacks of fields, see transformer_generic.cl)
 __kernel void cast_array_d2c(
-  __global double2 *arr_in,
-  __global double *arr_out,
+  __global FLD_REAL2 *arr_in,
+  __global FLD_REAL *arr_out,
            uint arr_size)
 {
   uint i_cell = (uint) get_global_id(0);
@@ -110,3 +111,183 @@ __kernel void cast_array_d2c(
     arr_out[i_cell] = arr_in[i_cell].s0;
    }
 }
+
+// Cast a double-type array to a complex-type one
+// (used on the stacks of fields)
+__kernel void cast_array_r2c(
+  __global FLD_REAL *arr_in,
+  __global FLD_REAL2 *arr_out,
+           uint arr_size)
+{
+  uint i_cell = (uint) get_global_id(0);
+  if (i_cell < arr_size)
+   {
+    arr_out[i_cell].s0 = arr_in[i_cell];
+    arr_out[i_cell].s1 = 0.0;
+   }
+}
+
+// Copy the columns [ix0, ix0+ncols) of the array made of the rows
+// of Nx elements into a contiguous buffer starting from buff_offset
+__kernel void get_columns(
+  __global double *arr,
+  __global double *buff,
+           uint Nx,
+           uint ix0,
+           uint ncols,
+           uint buff_size,
+           uint buff_offset)
+{
+  uint i_cell = (uint) get_global_id(0);
+  if (i_cell < buff_size)
+   {
+    uint irow = i_cell/ncols;
+    uint ix = i_cell - irow*ncols;
+    buff[buff_offset + i_cell] = arr[irow*Nx + ix0 + ix];
+   }
+}
+
+// Write (add=0) or add (add=1) the contiguous buffer starting from
+// buff_offset to the columns [ix0, ix0+ncols) of the array made of
+// the rows of Nx elements
+__kernel void set_columns(
+  __global double *arr,
+  __global double *buff,
+           uint Nx,
+           uint ix0,
+           uint ncols,
+           uint buff_size,
+           uint buff_offset,
+           uint add)
+{
+  uint i_cell = (uint) get_global_id(0);
+  if (i_cell < buff_size)
+   {
+    uint irow = i_cell/ncols;
+    uint ix = i_cell - irow*ncols;
+    uint i_arr = irow*Nx + ix0 + ix;
+    double val = buff[buff_offset + i_cell];
+    if (add == 1)
+      {
+        arr[i_arr] += val;
+      }
+    else
+      {
+        arr[i_arr] = val;
+      }
+   }
+}
+
+// Add the squared modules of the double-type field of Nr rows and
+// Nx columns summed along the rows with the weights:
+// out[ix] += factor * sum_ir weights[ir]*fld[ir, ix]^2
+__kernel void sum_sq_cols_d(
+  __global double *fld,
+  __global double *weights,
+  __global double *out,
+           double factor,
+           uint Nx,
+           uint Nr)
+{
+  uint ix = (uint) get_global_id(0);
+  if (ix < Nx)
+   {
+    double sum = 0.0;
+    for (uint ir=0; ir<Nr; ir++)
+     {
+      double f = fld[ir*Nx + ix];
+      sum += weights[ir] * f * f;
+     }
+    out[ix] += factor * sum;
+   }
+}
+
+// Same as sum_sq_cols_d for the complex-type field
+__kernel void sum_sq_cols_c(
+  __global double2 *fld,
+  __global double *weights,
+  __global double *out,
+           double factor,
+           uint Nx,
+           uint Nr)
+{
+  uint ix = (uint) get_global_id(0);
+  if (ix < Nx)
+   {
+    double sum = 0.0;
+    for (uint ir=0; ir<Nr; ir++)
+     {
+      double2 f = fld[ir*Nx + ix];
+      sum += weights[ir] * (f.s0*f.s0 + f.s1*f.s1);
+     }
+    out[ix] += factor * sum;
+   }
+}
+
+// Partial histograms of the values with the weights, which each
+// work-group accumulates over the chunks of BLOCK_SIZE elements into
+// its row hist[i_grp, :]. The bins of a chunk are staged in the local
+// memory, and each bin is accumulated by one work-item, so the sums
+// need no atomics and follow a fixed order
+__kernel void histogram_w(
+  __global double *vals,
+  __global double *weights,
+  __global double *hist,
+  __local uint *bins_loc,
+  __local double *w_loc,
+  __local double *hist_loc,
+           double vmin,
+           double dv_inv,
+           uint num_bins,
+           uint num_p)
+{
+  uint i_loc = (uint) get_local_id(0);
+  uint i_grp = (uint) get_group_id(0);
+  uint n_grp = (uint) get_num_groups(0);
+
+  for (uint ib=i_loc; ib<num_bins; ib+=BLOCK_SIZE) {hist_loc[ib] = 0.0;}
+
+  for (uint ip0=i_grp*BLOCK_SIZE; ip0<num_p; ip0+=n_grp*BLOCK_SIZE)
+   {
+    uint ip = ip0 + i_loc;
+    bins_loc[i_loc] = num_bins;
+    if (ip < num_p)
+     {
+      double bin = (vals[ip] - vmin) * dv_inv;
+      if (bin >= 0.0 && bin < num_bins)
+       {
+        bins_loc[i_loc] = (uint) bin;
+        w_loc[i_loc] = weights[ip];
+       }
+     }
+    barrier(CLK_LOCAL_MEM_FENCE);
+
+    for (uint i=0; i<BLOCK_SIZE; i++)
+     {
+      uint ib = bins_loc[i];
+      if (ib < num_bins && ib % BLOCK_SIZE == i_loc) {hist_loc[ib] += w_loc[i];}
+     }
+    barrier(CLK_LOCAL_MEM_FENCE);
+   }
+
+  for (uint ib=i_loc; ib<num_bins; ib+=BLOCK_SIZE)
+   {
+    hist[i_grp*num_bins + ib] = hist_loc[ib];
+   }
+}
+
+// Sum the rows of the array of nrows rows and ncols columns
+__kernel void sum_rows_d(
+  __global double *arr,
+  __global double *out,
+           uint ncols,
+           uint nrows)
+{
+  uint icol = (uint) get_global_id(0);
+  if (icol < ncols)
+   {
+    double sum = 0.0;
+    for (uint irow=0; irow<nrows; irow++) {sum += arr[irow*ncols + icol];}
+    out[icol] = sum;
+   }
+}
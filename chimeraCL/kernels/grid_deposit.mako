@@ -0,0 +1,757 @@
+/// this is a source of grid kernels for chimeraCL project
+/// generated for the azimuthal modes m=0..${M} and the particle shape
+/// of the order ${order}, which is projected onto S=${S} nodes in each
+/// direction starting from the node lo=${lo} relative to the particle cell
+/// (see grid_methods_cl.py)
+
+## declare mode-resolved private cell arrays
+<%def name="cell_arrays(name, dims)">\
+    double ${name}_m0${dims}[${S}][${S}];
+% for m in range(1, M+1):
+    double ${name}_m${m}${dims}[${S}][${S}][2];
+% endfor
+</%def>
+
+## compute the shape factors s[0..S-1] of a particle at the distance d
+## from its cell origin (normalized to the cell size)
+<%def name="shape_factors(s, d, indent)">\
+% if order == 1:
+${indent}${s}[1] = ${d};
+${indent}${s}[0] = 1.0 - ${s}[1];
+% elif order == 2:
+${indent}{
+${indent}  double d = ${d};
+${indent}  if (d<0.5){
+${indent}    ${s}[0] = 0.5*(0.5-d)*(0.5-d);
+${indent}    ${s}[1] = 0.75 - d*d;
+${indent}    ${s}[2] = 0.5*(0.5+d)*(0.5+d);
+${indent}    ${s}[3] = 0.;
+${indent}  }
+${indent}  else {
+${indent}    ${s}[0] = 0.;
+${indent}    ${s}[1] = 0.5*(1.5-d)*(1.5-d);
+${indent}    ${s}[2] = 0.75 - (1.-d)*(1.-d);
+${indent}    ${s}[3] = 0.5*(d-0.5)*(d-0.5);
+${indent}  }
+${indent}}
+% elif order == 3:
+${indent}{
+${indent}  double d = ${d};
+${indent}  double d1 = 1. - d;
+${indent}  ${s}[0] = d1*d1*d1/6.;
+${indent}  ${s}[1] = (4. - 6.*d*d + 3.*d*d*d)/6.;
+${indent}  ${s}[2] = (4. - 6.*d1*d1 + 3.*d1*d1*d1)/6.;
+${indent}  ${s}[3] = d*d*d/6.;
+${indent}}
+% else:
+<% raise ValueError("Shape order {} is not supported".format(order)) %>
+% endif
+</%def>
+
+## compute the deposition coefficients of the cell nodes; the node
+## below the axis is folded with the sign of treat_axis kernels
+<%def name="deposit_coefficients(indent)">\
+${shape_factors('sX', '( xp - xmin_loc )*dx_inv_loc - ix', indent)}\
+${shape_factors('sR', '( rp - rmin_loc )*dr_inv_loc - ir', indent)}\
+% if lo < 0:
+${indent}if (ir==0){
+${indent}  sR[${1-2*lo}] -= sR[0];
+${indent}  sR[0] = 0.;
+${indent}  }
+% endif
+
+${indent}for (j=0;j<${S};j++){sX[j] *= wp;}
+
+${indent}for (i=0;i<${S};i++){
+${indent}  for (j=0;j<${S};j++){
+${indent}    C_cell[i][j] = sR[i]*sX[j];
+${indent}    }}
+</%def>
+
+## compute exp(i*m*theta) for m>1 from the m=1 values
+<%def name="exp_modes(indent)">\
+% for m in range(2, M+1):
+${indent}exp_m${m}[0] = exp_m${m-1}[0]*exp_m1[0] - exp_m${m-1}[1]*exp_m1[1];
+${indent}exp_m${m}[1] = exp_m${m-1}[0]*exp_m1[1] + exp_m${m-1}[1]*exp_m1[0];
+% endfor
+</%def>
+
+<%def name="exp_decl()">\
+% for m in range(1, M+1):
+    double exp_m${m}[2];
+% endfor
+</%def>
+
+## declare mode-resolved field arguments
+<%def name="scalar_args(suffix='', last=True, real='double')">\
+% for m in range(M+1):
+  __global ${real if m==0 else real+'2'} *scl_m${m}${suffix}${'' if (last and m==M) else ','}
+% endfor
+</%def>
+
+<%def name="vector_args(suffix='', last=True, real='double')">\
+% for m in range(M+1):
+% for comp in ['x', 'y', 'z']:
+  __global ${real if m==0 else real+'2'} *vec_${comp}_m${m}${suffix}${'' if (last and m==M and comp=='z') else ','}
+% endfor
+% endfor
+</%def>
+
+<%def name="scalar_deposit_loop()">\
+    // allocate privitely some reused variables
+    double sX[${S}], sR[${S}];
+    double C_cell[${S}][${S}];
+${exp_decl()}
+    double xp, yp, zp, wp, rp, rp_inv;
+    double rmin_loc = *rmin;
+    double dr_inv_loc = *dr_inv;
+    double xmin_loc = *xmin;
+    double dx_inv_loc = *dx_inv;
+    uint ip_srtd;
+
+    // run over the particles for linear deposition
+    for (uint ip=ip_start; ip<ip_end; ip++){
+
+      ip_srtd = sorting_indx[ip];
+      xp = x[P_IDX(ip_srtd, COMP_X)];
+      yp = y[P_IDX(ip_srtd, COMP_Y)];
+      zp = z[P_IDX(ip_srtd, COMP_Z)];
+      wp = w[P_IDX(ip_srtd, COMP_W)]*charge;
+
+      rp = sqrt(yp*yp + zp*zp);
+% if M > 0:
+
+      rp_inv = 1./rp;
+      exp_m1[0] = yp*rp_inv;
+      exp_m1[1] = zp*rp_inv;
+${exp_modes('      ')}\
+% endif
+
+${deposit_coefficients('      ')}
+      for (i=0;i<${S};i++){
+        for (j=0;j<${S};j++){
+          scl_cell_m0[i][j] += C_cell[i][j];
+% for m in range(1, M+1):
+          scl_cell_m${m}[i][j][0] += C_cell[i][j]*exp_m${m}[0];
+          scl_cell_m${m}[i][j][1] += C_cell[i][j]*exp_m${m}[1];
+% endfor
+          }}
+    }
+</%def>
+
+<%def name="vector_deposit_loop()">\
+    // allocate privitely some reused variables
+    double sX[${S}], sR[${S}];
+    double C_cell[${S}][${S}];
+${exp_decl()}
+    double xp, yp, zp, wp,rp,rp_inv,jp_proj;
+    double jp[3];
+    double rmin_loc = *rmin;
+    double dr_inv_loc = *dr_inv;
+    double xmin_loc = *xmin;
+    double dx_inv_loc = *dx_inv;
+    uint ip_srtd;
+
+    // run over the particles for linear deposition
+    for (uint ip=ip_start; ip<ip_end; ip++)
+     {
+      ip_srtd = sorting_indx[ip];
+      xp = x[P_IDX(ip_srtd, COMP_X)];
+      yp = y[P_IDX(ip_srtd, COMP_Y)];
+      zp = z[P_IDX(ip_srtd, COMP_Z)];
+      jp[0] = ux[P_IDX(ip_srtd, COMP_PX)];
+      jp[1] = uy[P_IDX(ip_srtd, COMP_PY)];
+      jp[2] = uz[P_IDX(ip_srtd, COMP_PZ)];
+      wp = w[P_IDX(ip_srtd, COMP_W)] * g_inv[P_IDX(ip_srtd, COMP_G_INV)]
+           * charge;
+
+      rp = sqrt(yp*yp + zp*zp);
+% if M > 0:
+
+      rp_inv = 0;
+      if (rp>0){rp_inv = 1./rp;}
+
+      exp_m1[0] = yp*rp_inv;
+      exp_m1[1] = zp*rp_inv;
+${exp_modes('      ')}\
+% endif
+
+${deposit_coefficients('      ')}
+      for (k=0;k<3;k++){
+        for (i=0;i<${S};i++){
+          for (j=0;j<${S};j++){
+            jp_proj = C_cell[i][j]*jp[k];
+            vec_cell_m0[k][i][j] += jp_proj;
+% for m in range(1, M+1):
+            vec_cell_m${m}[k][i][j][0] += jp_proj*exp_m${m}[0];
+            vec_cell_m${m}[k][i][j][1] += jp_proj*exp_m${m}[1];
+% endfor
+          }}}
+   }
+</%def>
+
+<%def name="four_cells_origin()">\
+  // running kernels over the groups of ${S}x${S} cells
+  uint i_cell = (uint) get_global_id(0);
+  if (i_cell < *NxNr_4)
+   {
+    // get numbers of cells and period of grid of groups
+    uint Nx_grid = *Nx;
+    uint Nx_cell = Nx_grid-1;
+    uint Nx_S = (Nx_grid+${S-1})/${S};
+    uint Nr_cell = *Nr-1;
+
+    // get indicies of group origin (left-bottom)
+    uint ir = i_cell/Nx_S;
+    uint ix = i_cell - ir*Nx_S;
+
+    // convert group indicies to global grid
+    ix *= ${S};
+    ir *= ${S};
+
+    // apply offset whithin a group
+    ix += cell_offset % ${S};
+    ir += cell_offset / ${S};
+</%def>
+
+<%def name="tile_origin()">\
+  // get tile origin and indicies of the cell in the tile
+  uint i_tile = (uint) get_group_id(0);
+  uint ir0 = (i_tile/num_tiles_x)*TILE_NR;
+  uint ix0 = (i_tile - (i_tile/num_tiles_x)*num_tiles_x)*TILE_NX;
+
+  uint ir_loc = (uint) get_local_id(0)/TILE_NX;
+  uint ix_loc = (uint) get_local_id(0) - ir_loc*TILE_NX;
+
+  uint ir = ir0 + ir_loc;
+  uint ix = ix0 + ix_loc;
+
+  // get numbers of cells
+  uint Nx_grid = *Nx;
+  uint Nx_cell = Nx_grid-1;
+  uint Nr_cell = *Nr-1;
+</%def>
+
+// Depose particles "weights" onto 2D grid via linear projection,
+// using groups of 4 cells and barriered steps for each cell
+// in a group by calling kernel with different offsets: (0,1,2,3)
+// _______________________
+//|     |     |     |     |
+//|  2  |  3  |  2  |  3  |
+//|_____|_____|_____|_____|
+//|     |     |     |     |
+//|  0  |  1  |  0  |  1  |
+//|_____|_____|_____|_____|
+//| ____|____ |     |     |
+//|| 2  |  3 ||  2  |  3  |
+//||____|____||_____|_____|
+//||    |    ||     |     |
+//||_0__|__1_||  0  |  1  |
+//|_____|_____|_____|_____|
+//
+__kernel void depose_scalar(
+           uint cell_offset,
+  __global uint *sorting_indx,
+  __global double *x,
+  __global double *y,
+  __global double *z,
+  __global PART_REAL *w,
+  __global uint *indx_offset,
+             char charge,
+  __constant uint *Nx,
+  __constant double *xmin,
+  __constant double *dx_inv,
+  __constant uint *Nr,
+  __constant double *rmin,
+  __constant double *dr_inv,
+  __constant uint *NxNr_4,
+${scalar_args()}\
+)
+{
+${four_cells_origin()}
+if (ix>0 && ix<Nx_cell-1 && ir<Nr_cell-1 ){
+    // get 1D indicies of the selected
+    // cell and grid node on the global grid
+    uint i_cell_glob = ix + ir*Nx_cell;
+    uint i_grid_glob = ix + ${lo} + (ir + ${lo})*Nx_grid;
+
+    // get particles indicies in the selected cell
+    uint ip_start = indx_offset[i_cell_glob];
+    uint ip_end = indx_offset[i_cell_glob+1];
+
+    // skip empty cells
+if (ip_start != ip_end){
+
+    // allocate few integer counters
+    uint i,j,i_dep;
+
+    // allocate privite cell array for the deposition
+${cell_arrays('scl_cell', '')}
+    for (i=0;i<${S};i++){
+      for (j=0;j<${S};j++){
+        scl_cell_m0[i][j] = 0;
+% for m in range(1, M+1):
+        scl_cell_m${m}[i][j][0] = 0;
+        scl_cell_m${m}[i][j][1] = 0;
+% endfor
+        }}
+
+${scalar_deposit_loop()}
+    // write to the global field memory
+    for (i=0;i<${S};i++){
+      for (j=0;j<${S};j++){
+% if lo < 0:
+        if (ir+i < ${-lo}) continue;
+% endif
+        i_dep = i_grid_glob + j + Nx_grid*i;
+
+        scl_m0[i_dep] = scl_m0[i_dep] + scl_cell_m0[i][j];
+% for m in range(1, M+1):
+        scl_m${m}[i_dep] = scl_m${m}[i_dep] + (double2) {scl_cell_m${m}[i][j][0],
+                                                   scl_cell_m${m}[i][j][1]};
+% endfor
+        }}
+  }
+}}
+}
+
+// Depose weighted particles vectors onto 2D grid via linear projection,
+// using groups of 4 cells and barriered steps for each cell
+// in a group by calling kernel with different offsets: (0,1,2,3)
+// (see depose_scalar)
+__kernel void depose_vector(
+           uint cell_offset,
+  __global uint *sorting_indx,
+  __global double *x,
+  __global double *y,
+  __global double *z,
+  __global PART_REAL *ux,
+  __global PART_REAL *uy,
+  __global PART_REAL *uz,
+  __global PART_REAL *g_inv,
+  __global PART_REAL *w,
+  __global uint *indx_offset,
+           char charge,
+  __constant uint *Nx,
+  __constant double *xmin,
+  __constant double *dx_inv,
+  __constant uint *Nr,
+  __constant double *rmin,
+  __constant double *dr_inv,
+  __constant uint *NxNr_4,
+${vector_args()}\
+)
+{
+${four_cells_origin()}
+if (ix>0 && ix<Nx_cell-1 && ir<Nr_cell-1 ){
+
+    // get 1D indicies of the selected
+    // cell and grid node on the global grid
+    uint i_cell_glob = ix + ir*Nx_cell;
+    uint i_grid_glob = ix + ${lo} + (ir + ${lo})*Nx_grid;
+
+    // get particles indicies in the selected cell
+    uint ip_start = indx_offset[i_cell_glob];
+    uint ip_end = indx_offset[i_cell_glob+1];
+
+    // skip empty cells
+if (ip_start != ip_end){
+
+    // allocate few integer counters
+    uint i,j,k,i_dep;
+
+    // allocate privite cell array for the deposition
+${cell_arrays('vec_cell', '[3]')}
+    for (k=0; k<3; k++){
+      for (i=0; i<${S}; i++){
+        for (j=0; j<${S}; j++){
+          vec_cell_m0[k][i][j] = 0.;
+% for m in range(1, M+1):
+          vec_cell_m${m}[k][i][j][0] = 0.;
+          vec_cell_m${m}[k][i][j][1] = 0.;
+% endfor
+        }}}
+
+${vector_deposit_loop()}
+    // write to the global field memory
+    for (i=0;i<${S};i++){
+      for (j=0;j<${S};j++){
+% if lo < 0:
+        if (ir+i < ${-lo}) continue;
+% endif
+        i_dep = i_grid_glob + j + Nx_grid*i;
+
+% for k, comp in enumerate(['x', 'y', 'z']):
+        vec_${comp}_m0[i_dep] = vec_${comp}_m0[i_dep] + vec_cell_m0[${k}][i][j];
+% endfor
+% for m in range(1, M+1):
+
+% for k, comp in enumerate(['x', 'y', 'z']):
+        vec_${comp}_m${m}[i_dep] = vec_${comp}_m${m}[i_dep] + (double2) {vec_cell_m${m}[${k}][i][j][0],
+                                                       vec_cell_m${m}[${k}][i][j][1]};
+% endfor
+% endfor
+        }}
+  }
+}}
+}
+
+// Depose particles "weights" onto 2D grid via linear projection,
+// with a work-group per tile of cells, accumulating the deposited
+// values in the local memory (see tile_write_d in grid_generic.cl).
+// Cells of the same parity are added to the tile at the same time.
+__kernel void depose_scalar_tiles(
+  __global uint *sorting_indx,
+  __global double *x,
+  __global double *y,
+  __global double *z,
+  __global PART_REAL *w,
+  __global uint *indx_offset,
+             char charge,
+  __constant uint *Nx,
+  __constant double *xmin,
+  __constant double *dx_inv,
+  __constant uint *Nr,
+  __constant double *rmin,
+  __constant double *dr_inv,
+             uint num_tiles_x,
+${scalar_args(last=False)}\
+${scalar_args('_halo', real='FLD_REAL')}\
+)
+{
+  __local FLD_REAL scl_tile_m0[TILE_NODES];
+% for m in range(1, M+1):
+  __local FLD_REAL2 scl_tile_m${m}[TILE_NODES];
+% endfor
+
+${tile_origin()}
+  tile_clear_d(scl_tile_m0);
+% for m in range(1, M+1):
+  tile_clear_c(scl_tile_m${m});
+% endfor
+  barrier(CLK_LOCAL_MEM_FENCE);
+
+  // allocate few integer counters
+  uint i,j,i_dep;
+
+  // allocate privite cell array for the deposition
+${cell_arrays('scl_cell', '')}
+  for (i=0;i<${S};i++){
+    for (j=0;j<${S};j++){
+      scl_cell_m0[i][j] = 0;
+% for m in range(1, M+1):
+      scl_cell_m${m}[i][j][0] = 0;
+      scl_cell_m${m}[i][j][1] = 0;
+% endfor
+      }}
+
+if (ix>0 && ix<Nx_cell-1 && ir<Nr_cell-1 ){
+    // get particles indicies in the selected cell
+    uint i_cell_glob = ix + ir*Nx_cell;
+    uint ip_start = indx_offset[i_cell_glob];
+    uint ip_end = indx_offset[i_cell_glob+1];
+
+${scalar_deposit_loop()}\
+}
+
+  // write to the local tile memory by the cells of the same parity
+  for (uint color=0; color<${S*S}; color++){
+    if ( (ix_loc % ${S}) + ${S}*(ir_loc % ${S}) == color ){
+      for (i=0;i<${S};i++){
+        for (j=0;j<${S};j++){
+          i_dep = ix_loc + j + TILE_EXT_NX*(ir_loc + i);
+          scl_tile_m0[i_dep] += scl_cell_m0[i][j];
+% for m in range(1, M+1):
+          scl_tile_m${m}[i_dep] += (FLD_REAL2) {scl_cell_m${m}[i][j][0],
+                                             scl_cell_m${m}[i][j][1]};
+% endfor
+          }}
+      }
+    barrier(CLK_LOCAL_MEM_FENCE);
+  }
+
+  // write to the global field memory and halo
+  tile_write_d(scl_tile_m0, scl_m0, scl_m0_halo, i_tile, ir0, ix0,
+               Nx_grid, *Nr);
+% for m in range(1, M+1):
+  tile_write_c(scl_tile_m${m}, scl_m${m}, scl_m${m}_halo, i_tile, ir0, ix0,
+               Nx_grid, *Nr);
+% endfor
+}
+
+// Depose weighted particles vectors onto 2D grid via linear projection,
+// with a work-group per tile of cells (see depose_scalar_tiles)
+__kernel void depose_vector_tiles(
+  __global uint *sorting_indx,
+  __global double *x,
+  __global double *y,
+  __global double *z,
+  __global PART_REAL *ux,
+  __global PART_REAL *uy,
+  __global PART_REAL *uz,
+  __global PART_REAL *g_inv,
+  __global PART_REAL *w,
+  __global uint *indx_offset,
+           char charge,
+  __constant uint *Nx,
+  __constant double *xmin,
+  __constant double *dx_inv,
+  __constant uint *Nr,
+  __constant double *rmin,
+  __constant double *dr_inv,
+             uint num_tiles_x,
+${vector_args(last=False)}\
+${vector_args('_halo', real='FLD_REAL')}\
+)
+{
+  __local FLD_REAL vec_tile_m0[3][TILE_NODES];
+% for m in range(1, M+1):
+  __local FLD_REAL2 vec_tile_m${m}[3][TILE_NODES];
+% endfor
+
+${tile_origin()}
+  // allocate few integer counters
+  uint i,j,k,i_dep;
+
+  for (k=0; k<3; k++){
+    tile_clear_d(vec_tile_m0[k]);
+% for m in range(1, M+1):
+    tile_clear_c(vec_tile_m${m}[k]);
+% endfor
+  }
+  barrier(CLK_LOCAL_MEM_FENCE);
+
+  // allocate privite cell array for the deposition
+${cell_arrays('vec_cell', '[3]')}
+  for (k=0; k<3; k++){
+    for (i=0; i<${S}; i++){
+      for (j=0; j<${S}; j++){
+        vec_cell_m0[k][i][j] = 0.;
+% for m in range(1, M+1):
+        vec_cell_m${m}[k][i][j][0] = 0.;
+        vec_cell_m${m}[k][i][j][1] = 0.;
+% endfor
+      }}}
+
+if (ix>0 && ix<Nx_cell-1 && ir<Nr_cell-1 ){
+    // get particles indicies in the selected cell
+    uint i_cell_glob = ix + ir*Nx_cell;
+    uint ip_start = indx_offset[i_cell_glob];
+    uint ip_end = indx_offset[i_cell_glob+1];
+
+${vector_deposit_loop()}\
+}
+
+  // write to the local tile memory by the cells of the same parity
+  for (uint color=0; color<${S*S}; color++){
+    if ( (ix_loc % ${S}) + ${S}*(ir_loc % ${S}) == color ){
+      for (k=0;k<3;k++){
+        for (i=0;i<${S};i++){
+          for (j=0;j<${S};j++){
+            i_dep = ix_loc + j + TILE_EXT_NX*(ir_loc + i);
+            vec_tile_m0[k][i_dep] += vec_cell_m0[k][i][j];
+% for m in range(1, M+1):
+            vec_tile_m${m}[k][i_dep] += (FLD_REAL2) {vec_cell_m${m}[k][i][j][0],
+                                                  vec_cell_m${m}[k][i][j][1]};
+% endfor
+            }}}
+      }
+    barrier(CLK_LOCAL_MEM_FENCE);
+  }
+
+  // write to the global field memory and halo
+% for m in range(M+1):
+% for k, comp in enumerate(['x', 'y', 'z']):
+  tile_write_${'d' if m==0 else 'c'}(vec_tile_m${m}[${k}], vec_${comp}_m${m}, vec_${comp}_m${m}_halo, i_tile, ir0, ix0,
+               Nx_grid, *Nr);
+% endfor
+% endfor
+}
+
+// Gather linearly fields on the particles and advance their momenta
+__kernel void gather_and_push(
+  __global double *x,
+  __global double *y,
+  __global double *z,
+  __global PART_REAL *px,
+  __global PART_REAL *py,
+  __global PART_REAL *pz,
+  __global PART_REAL *g_inv,
+  __global uint *sorting_indx,
+  __global uint *indx_offset,
+  __constant double *dt,
+             uint Np,
+  __constant uint *Nx,
+  __constant double *xmin,
+  __constant double *dx_inv,
+  __constant uint *Nr,
+  __constant double *rmin,
+  __constant double *dr_inv,
+  __constant uint *Nxm1Nrm1,
+% for m in range(M+1):
+% for fld in ['e', 'b']:
+% for comp in ['x', 'y', 'z']:
+  __global ${'double' if m==0 else 'double2'} *${fld}${comp}_m${m}${'' if (m==M and fld=='b' and comp=='z') else ','}
+% endfor
+% endfor
+% endfor
+)
+{
+ // running kernels over the particles
+ uint ip  = (uint) get_global_id(0);
+ if (ip<Np)
+  {
+   uint ip_srtd = sorting_indx[ip];
+   // particles which left the grid are sorted after Np_stay,
+   // which is the offset of the last cell
+   uint Np_stay = indx_offset[*Nxm1Nrm1];
+   if (ip<Np_stay)
+   {
+
+    // get cell number and period of grid
+    int Nx_grid = (int) *Nx;
+    int Nx_cell = Nx_grid - 1;
+    int Nr_cell = (int) *Nr-1;
+
+    double xmin_loc = *xmin;
+    double rmin_loc = *rmin;
+    double dr_inv_loc = *dr_inv;
+    double dx_inv_loc = *dx_inv;
+
+    double xp = x[P_IDX(ip_srtd, COMP_X)];
+    double yp = y[P_IDX(ip_srtd, COMP_Y)];
+    double zp = z[P_IDX(ip_srtd, COMP_Z)];
+    double rp = sqrt(yp*yp + zp*zp);
+
+    int ix = (int) floor( (xp-xmin_loc) * dx_inv_loc );
+    int ir = (int) floor( (rp-rmin_loc) * dr_inv_loc );
+
+if (ix>0 && ix<Nx_cell-1 && ir<Nr_cell-1 ){
+
+    uint i_cell = ix + ir*Nx_cell;
+
+    double u_p[3] = {px[P_IDX(ip_srtd, COMP_PX)],
+                     py[P_IDX(ip_srtd, COMP_PY)],
+                     pz[P_IDX(ip_srtd, COMP_PZ)]};
+    double dt_2 = 0.5*(*dt);
+
+    // allocate privitely some reused variables
+    double sX[${S}], sR[${S}];
+    double C_cell[${S}][${S}];
+
+${shape_factors('sX', '( xp - xmin_loc )*dx_inv_loc - ix', '    ')}\
+${shape_factors('sR', '( rp - rmin_loc )*dr_inv_loc - ir', '    ')}
+    // get the rows of the nodes, where the row below the axis is
+    // taken from the mirrored one as in warp_axis kernels
+    int ir_node[${S}];
+    double sgn_node[${S}];
+    for (int i=0;i<${S};i++){
+      ir_node[i] = ir + ${lo} + i;
+      sgn_node[i] = 1.;
+      }
+% if lo < 0:
+    if (ir==0){
+      ir_node[0] = ${1-lo};
+      sgn_node[0] = -1.;
+      }
+% endif
+% if M > 0:
+${exp_decl()}
+    // phase factors exp(-i*m*theta)
+    double rp_inv = 1./rp;
+    exp_m1[0] = yp*rp_inv;
+    exp_m1[1] = -zp*rp_inv;
+${exp_modes('    ')}\
+% endif
+
+    uint i,j,k,i_loc;
+
+    for (i=0;i<${S};i++){
+      for (j=0;j<${S};j++){
+        C_cell[i][j] = sR[i]*sX[j];
+        }}
+
+    // allocate privite cell array for the deposition
+    // NB: multiplictaion of m>0 by 2 accounts for Hermit symmetry
+${cell_arrays('e_cell', '[3]')}\
+${cell_arrays('b_cell', '[3]')}
+    for (i=0;i<${S};i++){
+      for (j=0;j<${S};j++){
+        i_loc = ix + ${lo} + j + Nx_grid*ir_node[i];
+% for fld in ['e', 'b']:
+% for k, comp in enumerate(['x', 'y', 'z']):
+        ${fld}_cell_m0[${k}][i][j] = ${fld}${comp}_m0[i_loc];
+% endfor
+
+% endfor
+% for m in range(1, M+1):
+% for fld in ['e', 'b']:
+% for k, comp in enumerate(['x', 'y', 'z']):
+        ${fld}_cell_m${m}[${k}][i][j][0] = 2 * sgn_node[i] * ((double) ${fld}${comp}_m${m}[i_loc].s0);
+        ${fld}_cell_m${m}[${k}][i][j][1] = 2 * sgn_node[i] * ((double) ${fld}${comp}_m${m}[i_loc].s1);
+
+% endfor
+% endfor
+% endfor
+        }}
+
+    double e_p[3], b_p[3];
+    for (k=0;k<3;k++){
+      e_p[k] = 0;
+      b_p[k] = 0;
+      }
+
+    for (k=0;k<3;k++){
+      for (i=0;i<${S};i++){
+        for (j=0;j<${S};j++){
+          e_p[k] += C_cell[i][j]*e_cell_m0[k][i][j];
+          b_p[k] += C_cell[i][j]*b_cell_m0[k][i][j];
+% for m in range(1, M+1):
+
+          e_p[k] += C_cell[i][j]*e_cell_m${m}[k][i][j][0]*exp_m${m}[0];
+          e_p[k] -= C_cell[i][j]*e_cell_m${m}[k][i][j][1]*exp_m${m}[1];
+          b_p[k] += C_cell[i][j]*b_cell_m${m}[k][i][j][0]*exp_m${m}[0];
+          b_p[k] -= C_cell[i][j]*b_cell_m${m}[k][i][j][1]*exp_m${m}[1];
+% endfor
+          }}}
+
+    double um[3], up[3], u0[3], t[3], s[3];
+
+    for(k=0;k<3;k++){
+      um[k] = u_p[k] + dt_2*e_p[k];
+    }
+
+    double g_p_inv = 1. / sqrt(1. + um[0]*um[0] + um[1]*um[1] + um[2]*um[2]);
+
+    for(k=0;k<3;k++){
+      t[k] = dt_2 * b_p[k] * g_p_inv;
+      }
+
+    double t2p1_m1_05 = 2. / (1. + t[0]*t[0] + t[1]*t[1] + t[2]*t[2]) ;
+
+    for(k=0;k<3;k++){
+      s[k] = t[k] * t2p1_m1_05;
+      }
+
+    u0[0] = um[0] + um[1]*t[2] - um[2]*t[1];
+    u0[1] = um[1] - um[0]*t[2] + um[2]*t[0];
+    u0[2] = um[2] + um[0]*t[1] - um[1]*t[0];
+
+    up[0] = um[0] +  u0[1]*s[2] - u0[2]*s[1];
+    up[1] = um[1] -  u0[0]*s[2] + u0[2]*s[0];
+    up[2] = um[2] +  u0[0]*s[1] - u0[1]*s[0];
+
+    for(int k=0;k<3;k++) {
+      u_p[k] = up[k] + dt_2*e_p[k];
+      }
+
+    g_p_inv = 1. / sqrt(1. + u_p[0]*u_p[0] + u_p[1]*u_p[1] + u_p[2]*u_p[2]);
+
+    px[P_IDX(ip_srtd, COMP_PX)] = u_p[0];
+    py[P_IDX(ip_srtd, COMP_PY)] = u_p[1];
+    pz[P_IDX(ip_srtd, COMP_PZ)] = u_p[2];
+    g_inv[P_IDX(ip_srtd, COMP_G_INV)] = g_p_inv;
+   }
+  }
+}
+}
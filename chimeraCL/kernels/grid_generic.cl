@@ -84,3 +84,216 @@ __kernel void warp_axis_m1plus_c(
     arr[i_cell].s1 = -arr[i_cell + Nx].s1;
    }
 }
+
+// Tile-based deposition: a work-group deposes particles of a tile of
+// TILE_NR x TILE_NX cells (one cell per work-item) into the local
+// array of its nodes, extended by TILE_GL nodes below and on the left
+// and TILE_GU nodes above and on the right, as given by the particle
+// shape (TILE_GL=0 and TILE_GU=1 for the linear shape). The nodes of
+// the tile with extended local indicies TILE_GL <= ir < TILE_GL+TILE_NR
+// and TILE_GL <= ix < TILE_GL+TILE_NX belong only to this tile and are
+// added to the field directly, while the border nodes are shared with
+// the neighbouring tiles, and are written to the halo buffer of the tile
+// (TILE_HALO values per tile): the lower and upper rows go first,
+// followed by the left and right columns of the middle rows. The local
+// arrays and halos are of FLD_REAL type, and the fields are double
+#define TILE_GHOSTS (TILE_GL+TILE_GU)
+#define TILE_EXT_NX (TILE_NX+TILE_GHOSTS)
+#define TILE_EXT_NR (TILE_NR+TILE_GHOSTS)
+#define TILE_NODES (TILE_EXT_NR*TILE_EXT_NX)
+#define TILE_HALO (TILE_GHOSTS*(TILE_EXT_NX+TILE_NR))
+
+// Set the local tile array of double type to zero
+void tile_clear_d(__local FLD_REAL *fld_loc)
+{
+  for (uint i_node=get_local_id(0); i_node<TILE_NODES;
+       i_node+=get_local_size(0)) {fld_loc[i_node] = 0;}
+}
+
+// Set the local tile array of complex type to zero
+void tile_clear_c(__local FLD_REAL2 *fld_loc)
+{
+  for (uint i_node=get_local_id(0); i_node<TILE_NODES;
+       i_node+=get_local_size(0)) {fld_loc[i_node] = (FLD_REAL2) {0., 0.};}
+}
+
+// Check if a node of the extended tile belongs only to this tile
+bool tile_owns_node(uint ir_loc, uint ix_loc)
+{
+  return ir_loc>=TILE_GL && ir_loc<TILE_GL+TILE_NR && \
+         ix_loc>=TILE_GL && ix_loc<TILE_GL+TILE_NX;
+}
+
+// Get the position of a node of the tile border in its halo
+uint tile_halo_index(uint ir_loc, uint ix_loc)
+{
+  if (ir_loc < TILE_GL)
+    {return ir_loc*TILE_EXT_NX + ix_loc;}
+  else if (ir_loc >= TILE_GL+TILE_NR)
+    {return (ir_loc-TILE_NR)*TILE_EXT_NX + ix_loc;}
+  else if (ix_loc < TILE_GL)
+    {return TILE_GHOSTS*TILE_EXT_NX + (ir_loc-TILE_GL)*TILE_GHOSTS
+            + ix_loc;}
+  else
+    {return TILE_GHOSTS*TILE_EXT_NX + (ir_loc-TILE_GL)*TILE_GHOSTS
+            + ix_loc - TILE_NX;}
+}
+
+// Write the local tile array of double type to the field and halo
+void tile_write_d(
+  __local FLD_REAL *fld_loc,
+  __global double *fld,
+  __global FLD_REAL *fld_halo,
+  uint i_tile,
+  uint ir0,
+  uint ix0,
+  uint Nx_grid,
+  uint Nr_grid)
+{
+  for (uint i_node=get_local_id(0); i_node<TILE_NODES;
+       i_node+=get_local_size(0))
+   {
+    uint ir_loc = i_node/TILE_EXT_NX;
+    uint ix_loc = i_node - ir_loc*TILE_EXT_NX;
+
+    if (tile_owns_node(ir_loc, ix_loc))
+     {
+      uint ir = ir0 + ir_loc - TILE_GL;
+      uint ix = ix0 + ix_loc - TILE_GL;
+      if (ir<Nr_grid && ix<Nx_grid)
+        {fld[ix + Nx_grid*ir] += fld_loc[i_node];}
+     }
+    else
+     {
+      fld_halo[i_tile*TILE_HALO + tile_halo_index(ir_loc, ix_loc)] = \
+        fld_loc[i_node];
+     }
+   }
+}
+
+// Write the local tile array of complex type to the field and halo
+void tile_write_c(
+  __local FLD_REAL2 *fld_loc,
+  __global double2 *fld,
+  __global FLD_REAL2 *fld_halo,
+  uint i_tile,
+  uint ir0,
+  uint ix0,
+  uint Nx_grid,
+  uint Nr_grid)
+{
+  for (uint i_node=get_local_id(0); i_node<TILE_NODES;
+       i_node+=get_local_size(0))
+   {
+    uint ir_loc = i_node/TILE_EXT_NX;
+    uint ix_loc = i_node - ir_loc*TILE_EXT_NX;
+
+    if (tile_owns_node(ir_loc, ix_loc))
+     {
+      uint ir = ir0 + ir_loc - TILE_GL;
+      uint ix = ix0 + ix_loc - TILE_GL;
+      if (ir<Nr_grid && ix<Nx_grid)
+        {fld[ix + Nx_grid*ir] += convert_double2(fld_loc[i_node]);}
+     }
+    else
+     {
+      fld_halo[i_tile*TILE_HALO + tile_halo_index(ir_loc, ix_loc)] = \
+        fld_loc[i_node];
+     }
+   }
+}
+
+// Get the position of a node in the halo of the neighbouring tile
+// (i_tr, i_tx), or -1 if the node is not on the border of that tile
+int tile_neighbour_halo_index(
+  int ir,
+  int ix,
+  int i_tr,
+  int i_tx,
+  uint num_tiles_x,
+  uint num_tiles_r)
+{
+  int ir_loc = ir - i_tr*TILE_NR + TILE_GL;
+  int ix_loc = ix - i_tx*TILE_NX + TILE_GL;
+
+  if (i_tr<0 || i_tr>=(int)num_tiles_r || i_tx<0 || i_tx>=(int)num_tiles_x
+      || ir_loc<0 || ir_loc>=TILE_EXT_NR || ix_loc<0 || ix_loc>=TILE_EXT_NX)
+    {return -1;}
+
+  return (i_tr*num_tiles_x + i_tx)*TILE_HALO + \
+         tile_halo_index(ir_loc, ix_loc);
+}
+
+// Add the halos of the tiles to the field of double type: each node
+// close to the tiles borders gathers the values from the halos of the
+// neighbouring tiles
+__kernel void add_tile_halo_d(
+  __global double *fld,
+  __global FLD_REAL *fld_halo,
+  __constant uint *NxNr,
+  __constant uint *Nx,
+             uint num_tiles_x,
+             uint num_tiles_r)
+{
+  uint i_node = (uint) get_global_id(0);
+  if (i_node < *NxNr)
+   {
+    int ir = i_node / (*Nx);
+    int ix = i_node - ir*(*Nx);
+
+    int ir_tile = ir/TILE_NR;
+    int ix_tile = ix/TILE_NX;
+    int ir_loc = ir - ir_tile*TILE_NR;
+    int ix_loc = ix - ix_tile*TILE_NX;
+
+    if (ir_loc<TILE_GU || ir_loc>=TILE_NR-TILE_GL ||
+        ix_loc<TILE_GU || ix_loc>=TILE_NX-TILE_GL)
+     {
+      double val = 0;
+      for (int i_tr=ir_tile-1; i_tr<=ir_tile+1; i_tr++){
+        for (int i_tx=ix_tile-1; i_tx<=ix_tile+1; i_tx++){
+          int i_halo = tile_neighbour_halo_index(ir, ix, i_tr, i_tx,
+                                                 num_tiles_x, num_tiles_r);
+          if ((i_tr!=ir_tile || i_tx!=ix_tile) && i_halo>=0)
+            {val += fld_halo[i_halo];}
+          }}
+      fld[i_node] += val;
+     }
+   }
+}
+
+// Add the halos of the tiles to the field of complex type
+__kernel void add_tile_halo_c(
+  __global double2 *fld,
+  __global FLD_REAL2 *fld_halo,
+  __constant uint *NxNr,
+  __constant uint *Nx,
+             uint num_tiles_x,
+             uint num_tiles_r)
+{
+  uint i_node = (uint) get_global_id(0);
+  if (i_node < *NxNr)
+   {
+    int ir = i_node / (*Nx);
+    int ix = i_node - ir*(*Nx);
+
+    int ir_tile = ir/TILE_NR;
+    int ix_tile = ix/TILE_NX;
+    int ir_loc = ir - ir_tile*TILE_NR;
+    int ix_loc = ix - ix_tile*TILE_NX;
+
+    if (ir_loc<TILE_GU || ir_loc>=TILE_NR-TILE_GL ||
+        ix_loc<TILE_GU || ix_loc>=TILE_NX-TILE_GL)
+     {
+      double2 val = (double2) {0., 0.};
+      for (int i_tr=ir_tile-1; i_tr<=ir_tile+1; i_tr++){
+        for (int i_tx=ix_tile-1; i_tx<=ix_tile+1; i_tx++){
+          int i_halo = tile_neighbour_halo_index(ir, ix, i_tr, i_tx,
+                                                 num_tiles_x, num_tiles_r);
+          if ((i_tr!=ir_tile || i_tx!=ix_tile) && i_halo>=0)
+            {val += convert_double2(fld_halo[i_halo]);}
+          }}
+      fld[i_node] += val;
+     }
+   }
+}
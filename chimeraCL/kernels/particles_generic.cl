@@ -1,5 +1,6 @@
 // this is a source of particles kernels for chimeraCL project
 #pragma OPENCL EXTENSION cl_khr_global_int32_base_atomics : enable
+#pragma OPENCL EXTENSION cl_khr_local_int32_base_atomics : enable
 
 
 // Multiply particles weight by an intrpolant profile
@@ -83,6 +84,203 @@ __kernel void fill_grid(
   }
 }
 
+// Linear interpolation of the tabulated profile between the points
+// i_start and i_end, which is zero outside of the table
+double profile_factor(double xp,
+                      __global double *xx_prf,
+                      __global double *ff_prf,
+                      __global double *dxm1_prf,
+                      uint i_start,
+                      uint i_end)
+{
+  for (uint ix=i_start; ix<i_end-1; ix++){
+    if (xp>xx_prf[ix] && xp<=xx_prf[ix+1]) {
+      double f_minus = ff_prf[ix]*dxm1_prf[ix];
+      double f_plus = ff_prf[ix+1]*dxm1_prf[ix];
+      return f_minus*(xx_prf[ix+1]-xp) + f_plus*(xp-xx_prf[ix]);
+    }
+  }
+  return 0.;
+}
+
+// Fill the cells of the injected domain with the particles, which
+// are written into the storage after the first ip_start ones. The
+// weights are multiplied by the longitudinal density profiles, which
+// are concatenated in the tables starting at prf_offset
+__kernel void inject_grid(
+  __global double *x,
+  __global double *y,
+  __global double *z,
+  __global PART_REAL *w,
+  __global double *theta_var,
+           uint ip_start,
+           double xmin,
+           double dx,
+           double rmin,
+           double dr,
+           double w0,
+           uint Nx,
+           uint ncells,
+           uint Nppc_x,
+           uint Nppc_r,
+           uint Nppc_th,
+  __global double *xx_prf,
+  __global double *ff_prf,
+  __global double *dxm1_prf,
+  __global uint *prf_offset,
+           uint num_prf)
+{
+    uint i_cell = (uint) get_global_id(0);
+    if (i_cell < ncells)
+    {
+        uint Nx_cell = Nx-1;
+        uint Nppc_loc = Nppc_x*Nppc_r*Nppc_th;
+
+        uint ir =  i_cell/Nx_cell;
+        uint ix =  i_cell - Nx_cell*ir;
+        uint ip = ip_start + i_cell*Nppc_loc;
+
+        double xmin_cell = xmin + dx*ix;
+        double rmin_cell = rmin + dr*ir;
+        double thmin = theta_var[i_cell];
+
+        double Lx = xmin + dx*(ix+1) - xmin_cell;
+        double Lr = rmin + dr*(ir+1) - rmin_cell;
+        double ddx = 1./( (double) Nppc_x);
+        double ddr = 1./( (double) Nppc_r);
+        double dth = 2*M_PI/( (double) Nppc_th);
+        double th, xp, rp, wp, sin_th, cos_th, rp_s, rp_c;
+
+        for (uint incell_th=0; incell_th<Nppc_th; incell_th++){
+          th = thmin + incell_th*dth;
+          sin_th = sin(th);
+          cos_th = cos(th);
+          for (int incell_r=0;incell_r<Nppc_r;incell_r++){
+            rp = rmin_cell + (0.5+incell_r)*ddr*Lr;
+            rp_s = rp*sin_th;
+            rp_c = rp*cos_th;
+            for (int incell_x=0;incell_x<Nppc_x;incell_x++){
+              xp = xmin_cell + (0.5+incell_x)*ddx*Lx;
+              wp = rp*w0;
+              for (uint i_prf=0; i_prf<num_prf; i_prf++){
+                wp *= profile_factor(xp, xx_prf, ff_prf, dxm1_prf,
+                                     prf_offset[i_prf], prf_offset[i_prf+1]);
+              }
+
+              x[P_IDX(ip, COMP_X)] = xp;
+              y[P_IDX(ip, COMP_Y)] = rp_s;
+              z[P_IDX(ip, COMP_Z)] = rp_c;
+              w[P_IDX(ip, COMP_W)] = wp;
+              ip += 1;
+            }}}
+  }
+}
+
+// Write the momenta of the injected particles into the storage
+// after the first ip_start ones, with their inverse Lorentz factors
+__kernel void inject_momenta(
+  __global PART_REAL *px,
+  __global PART_REAL *py,
+  __global PART_REAL *pz,
+  __global PART_REAL *g_inv,
+  __global double *px_new,
+  __global double *py_new,
+  __global double *pz_new,
+           uint ip_start,
+           uint num_p)
+{
+  uint ip = (uint) get_global_id(0);
+  if (ip < num_p)
+   {
+    double pxp = px_new[ip];
+    double pyp = py_new[ip];
+    double pzp = pz_new[ip];
+
+    px[P_IDX(ip_start+ip, COMP_PX)] = pxp;
+    py[P_IDX(ip_start+ip, COMP_PY)] = pyp;
+    pz[P_IDX(ip_start+ip, COMP_PZ)] = pzp;
+    g_inv[P_IDX(ip_start+ip, COMP_G_INV)] = 1. / sqrt(1. + pxp*pxp
+                                                + pyp*pyp + pzp*pzp);
+   }
+}
+
+// Get index of the cell containing the particle, or of the
+// overflow cell Nr_loc*Nx_loc for the particles out of the grid
+uint get_cell_index(double xp, double yp, double zp,
+                    uint Nx, double xmin, double dx_inv,
+                    uint Nr, double rmin, double dr_inv)
+{
+  int Nx_loc = (int) Nx-1;
+  int Nr_loc = (int) Nr-1;
+
+  double r = sqrt(yp*yp+zp*zp);
+
+  int ix = (int)floor( (xp - xmin)*dx_inv );
+  int ir = (int)floor((r - rmin)*dr_inv);
+
+  if (ix > 0 && ix < Nx_loc-1 && ir < Nr_loc-1 && ir>=0)
+   {
+    return ix + ir * Nx_loc;
+   }
+  else
+   {
+    return Nr_loc*Nx_loc;
+   }
+}
+
+// Particles of a work-group are counted in the local bins for a tile
+// of BLOCK_SIZE cells, starting from the cell of its first particle,
+// and in a separate bin for the overflow cell. The local bins are then
+// merged into the global sums with one atomic per non-empty bin, which
+// avoids contention of global atomics for sorted and dense particles.
+void clear_local_bins(
+  __local uint *sum_loc,
+  __local uint *sum_overflow)
+{
+  for (uint i_bin=get_local_id(0); i_bin<BLOCK_SIZE;
+       i_bin+=get_local_size(0)) {sum_loc[i_bin] = 0;}
+
+  if (get_local_id(0) == 0) {*sum_overflow = 0;}
+}
+
+// Get the local bin of the cell, or 0 if cell is out of the tile
+__local uint *get_local_bin(
+  uint i_cell,
+  uint i_cell_overflow,
+  uint tile_start,
+  __local uint *sum_loc,
+  __local uint *sum_overflow)
+{
+  if (i_cell == i_cell_overflow) {return sum_overflow;}
+  if (i_cell - tile_start < BLOCK_SIZE) {return &sum_loc[i_cell - tile_start];}
+  return 0;
+}
+
+// Add local bins to the global sums, and replace them by the
+// previous values of these sums
+void merge_local_bins(
+  uint i_cell_overflow,
+  uint tile_start,
+  __local uint *sum_loc,
+  __local uint *sum_overflow,
+  __global uint *sum_in_cell)
+{
+  for (uint i_bin=get_local_id(0); i_bin<BLOCK_SIZE;
+       i_bin+=get_local_size(0))
+   {
+    if (sum_loc[i_bin] > 0)
+     {
+      sum_loc[i_bin] = atom_add(&sum_in_cell[tile_start+i_bin],
+                                sum_loc[i_bin]);
+     }
+   }
+
+  if (get_local_id(0) == 0 && *sum_overflow > 0)
+   {
+    *sum_overflow = atom_add(&sum_in_cell[i_cell_overflow], *sum_overflow);
+   }
+}
+
 // Find cell indicies of the particles and
 // sums of paricles per cell
 __kernel void index_and_sum_in_cell(
@@ -99,30 +297,100 @@ __kernel void index_and_sum_in_cell(
   __constant double *rmin,
   __constant double *dr_inv)
 {
+  __local uint sum_loc[BLOCK_SIZE];
+  __local uint sum_overflow;
+  __local uint tile_start;
+
   uint ip = (uint) get_global_id(0);
+  uint i_cell_overflow = (*Nx-1)*(*Nr-1);
+  uint i_cell = i_cell_overflow;
+
   if (ip < *num_p)
    {
-    double r;
-    int ix,ir;
-    int Nx_loc = (int) *Nx-1;
-    int Nr_loc = (int) *Nr-1;
+    i_cell = get_cell_index(x[P_IDX(ip, COMP_X)], y[P_IDX(ip, COMP_Y)],
+                            z[P_IDX(ip, COMP_Z)], *Nx, *xmin, *dx_inv,
+                            *Nr, *rmin, *dr_inv);
+    indx_in_cell[ip] = i_cell;
+   }
 
-    r = sqrt(y[ip]*y[ip]+z[ip]*z[ip]);
+  clear_local_bins(sum_loc, &sum_overflow);
+  if (get_local_id(0) == 0) {tile_start = i_cell;}
+  barrier(CLK_LOCAL_MEM_FENCE);
 
-    ix = (int)floor( (x[ip] - *xmin)*(*dx_inv) );
-    ir = (int)floor((r - *rmin)*(*dr_inv));
+  if (ip < *num_p)
+   {
+    __local uint *bin = get_local_bin(i_cell, i_cell_overflow, tile_start,
+                                      sum_loc, &sum_overflow);
+    if (bin) {atom_add(bin, 1U);}
+    else {atom_add(&sum_in_cell[i_cell], 1U);}
+   }
+  barrier(CLK_LOCAL_MEM_FENCE);
 
-    if (ix > 0 && ix < Nx_loc-1 && ir < Nr_loc-1 && ir>=0)
-     {
-      indx_in_cell[ip] = ix + ir * Nx_loc;
-      atom_add(&sum_in_cell[indx_in_cell[ip]], 1U);
-     }
-    else
-     {
-      indx_in_cell[ip] = Nr_loc*Nx_loc ;
-      atom_add(&sum_in_cell[indx_in_cell[ip]], 1U);
-     }
-  }
+  merge_local_bins(i_cell_overflow, tile_start, sum_loc, &sum_overflow,
+                   sum_in_cell);
+}
+
+// Advance particles coordinates, find their cell indicies and
+// sums of paricles per cell in one pass
+__kernel void push_xyz_index_and_sum_in_cell(
+  __global double *x,
+  __global double *y,
+  __global double *z,
+  __global PART_REAL *px,
+  __global PART_REAL *py,
+  __global PART_REAL *pz,
+  __global PART_REAL *g_inv,
+  __constant double *dt,
+  __global uint *sum_in_cell,
+  __constant uint *num_p,
+  __global uint *indx_in_cell,
+  __constant uint *Nx,
+  __constant double *xmin,
+  __constant double *dx_inv,
+  __constant uint *Nr,
+  __constant double *rmin,
+  __constant double *dr_inv)
+{
+  __local uint sum_loc[BLOCK_SIZE];
+  __local uint sum_overflow;
+  __local uint tile_start;
+
+  uint ip = (uint) get_global_id(0);
+  uint i_cell_overflow = (*Nx-1)*(*Nr-1);
+  uint i_cell = i_cell_overflow;
+
+  if (ip < *num_p)
+   {
+    double dt_g = (*dt) * g_inv[P_IDX(ip, COMP_G_INV)];
+
+    double xp = x[P_IDX(ip, COMP_X)] + px[P_IDX(ip, COMP_PX)] * dt_g;
+    double yp = y[P_IDX(ip, COMP_Y)] + py[P_IDX(ip, COMP_PY)] * dt_g;
+    double zp = z[P_IDX(ip, COMP_Z)] + pz[P_IDX(ip, COMP_PZ)] * dt_g;
+
+    x[P_IDX(ip, COMP_X)] = xp;
+    y[P_IDX(ip, COMP_Y)] = yp;
+    z[P_IDX(ip, COMP_Z)] = zp;
+
+    i_cell = get_cell_index(xp, yp, zp, *Nx, *xmin, *dx_inv,
+                            *Nr, *rmin, *dr_inv);
+    indx_in_cell[ip] = i_cell;
+   }
+
+  clear_local_bins(sum_loc, &sum_overflow);
+  if (get_local_id(0) == 0) {tile_start = i_cell;}
+  barrier(CLK_LOCAL_MEM_FENCE);
+
+  if (ip < *num_p)
+   {
+    __local uint *bin = get_local_bin(i_cell, i_cell_overflow, tile_start,
+                                      sum_loc, &sum_overflow);
+    if (bin) {atom_add(bin, 1U);}
+    else {atom_add(&sum_in_cell[i_cell], 1U);}
+   }
+  barrier(CLK_LOCAL_MEM_FENCE);
+
+  merge_local_bins(i_cell_overflow, tile_start, sum_loc, &sum_overflow,
+                   sum_in_cell);
 }
 
 // Advance particles coordinates
@@ -130,25 +398,25 @@ __kernel void push_xyz(
   __global double *x,
   __global double *y,
   __global double *z,
-  __global double *px,
-  __global double *py,
-  __global double *pz,
-  __global double *g_inv,
+  __global PART_REAL *px,
+  __global PART_REAL *py,
+  __global PART_REAL *pz,
+  __global PART_REAL *g_inv,
   __constant double *dt,
   __constant uint *num_p)
 {
   uint ip = (uint) get_global_id(0);
   if (ip < *num_p)
    {
-    double dt_g = (*dt) * g_inv[ip];
+    double dt_g = (*dt) * g_inv[P_IDX(ip, COMP_G_INV)];
 
-    double dx = px[ip] * dt_g;
-    double dy = py[ip] * dt_g;
-    double dz = pz[ip] * dt_g;
+    double dx = px[P_IDX(ip, COMP_PX)] * dt_g;
+    double dy = py[P_IDX(ip, COMP_PY)] * dt_g;
+    double dz = pz[P_IDX(ip, COMP_PZ)] * dt_g;
 
-    x[ip] = x[ip] + dx;
-    y[ip] = y[ip] + dy;
-    z[ip] = z[ip] + dz;
+    x[P_IDX(ip, COMP_X)] = x[P_IDX(ip, COMP_X)] + dx;
+    y[P_IDX(ip, COMP_Y)] = y[P_IDX(ip, COMP_Y)] + dy;
+    z[P_IDX(ip, COMP_Z)] = z[P_IDX(ip, COMP_Z)] + dz;
    }
 }
 
@@ -168,6 +436,158 @@ __kernel void data_align_dbl(
   }
 }
 
+// Copy sorted particle data of the storage type (PART_REAL)
+// to a new array
+__kernel void data_align_part(
+  __global PART_REAL *x,
+  __global PART_REAL *x_new,
+  __global uint *sorted_indx,
+  uint num_p)
+{
+  uint ip = (uint) get_global_id(0);
+  if (ip < num_p)
+   {
+    x_new[ip] = x[sorted_indx[ip]];
+   }
+}
+
+// Copy sorted packed particle records to a new array
+__kernel void data_align_record(
+  __global double *rec,
+  __global double *rec_new,
+  __global uint *sorted_indx,
+  uint num_p)
+{
+  uint ip = (uint) get_global_id(0);
+  if (ip < num_p)
+   {
+    vstore8(vload8(sorted_indx[ip], rec), ip, rec_new);
+   }
+}
+
+// Write a component array into the packed particle records
+// starting from the record ip_start
+__kernel void data_pack_comp(
+  __global double *x,
+  __global double *rec,
+  uint comp,
+  uint ip_start,
+  uint num_p)
+{
+  uint ip = (uint) get_global_id(0);
+  if (ip < num_p)
+   {
+    rec[(ip_start+ip)*PART_STRIDE + comp] = x[ip];
+   }
+}
+
+// Copy a component of the sorted packed records to a new array
+__kernel void data_gather_comp(
+  __global double *rec,
+  __global double *x_new,
+  __global uint *sorted_indx,
+  uint comp,
+  uint num_p)
+{
+  uint ip = (uint) get_global_id(0);
+  if (ip < num_p)
+   {
+    x_new[ip] = rec[sorted_indx[ip]*PART_STRIDE + comp];
+   }
+}
+
+// Mark the particles which stay in the grid (not in the overflow cell)
+__kernel void stay_mask(
+  __global uint *indx_in_cell,
+  __global uint *stay,
+           uint i_cell_overflow,
+           uint num_p)
+{
+  uint ip = (uint) get_global_id(0);
+  if (ip < num_p)
+   {
+    stay[ip] = (indx_in_cell[ip] < i_cell_overflow) ? 1U : 0U;
+   }
+}
+
+// Mark the particles with the coordinate inside (inside=1) or
+// outside (inside=0) of the interval [xmin, xmax)
+__kernel void range_mask(
+  __global double *x,
+  __global uint *mask,
+           double xmin,
+           double xmax,
+           uint inside,
+           uint num_p)
+{
+  uint ip = (uint) get_global_id(0);
+  if (ip < num_p)
+   {
+    double xp = x[P_IDX(ip, COMP_X)];
+    uint in_range = (xp >= xmin && xp < xmax) ? 1U : 0U;
+    mask[ip] = (in_range == inside) ? 1U : 0U;
+   }
+}
+
+// Get the indices of the staying particles in the storage order
+// from the exclusive prefix sum of their mask
+__kernel void compact_index(
+  __global uint *stay_offset,
+  __global uint *compact_indx,
+           uint num_p)
+{
+  uint ip = (uint) get_global_id(0);
+  if (ip < num_p)
+   {
+    uint i_new = stay_offset[ip];
+    if (stay_offset[ip+1] > i_new) {compact_indx[i_new] = ip;}
+   }
+}
+
+// Move the sorting indices of the staying particles to their
+// positions after the compaction
+__kernel void remap_sort_index(
+  __global uint *sorted_indx,
+  __global uint *stay_offset,
+  __global uint *sorted_indx_new,
+           uint num_p)
+{
+  uint ip = (uint) get_global_id(0);
+  if (ip < num_p)
+   {
+    sorted_indx_new[ip] = stay_offset[sorted_indx[ip]];
+   }
+}
+
+// Count the sorted particles which are stored farther than the
+// window from their predecessors in the sorted order
+__kernel void count_sort_jumps(
+  __global uint *sorted_indx,
+  __global uint *num_jumps,
+  uint window,
+  uint num_p)
+{
+  __local uint num_jumps_loc;
+  if (get_local_id(0) == 0) {num_jumps_loc = 0;}
+  barrier(CLK_LOCAL_MEM_FENCE);
+
+  uint ip = (uint) get_global_id(0);
+  if (ip > 0 && ip < num_p)
+   {
+    long jump = (long) sorted_indx[ip] - (long) sorted_indx[ip-1];
+    if (jump > (long) window || jump < -((long) window))
+     {
+      atom_add(&num_jumps_loc, 1U);
+     }
+   }
+  barrier(CLK_LOCAL_MEM_FENCE);
+
+  if (get_local_id(0) == 0 && num_jumps_loc > 0)
+   {
+    atom_add(num_jumps, num_jumps_loc);
+   }
+}
+
 // Copy sorted particle data of integer-type to a new array
 __kernel void data_align_int(
   __global uint *x,
@@ -183,19 +603,240 @@ __kernel void data_align_int(
 }
 
 
+// Sort particles by cells using their offsets. Positions within
+// the cells are counted in the local bins, so for the particles in
+// the tile only the work-group takes a place in the cell atomically.
+// The sort is skipped, if the number of movers is below movers_min
+// (see sort_incremental)
 __kernel void sort(
   __global uint *cell_offset,
   __global uint *indx_in_cell,
   __global uint *new_sum_in_cell,
   __global uint *sorted_indx,
-                  uint num_p)
+                  uint num_p,
+                  uint num_cells,
+  __global uint *num_movers,
+                  uint movers_min)
 {
+  __local uint sum_loc[BLOCK_SIZE];
+  __local uint sum_overflow;
+  __local uint tile_start;
+
+  // the condition is the same for all work-items
+  if (*num_movers < movers_min) {return;}
+
   uint ip = (uint) get_global_id(0);
+  uint i_cell_overflow = num_cells-1;
+  uint i_cell = i_cell_overflow;
+  uint ip_offset_loc = 0;
+  __local uint *bin = 0;
+
+  if (ip < num_p) {i_cell = indx_in_cell[ip];}
+
+  clear_local_bins(sum_loc, &sum_overflow);
+  if (get_local_id(0) == 0) {tile_start = i_cell;}
+  barrier(CLK_LOCAL_MEM_FENCE);
+
   if (ip < num_p)
    {
-    uint i_cell = indx_in_cell[ip];
-    uint ip_offset_loc = atom_add(&new_sum_in_cell[i_cell], 1U);
+    bin = get_local_bin(i_cell, i_cell_overflow, tile_start,
+                        sum_loc, &sum_overflow);
+    if (bin) {ip_offset_loc = atom_add(bin, 1U);}
+    else {ip_offset_loc = atom_add(&new_sum_in_cell[i_cell], 1U);}
+   }
+  barrier(CLK_LOCAL_MEM_FENCE);
+
+  merge_local_bins(i_cell_overflow, tile_start, sum_loc, &sum_overflow,
+                   new_sum_in_cell);
+  barrier(CLK_LOCAL_MEM_FENCE);
+
+  if (ip < num_p)
+   {
+    if (bin) {ip_offset_loc += *bin;}
     uint ip_sorted = cell_offset[i_cell] + ip_offset_loc;
     sorted_indx[ip_sorted] = ip;
    }
 }
+
+// Find new cell indicies of the particles, and count the particles
+// which changed their cells since the last sort (movers), with
+// the sums of movers leaving and entering each cell. The movers
+// are marked in the mask moved
+__kernel void index_and_count_movers(
+  __global double *x,
+  __global double *y,
+  __global double *z,
+  __constant uint *num_p,
+  __global uint *indx_in_cell,
+  __global uint *moved,
+  __global uint *sum_out_cell,
+  __global uint *sum_new_cell,
+  __global uint *num_movers,
+  __constant uint *Nx,
+  __constant double *xmin,
+  __constant double *dx_inv,
+  __constant uint *Nr,
+  __constant double *rmin,
+  __constant double *dr_inv)
+{
+  __local uint num_movers_loc;
+  if (get_local_id(0) == 0) {num_movers_loc = 0;}
+  barrier(CLK_LOCAL_MEM_FENCE);
+
+  uint ip = (uint) get_global_id(0);
+  if (ip < *num_p)
+   {
+    uint i_cell = get_cell_index(x[P_IDX(ip, COMP_X)], y[P_IDX(ip, COMP_Y)],
+                                 z[P_IDX(ip, COMP_Z)], *Nx, *xmin, *dx_inv,
+                                 *Nr, *rmin, *dr_inv);
+
+    uint i_cell_old = indx_in_cell[ip];
+    moved[ip] = (uint) (i_cell != i_cell_old);
+    if (i_cell != i_cell_old)
+     {
+      indx_in_cell[ip] = i_cell;
+      atom_add(&sum_out_cell[i_cell_old], 1U);
+      atom_add(&sum_new_cell[i_cell], 1U);
+      atom_add(&num_movers_loc, 1U);
+     }
+  }
+  barrier(CLK_LOCAL_MEM_FENCE);
+
+  if (get_local_id(0) == 0 && num_movers_loc > 0)
+   {
+    atom_add(num_movers, num_movers_loc);
+   }
+}
+
+// Advance particles coordinates, find their new cell indicies,
+// and count the movers in one pass
+__kernel void push_xyz_index_and_count_movers(
+  __global double *x,
+  __global double *y,
+  __global double *z,
+  __global PART_REAL *px,
+  __global PART_REAL *py,
+  __global PART_REAL *pz,
+  __global PART_REAL *g_inv,
+  __constant double *dt,
+  __constant uint *num_p,
+  __global uint *indx_in_cell,
+  __global uint *moved,
+  __global uint *sum_out_cell,
+  __global uint *sum_new_cell,
+  __global uint *num_movers,
+  __constant uint *Nx,
+  __constant double *xmin,
+  __constant double *dx_inv,
+  __constant uint *Nr,
+  __constant double *rmin,
+  __constant double *dr_inv)
+{
+  __local uint num_movers_loc;
+  if (get_local_id(0) == 0) {num_movers_loc = 0;}
+  barrier(CLK_LOCAL_MEM_FENCE);
+
+  uint ip = (uint) get_global_id(0);
+  if (ip < *num_p)
+   {
+    double dt_g = (*dt) * g_inv[P_IDX(ip, COMP_G_INV)];
+
+    double xp = x[P_IDX(ip, COMP_X)] + px[P_IDX(ip, COMP_PX)] * dt_g;
+    double yp = y[P_IDX(ip, COMP_Y)] + py[P_IDX(ip, COMP_PY)] * dt_g;
+    double zp = z[P_IDX(ip, COMP_Z)] + pz[P_IDX(ip, COMP_PZ)] * dt_g;
+
+    x[P_IDX(ip, COMP_X)] = xp;
+    y[P_IDX(ip, COMP_Y)] = yp;
+    z[P_IDX(ip, COMP_Z)] = zp;
+
+    uint i_cell = get_cell_index(xp, yp, zp, *Nx, *xmin, *dx_inv,
+                                 *Nr, *rmin, *dr_inv);
+
+    uint i_cell_old = indx_in_cell[ip];
+    moved[ip] = (uint) (i_cell != i_cell_old);
+    if (i_cell != i_cell_old)
+     {
+      indx_in_cell[ip] = i_cell;
+      atom_add(&sum_out_cell[i_cell_old], 1U);
+      atom_add(&sum_new_cell[i_cell], 1U);
+      atom_add(&num_movers_loc, 1U);
+     }
+  }
+  barrier(CLK_LOCAL_MEM_FENCE);
+
+  if (get_local_id(0) == 0 && num_movers_loc > 0)
+   {
+    atom_add(num_movers, num_movers_loc);
+   }
+}
+
+// Update numbers of particles per cell by the sums of movers
+__kernel void update_sum_in_cell(
+  __global uint *sum_in_cell,
+  __global uint *sum_out_cell,
+  __global uint *sum_new_cell,
+           uint num_cells)
+{
+  uint i_cell = (uint) get_global_id(0);
+  if (i_cell < num_cells)
+   {
+    sum_in_cell[i_cell] += sum_new_cell[i_cell] - sum_out_cell[i_cell];
+   }
+}
+
+// Flag the particles which stay in their cells, in the order
+// of the previous sort
+__kernel void stay_sorted(
+  __global uint *moved,
+  __global uint *sorted_indx_old,
+  __global uint *stay,
+           uint num_p)
+{
+  uint ip_sorted = (uint) get_global_id(0);
+  if (ip_sorted < num_p)
+   {
+    stay[ip_sorted] = 1U - moved[sorted_indx_old[ip_sorted]];
+   }
+}
+
+// Update sorting of the particles using the previous one: particles
+// staying in the cell are copied to its start keeping their order
+// (given by the prefix sum of the stay flags stay_offset), and the
+// movers are placed to the end of their new cells. It is run over
+// the particles, and skipped if the number of movers reaches
+// movers_min, when the counting sort is made instead
+__kernel void sort_incremental(
+  __global uint *cell_offset_old,
+  __global uint *cell_offset,
+  __global uint *indx_in_cell,
+  __global uint *moved,
+  __global uint *stay_offset,
+  __global uint *sum_new_cell,
+  __global uint *sorted_indx_old,
+  __global uint *sorted_indx,
+           uint num_p,
+  __global uint *num_movers,
+           uint movers_min)
+{
+  uint ip_sorted = (uint) get_global_id(0);
+  if (*num_movers >= movers_min) {return;}
+
+  if (ip_sorted < num_p)
+   {
+    uint ip = sorted_indx_old[ip_sorted];
+    uint i_cell = indx_in_cell[ip];
+
+    if (moved[ip] == 0U)
+     {
+      // staying particles before this one in its cell
+      uint ip_stay = stay_offset[ip_sorted]
+                     - stay_offset[cell_offset_old[i_cell]];
+      sorted_indx[cell_offset[i_cell] + ip_stay] = ip;
+     }
+    else
+     {
+      uint ip_offset_loc = atom_dec(&sum_new_cell[i_cell]);
+      sorted_indx[cell_offset[i_cell+1] - ip_offset_loc] = ip;
+     }
+   }
+}
@@ -0,0 +1,18 @@
+// this is a source of particles layout macros for chimeraCL project
+
+// Components of the packed particle record
+#define COMP_X 0
+#define COMP_Y 1
+#define COMP_Z 2
+#define COMP_PX 3
+#define COMP_PY 4
+#define COMP_PZ 5
+#define COMP_W 6
+#define COMP_G_INV 7
+
+// Index of the particle component. With the SoA layout (PART_STRIDE 1,
+// PART_PACKED 0) each component is a separate array, and with the AoS
+// layout (PART_STRIDE 8, PART_PACKED 1) all the components point to
+// the same array of records
+#define P_IDX(ip, comp) ((ip)*PART_STRIDE + PART_PACKED*(comp))
+
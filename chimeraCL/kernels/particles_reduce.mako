@@ -0,0 +1,97 @@
+/// this is a source of particles reduction kernels for chimeraCL project
+/// generated for the predicates on the components ${[p[0] for p in preds]}
+/// the components ${[c[0] for c in comps]}, the moments ${moments}
+/// and the value ${val} (see particles_methods_cl.py)
+
+<%def name="args()">
+% for i, (comp, idx, c_type) in enumerate(preds):
+  __global ${c_type} *pred_${i},
+           double vmin_${i},
+           double vmax_${i},
+% endfor
+% for comp, idx, c_type in comps:
+  __global ${c_type} *comp_${comp},
+% endfor
+</%def>
+
+<%def name="select()">
+    uint select = 1U;
+    double val;
+% for i, (comp, idx, c_type) in enumerate(preds):
+    val = (double) pred_${i}[P_IDX(ip, ${idx})];
+    if (!(val > vmin_${i} && val < vmax_${i})) {select = 0U;}
+% endfor
+</%def>
+
+<%def name="values()">
+% for comp, idx, c_type in comps:
+    double v_${comp} = (double) comp_${comp}[P_IDX(ip, ${idx})];
+% endfor
+% if 'g_inv' in [c[0] for c in comps]:
+    double v_gamma = 1.0 / v_g_inv;
+% endif
+</%def>
+
+// Sums of the products of the components (moments) over the particles
+// which satisfy all the predicates vmin < comp < vmax. Each work-group
+// sums its particles, and its sums are added by the first work-item in
+// a fixed order into the row moments_grp[i_grp, :]
+__kernel void select_moments(
+${args()}
+  __global double *moments_grp,
+  __local double *sum_loc,
+           uint num_p)
+{
+  uint i_loc = (uint) get_local_id(0);
+  uint n_loc = (uint) get_local_size(0);
+  uint i_grp = (uint) get_group_id(0);
+  uint n_grp = (uint) get_num_groups(0);
+
+% for k in range(len(moments)):
+  double sum_${k} = 0.0;
+% endfor
+
+  for (uint ip=i_grp*n_loc+i_loc; ip<num_p; ip+=n_grp*n_loc)
+   {
+${select()}
+    if (select == 1U)
+     {
+${values()}
+% for k, moment in enumerate(moments):
+      sum_${k} += ${' * '.join(['v_' + c for c in moment]) if len(moment) > 0 else '1.0'};
+% endfor
+     }
+   }
+
+% for k in range(len(moments)):
+  sum_loc[i_loc] = sum_${k};
+  barrier(CLK_LOCAL_MEM_FENCE);
+  if (i_loc == 0)
+   {
+    double sum = 0.0;
+    for (uint i=0; i<n_loc; i++) {sum += sum_loc[i];}
+    moments_grp[i_grp*${len(moments)} + ${k}] = sum;
+   }
+  barrier(CLK_LOCAL_MEM_FENCE);
+% endfor
+}
+
+% if val is not None:
+// Value of the particles and their weights, which are set to zero for
+// the particles which do not satisfy the predicates
+__kernel void select_values(
+${args()}
+  __global double *vals,
+  __global double *weights,
+           uint num_p)
+{
+  uint ip = (uint) get_global_id(0);
+  if (ip < num_p)
+   {
+${select()}
+${values()}
+    vals[ip] = v_${val};
+    weights[ip] = select * v_w;
+   }
+}
+% endif
@@ -0,0 +1,47 @@
+/// this is a source of particles selection kernels for chimeraCL project
+/// generated for the predicates on the components ${[p[0] for p in preds]}
+/// and the gathered components ${[c[0] for c in comps]}
+/// (see particles_methods_cl.py)
+
+// Mark the particles which satisfy all the predicates vmin < comp < vmax
+__kernel void select_mask(
+% for i, (comp, idx, c_type) in enumerate(preds):
+  __global ${c_type} *pred_${i},
+           double vmin_${i},
+           double vmax_${i},
+% endfor
+  __global uint *mask,
+           uint num_p)
+{
+  uint ip = (uint) get_global_id(0);
+  if (ip < num_p)
+   {
+    uint select = 1U;
+    double val;
+% for i, (comp, idx, c_type) in enumerate(preds):
+    val = (double) pred_${i}[P_IDX(ip, ${idx})];
+    if (!(val > vmin_${i} && val < vmax_${i})) {select = 0U;}
+% endfor
+    mask[ip] = select;
+   }
+}
+
+// Gather the components of the selected particles into the rows
+// of one compact array
+__kernel void select_gather(
+% for i, (comp, idx, c_type) in enumerate(comps):
+  __global ${c_type} *comp_${i},
+% endfor
+  __global double *data_sel,
+  __global uint *indx,
+           uint num_sel)
+{
+  uint i_sel = (uint) get_global_id(0);
+  if (i_sel < num_sel)
+   {
+    uint ip = indx[i_sel];
+% for i, (comp, idx, c_type) in enumerate(comps):
+    data_sel[${i}*num_sel + i_sel] = (double) comp_${i}[P_IDX(ip, ${idx})];
+% endfor
+   }
+}
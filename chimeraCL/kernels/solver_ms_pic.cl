@@ -54,6 +54,48 @@ __kernel void profile_edges_d(
    }
 }
 
+//  Kernel to multiply the left and right egdes of the stack of
+//  fields in (x, kr)-space by some (damping) profile, where the
+//  edges of Nf=0 are not damped. Stack modes are the first axis,
+//  and the 0 mode is kept real valued
+__kernel void profile_edges_stack(
+  __global FLD_REAL2 *x,
+  __global double *f,
+           uint stack_size,
+           uint mode_size,
+           uint Nx,
+           uint Nf_left,
+           uint Nf_right)
+{
+  uint i_cell = (uint) get_global_id(0);
+  if (i_cell < stack_size)
+   {
+    uint ir = i_cell/Nx;
+    uint ix = i_cell - ir*Nx;
+    double2 val = convert_double2(x[i_cell]);
+
+    if (i_cell < mode_size)
+      {
+        val.s1 = 0.0;
+      }
+
+    if (ix < Nf_left)
+      {
+        val.s0 *= f[ix];
+        val.s1 *= f[ix];
+      }
+
+    if (ix > Nx-Nf_right)
+      {
+        val.s0 *= f[Nx-ix];
+        val.s1 *= f[Nx-ix];
+      }
+
+    x[i_cell].s0 = val.s0;
+    x[i_cell].s1 = val.s1;
+   }
+}
+
 __kernel void advance_e_g_m(
   __constant uint *NxNr,
   __constant double *dt_inv,
@@ -141,3 +183,203 @@ __kernel void advance_e_g_m(
     g_z_m[i_grid] = (double2) {g1[2][0], g1[2][1]};
    }
 }
+
+
+//  Fused kernel of the field_grad and advance_e_g_m: the gradient of
+//  the scalar (charge density) is computed into n1 from the mode m and
+//  from the DHT-coupled contributions of modes m-1 (bm) and m+1 (bp)
+__kernel void advance_e_g_grad_m(
+  __constant uint *NxNr,
+  __constant uint *Nx,
+  __constant double *dt_inv,
+  __global double *c1_m,
+  __global double *c2_m,
+  __global double *c3_m,
+  __global double *kx,
+  __global double2 *scl_m,
+  __global double2 *bm,
+  __global double2 *bp,
+           uint use_minus,
+           uint use_plus,
+  __global double2 *e_x_m,
+  __global double2 *e_y_m,
+  __global double2 *e_z_m,
+  __global double2 *g_x_m,
+  __global double2 *g_y_m,
+  __global double2 *g_z_m,
+  __global double2 *j_x_m,
+  __global double2 *j_y_m,
+  __global double2 *j_z_m,
+  __global double2 *n0_x_m,
+  __global double2 *n0_y_m,
+  __global double2 *n0_z_m,
+  __global double2 *n1_x_m,
+  __global double2 *n1_y_m,
+  __global double2 *n1_z_m)
+{
+  uint i_grid = (uint) get_global_id(0);
+  if (i_grid < *NxNr)
+   {
+    uint ir = i_grid / (*Nx);
+    uint ix = i_grid - ir*(*Nx);
+
+    // gradient: n1 = (i*kx*scl, -bm + bp, -i*bm - i*bp)
+    double2 scl = scl_m[i_grid];
+    double2 b_m = (double2) {0., 0.};
+    double2 b_p = (double2) {0., 0.};
+    if (use_minus == 1) {b_m = bm[i_grid];}
+    if (use_plus == 1) {b_p = bp[i_grid];}
+
+    double n1[3][2] = {{-kx[ix]*scl.s1, kx[ix]*scl.s0},
+                       {b_p.s0 - b_m.s0, b_p.s1 - b_m.s1},
+                       {b_m.s1 + b_p.s1, -b_m.s0 - b_p.s0}
+                      };
+
+    n1_x_m[i_grid] = (double2) {n1[0][0], n1[0][1]};
+    n1_y_m[i_grid] = (double2) {n1[1][0], n1[1][1]};
+    n1_z_m[i_grid] = (double2) {n1[2][0], n1[2][1]};
+
+    double e0[3][2] = {{e_x_m[i_grid].s0, e_x_m[i_grid].s1},
+                       {e_y_m[i_grid].s0, e_y_m[i_grid].s1},
+                       {e_z_m[i_grid].s0, e_z_m[i_grid].s1}
+                      };
+
+    double g0[3][2] = {{g_x_m[i_grid].s0, g_x_m[i_grid].s1},
+                       {g_y_m[i_grid].s0, g_y_m[i_grid].s1},
+                       {g_z_m[i_grid].s0, g_z_m[i_grid].s1}
+                      };
+
+    double j0[3][2] = {{j_x_m[i_grid].s0, j_x_m[i_grid].s1},
+                       {j_y_m[i_grid].s0, j_y_m[i_grid].s1},
+                       {j_z_m[i_grid].s0, j_z_m[i_grid].s1}
+                      };
+
+    double n0[3][2] = {{n0_x_m[i_grid].s0, n0_x_m[i_grid].s1},
+                       {n0_y_m[i_grid].s0, n0_y_m[i_grid].s1},
+                       {n0_z_m[i_grid].s0, n0_z_m[i_grid].s1}
+                      };
+
+    double c1 = c1_m[i_grid];
+    double c2 = c2_m[i_grid];
+    double c3 = c3_m[i_grid];
+
+    double dt_inv_loc = *dt_inv;
+    double e1[3][2], g1[3][2];
+
+    double pi2 = 2 * M_PI;
+
+    for (int k=0;k<3;k++){
+        for (int i=0;i<2;i++){
+            j0[k][i] *= pi2;
+            n0[k][i] *= pi2;
+            n1[k][i] *= pi2;
+        }
+    }
+
+    for (int k=0;k<3;k++){
+        for (int i=0;i<2;i++){
+            e1[k][i] = c1*e0[k][i] + c2*c3*(g0[k][i]-j0[k][i]) +
+              c3*(c1*n0[k][i] - n1[k][i] -
+                  (n0[k][i]-n1[k][i]) * dt_inv_loc * c2 * c3);
+
+            g1[k][i] = -c2*e0[k][i] + c1*(g0[k][i]-j0[k][i]) + j0[k][i] +
+              c3*(dt_inv_loc*(1.-c1)*(n0[k][i]-n1[k][i]) - c2*n0[k][i]) ;
+        }
+    }
+    e_x_m[i_grid] = (double2) {e1[0][0], e1[0][1]};
+    e_y_m[i_grid] = (double2) {e1[1][0], e1[1][1]};
+    e_z_m[i_grid] = (double2) {e1[2][0], e1[2][1]};
+
+    g_x_m[i_grid] = (double2) {g1[0][0], g1[0][1]};
+    g_y_m[i_grid] = (double2) {g1[1][0], g1[1][1]};
+    g_z_m[i_grid] = (double2) {g1[2][0], g1[2][1]};
+   }
+}
+
+//  Stack the DHT-coupled parts of the rotor for the neighbour mode
+//  (m-1 with sgn=-1 and m+1 with sgn=1): [sgn*v_z + i*v_y, v_x]
+__kernel void stack_rot_m(
+  __global FLD_REAL2 *stack,
+  __global double2 *v_x_m,
+  __global double2 *v_y_m,
+  __global double2 *v_z_m,
+           double sgn,
+  __constant uint *NxNr,
+  __constant uint *Nx)
+{
+  uint i_grid = (uint) get_global_id(0);
+  if (i_grid < *NxNr)
+   {
+    uint ir = i_grid / (*Nx);
+    uint ix = i_grid - ir*(*Nx);
+    uint i_stack = ix + 2*ir*(*Nx);
+
+    double2 v_y = v_y_m[i_grid];
+    double2 v_z = v_z_m[i_grid];
+
+    double2 v_x = v_x_m[i_grid];
+
+    stack[i_stack] = (FLD_REAL2) {sgn*v_z.s0 - v_y.s1, sgn*v_z.s1 + v_y.s0};
+    stack[i_stack + *Nx] = (FLD_REAL2) {v_x.s0, v_x.s1};
+   }
+}
+
+//  Fused kernel of field_rot and field_poiss_vec: the rotor of the
+//  mode m is assembled from the kx-terms and the DHT-transformed
+//  stacks of the modes m-1 (sm) and m+1 (sp), and is multiplied by
+//  the Poisson factor
+__kernel void rot_poiss_m(
+  __constant uint *NxNr,
+  __constant uint *Nx,
+  __global double *kx,
+  __global double *poiss_m,
+  __global double2 *v_y_m,
+  __global double2 *v_z_m,
+  __global FLD_REAL2 *sm,
+  __global FLD_REAL2 *sp,
+           uint use_minus,
+           uint use_plus,
+  __global double2 *u_x_m,
+  __global double2 *u_y_m,
+  __global double2 *u_z_m)
+{
+  uint i_grid = (uint) get_global_id(0);
+  if (i_grid < *NxNr)
+   {
+    uint ir = i_grid / (*Nx);
+    uint ix = i_grid - ir*(*Nx);
+    uint i_stack = ix + 2*ir*(*Nx);
+
+    double2 v_y = v_y_m[i_grid];
+    double2 v_z = v_z_m[i_grid];
+    double kx_loc = kx[ix];
+    double poiss = poiss_m[i_grid];
+
+    // kx-terms: (0, -i*kx*v_z, i*kx*v_y)
+    double2 u_x = (double2) {0., 0.};
+    double2 u_y = (double2) { kx_loc*v_z.s1, -kx_loc*v_z.s0};
+    double2 u_z = (double2) {-kx_loc*v_y.s1,  kx_loc*v_y.s0};
+
+    if (use_minus == 1)
+     {
+      double2 s0 = convert_double2(sm[i_stack]);
+      double2 s1 = convert_double2(sm[i_stack + *Nx]);
+      u_x += s0;
+      u_y += (double2) {s1.s1, -s1.s0};
+      u_z += s1;
+     }
+
+    if (use_plus == 1)
+     {
+      double2 s0 = convert_double2(sp[i_stack]);
+      double2 s1 = convert_double2(sp[i_stack + *Nx]);
+      u_x += s0;
+      u_y += (double2) {s1.s1, -s1.s0};
+      u_z -= s1;
+     }
+
+    u_x_m[i_grid] = poiss*u_x;
+    u_y_m[i_grid] = poiss*u_y;
+    u_z_m[i_grid] = poiss*u_z;
+   }
+}
@@ -55,18 +55,18 @@ __kernel void get_phase_minus(
 }
 
 // Multiply transofmed fields by phase along X axis
+// (last axis of a stack of fields)
 __kernel void multiply_by_phase(
-  __global double2 *arr,
-  __constant uint *NxNr,
-  __constant uint *Nx,
+  __global FLD_REAL2 *arr,
+           uint arr_size,
+           uint Nx,
   __global double2 *phs_shft)
 {
   uint i_cell = (uint) get_global_id(0);
-  if (i_cell < *NxNr)
+  if (i_cell < arr_size)
    {
-    uint Nx_loc = *Nx;
-    uint ir = i_cell/Nx_loc;
-    uint ix = i_cell - ir*Nx_loc;
+    uint ir = i_cell/Nx;
+    uint ix = i_cell - ir*Nx;
 
     double arr_re = arr[i_cell].s0;
     double arr_im = arr[i_cell].s1;
@@ -78,3 +78,143 @@ __kernel void multiply_by_phase(
     arr[i_cell].s1 = (arr_re*phs_im + arr_im*phs_re);
    }
 }
+
+
+// Stacks of fields have the shape (Nmodes, Nr-1, Nfld, Nx), so that each
+// mode is a matrix (Nr-1, Nfld*Nx) for the DHT, and x is the last axis for
+// the FFT. Field arrays may have the guard row, which is skipped by the
+// fld_offset=Nx. Stacks are of FLD_REAL type, while the fields are double
+
+// Copy a double-type field into the stack of fields
+__kernel void stack_fld_d(
+  __global FLD_REAL *stack,
+  __global double *fld,
+           uint i_fld,
+           uint i_mode,
+           uint Nfld,
+           uint Nx,
+           uint NxNrm1,
+           uint fld_offset)
+{
+  uint i_grid = (uint) get_global_id(0);
+  if (i_grid < NxNrm1)
+   {
+    uint ir = i_grid/Nx;
+    uint ix = i_grid - ir*Nx;
+    uint i_stack = ix + Nx*(i_fld + Nfld*(ir + (NxNrm1/Nx)*i_mode));
+
+    stack[i_stack] = fld[i_grid + fld_offset];
+   }
+}
+
+// Copy a double-type field into the stack of complex fields
+__kernel void stack_fld_d2c(
+  __global FLD_REAL2 *stack,
+  __global double *fld,
+           uint i_fld,
+           uint i_mode,
+           uint Nfld,
+           uint Nx,
+           uint NxNrm1,
+           uint fld_offset)
+{
+  uint i_grid = (uint) get_global_id(0);
+  if (i_grid < NxNrm1)
+   {
+    uint ir = i_grid/Nx;
+    uint ix = i_grid - ir*Nx;
+    uint i_stack = ix + Nx*(i_fld + Nfld*(ir + (NxNrm1/Nx)*i_mode));
+
+    stack[i_stack].s0 = fld[i_grid + fld_offset];
+    stack[i_stack].s1 = 0.0;
+   }
+}
+
+// Copy a complex-type field into the stack of fields
+__kernel void stack_fld_c(
+  __global FLD_REAL2 *stack,
+  __global double2 *fld,
+           uint i_fld,
+           uint i_mode,
+           uint Nfld,
+           uint Nx,
+           uint NxNrm1,
+           uint fld_offset)
+{
+  uint i_grid = (uint) get_global_id(0);
+  if (i_grid < NxNrm1)
+   {
+    uint ir = i_grid/Nx;
+    uint ix = i_grid - ir*Nx;
+    uint i_stack = ix + Nx*(i_fld + Nfld*(ir + (NxNrm1/Nx)*i_mode));
+
+    stack[i_stack].s0 = fld[i_grid + fld_offset].s0;
+    stack[i_stack].s1 = fld[i_grid + fld_offset].s1;
+   }
+}
+
+// Copy a double-type field from the stack of fields
+__kernel void unstack_fld_d(
+  __global FLD_REAL *stack,
+  __global double *fld,
+           uint i_fld,
+           uint i_mode,
+           uint Nfld,
+           uint Nx,
+           uint NxNrm1,
+           uint fld_offset)
+{
+  uint i_grid = (uint) get_global_id(0);
+  if (i_grid < NxNrm1)
+   {
+    uint ir = i_grid/Nx;
+    uint ix = i_grid - ir*Nx;
+    uint i_stack = ix + Nx*(i_fld + Nfld*(ir + (NxNrm1/Nx)*i_mode));
+
+    fld[i_grid + fld_offset] = stack[i_stack];
+   }
+}
+
+// Copy real part of a field from the stack of complex fields
+__kernel void unstack_fld_c2d(
+  __global FLD_REAL2 *stack,
+  __global double *fld,
+           uint i_fld,
+           uint i_mode,
+           uint Nfld,
+           uint Nx,
+           uint NxNrm1,
+           uint fld_offset)
+{
+  uint i_grid = (uint) get_global_id(0);
+  if (i_grid < NxNrm1)
+   {
+    uint ir = i_grid/Nx;
+    uint ix = i_grid - ir*Nx;
+    uint i_stack = ix + Nx*(i_fld + Nfld*(ir + (NxNrm1/Nx)*i_mode));
+
+    fld[i_grid + fld_offset] = stack[i_stack].s0;
+   }
+}
+
+// Copy a complex-type field from the stack of fields
+__kernel void unstack_fld_c(
+  __global FLD_REAL2 *stack,
+  __global double2 *fld,
+           uint i_fld,
+           uint i_mode,
+           uint Nfld,
+           uint Nx,
+           uint NxNrm1,
+           uint fld_offset)
+{
+  uint i_grid = (uint) get_global_id(0);
+  if (i_grid < NxNrm1)
+   {
+    uint ir = i_grid/Nx;
+    uint ix = i_grid - ir*Nx;
+    uint i_stack = ix + Nx*(i_fld + Nfld*(ir + (NxNrm1/Nx)*i_mode));
+
+    fld[i_grid + fld_offset] = convert_double2(stack[i_stack]);
+   }
+}
@@ -1,4 +1,6 @@
 import numpy as np
+import os
+from hashlib import sha1
 
 from pyopencl.array import zeros
 from pyopencl.array import empty
@@ -6,8 +8,18 @@ from pyopencl import CommandQueue
 from pyopencl import device_type
 from pyopencl import create_some_context
 from pyopencl import enqueue_barrier
+from pyopencl import enqueue_copy
+from pyopencl import enqueue_map_buffer
+from pyopencl import Buffer
+from pyopencl import mem_flags
+from pyopencl import map_flags
+from pyopencl import LocalMemory
 from pyopencl import Program
+from pyopencl import Kernel
+from pyopencl import program_info
+from pyopencl import Error as CLError
 from reikna.cluda import ocl_api
+from mako.template import Template
 
 from chimeraCL import __path__ as src_path
 src_path = src_path[0] + '/kernels/'
@@ -15,27 +27,45 @@ src_path = src_path[0] + '/kernels/'
 compiler_options = ['-cl-fast-relaxed-math',]
 #compiler_options = []
 
+# With the 'single' particles precision the particles momenta, inverse
+# gamma-factors and weights are stored in float32 (kernels compute in
+# double). It concerns only the particles storage, the coordinates are
+# always kept in double precision
+part_precision_types = {'double': (np.double, 'double'),
+                        'single': (np.float32, 'float')}
+
+# With the 'single' fields precision the deposition buffers (local tiles
+# and their halos) are float32, and the stacks of fields, which are
+# transformed by FFT and DHT, are float32 and complex64. The DHT products
+# are accumulated in double, and the real space and spectral fields are
+# always kept in double precision
+fld_precision_types = {'double': (np.double, np.complex128, 'double'),
+                       'single': (np.float32, np.complex64, 'float')}
+
+default_cache_dir = os.path.join(os.path.expanduser('~'), '.cache',
+                                 'chimeraCL')
+
 
 class GenericMethodsCL:
     def init_generic_methods(self):
         self.set_global_working_group_size()
 
-        generic_sources = []
-        generic_sources.append(''.join(open(src_path+"generic.cl")\
-                               .readlines()) )
-
-        generic_sources = self.block_def_str + ''.join(generic_sources)
-
-        prg = Program(self.ctx, generic_sources).\
-            build(options=compiler_options)
+        prg = self.build_program(["generic.cl", ])
 
         self._cast_array_d2c_knl = prg.cast_array_d2c
+        self._cast_array_r2c_knl = prg.cast_array_r2c
         self._axpbyz_c2c_knl = prg.axpbyz_c2c
         self._zpaxz_c2c_knl = prg.zpaxz_c2c
         self._ab_dot_x_knl =  prg.ab_dot_x
         self._append_c2c_knl = prg.append_c2c
         self._set_cdouble_to_knl = prg.set_cdouble_to
         self._mult_elementwise_knl = prg.mult_elementwise_d2c
+        self._get_columns_knl = prg.get_columns
+        self._set_columns_knl = prg.set_columns
+        self._sum_sq_cols_d_knl = prg.sum_sq_cols_d
+        self._sum_sq_cols_c_knl = prg.sum_sq_cols_c
+        self._histogram_w_knl = prg.histogram_w
+        self._sum_rows_d_knl = prg.sum_rows_d
 
     def set_global_working_group_size(self):
         if self.dev_type=='CPU':
@@ -45,6 +75,29 @@ class GenericMethodsCL:
 
         self.block_def_str = "#define BLOCK_SIZE {:d}\n".format(self.WGS)
 
+    def build_program(self, source_files, defines={}, render_args={}):
+        """
+        Get the program made of the list of source files. Program is
+        compiled only once per context, and its binary is kept on disk.
+        The defines dictionary is prepended as preprocessor macros
+        (PART_REAL follows the particles precision, and FLD_REAL and
+        FLD_REAL2 the fields one, unless they are given), and the *.mako
+        sources are rendered with render_args.
+        """
+        sources = []
+        for fname in source_files:
+            source = ''.join(open(src_path + fname).readlines())
+            if fname.endswith('.mako'):
+                source = Template(source).render(**render_args)
+            sources.append(source)
+        defines = dict({'PART_REAL': self.part_real,
+                        'FLD_REAL': self.fld_real,
+                        'FLD_REAL2': self.fld_real + '2'}, **defines)
+        defs_str = ''.join(["#define {} {}\n".format(key, defines[key])
+                            for key in sorted(defines.keys())])
+        sources = self.block_def_str + defs_str + ''.join(sources)
+        return self.comm.get_program(sources, self.WGS)
+
     def get_wgs(self,Nelem):
         if Nelem <= self.WGS:
             return Nelem, Nelem
@@ -86,60 +139,252 @@ class GenericMethodsCL:
                 self.set_to(arr, val)
         return arr
 
-    def cast_array_c2d(self,arr_in, arr_out):
-        arr_size = arr_in.size
+    def host_arr(self, shape, dtype=np.double):
+        """
+        Allocate the host array in the pinned (page-locked) memory,
+        which is used for the non-blocking copies from the device
+        """
+        nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        if nbytes == 0:
+            return np.empty(shape, dtype=dtype)
+
+        buff = Buffer(self.ctx, mem_flags.READ_WRITE | \
+                      mem_flags.ALLOC_HOST_PTR, nbytes)
+        arr, evnt = enqueue_map_buffer(self.queue, buff,
+                                       map_flags.READ | map_flags.WRITE,
+                                       0, shape, dtype)
+        evnt.wait()
+        return arr
+
+    def get_async(self, arr, arr_host, wait_for=None):
+        """
+        Enqueue the non-blocking copy of the contiguous device array to
+        the host one, and return its event. The host array should not
+        be read before the event is complete
+        """
+        if arr.size == 0:
+            return enqueue_barrier(self.queue, wait_for=wait_for)
+
+        return enqueue_copy(self.queue, arr_host.reshape(-1)[:arr.size],
+                            arr.base_data,
+                            src_offset=arr.offset, is_blocking=False,
+                            wait_for=wait_for)
+
+    def set_from_host(self, arr, arr_host):
+        """
+        Copy the host data into the contiguous device array (blocking)
+        """
+        if arr.size == 0:
+            return
+
+        enqueue_copy(self.queue, arr.base_data,
+                     np.ascontiguousarray(arr_host, dtype=arr.dtype),
+                     dst_offset=arr.offset, is_blocking=True)
+
+    def complete(self, evnt):
+        """
+        Finalize the enqueued operation: in the synchronous mode host
+        waits for it, in the asynchronous mode the event is only
+        returned to be used in `wait_for` lists of the next launches
+        """
+        if not self.asynchronous:
+            evnt.wait()
+        return evnt
+
+    def cast_array_c2d(self,arr_in, arr_out, arr_size=None, wait_for=None):
+        if arr_size is None:
+            arr_size = arr_in.size
+        WGS, WGS_tot = self.get_wgs(arr_size)
+        evnt = self._cast_array_d2c_knl(self.queue, (WGS_tot, ), (WGS, ),
+                                        arr_in.data, arr_out.data,
+                                        np.uint32(arr_size),
+                                        wait_for=wait_for)
+        return self.complete(evnt)
+
+    def cast_array_r2c(self,arr_in, arr_out, arr_size=None, wait_for=None):
+        if arr_size is None:
+            arr_size = arr_in.size
         WGS, WGS_tot = self.get_wgs(arr_size)
-        self._cast_array_d2c_knl(self.queue, (WGS_tot, ), (WGS, ),
-                                 arr_in.data, arr_out.data,
-                                 np.uint32(arr_size)).wait()
+        evnt = self._cast_array_r2c_knl(self.queue, (WGS_tot, ), (WGS, ),
+                                        arr_in.data, arr_out.data,
+                                        np.uint32(arr_size),
+                                        wait_for=wait_for)
+        return self.complete(evnt)
 
-    def set_to(self, arr, val):
+    def set_to(self, arr, val, wait_for=None):
         if self.dev_type=='CPU' and arr.dtype == np.complex128:
             # just a workaround the stupid Apple CL implementation for CPU..
             arr_size = arr.size
             WGS, WGS_tot = self.get_wgs(arr_size)
-            self._set_cdouble_to_knl(self.queue, (WGS_tot, ), (WGS, ),
-                                     arr.data, np.complex128(val),
-                                     np.uint32(arr_size)).wait()
+            evnt = self._set_cdouble_to_knl(self.queue, (WGS_tot, ), (WGS, ),
+                                            arr.data, np.complex128(val),
+                                            np.uint32(arr_size),
+                                            wait_for=wait_for)
         else:
-            arr.fill(val)
+            evnt = arr.fill(val, wait_for=wait_for).events[-1]
+        return self.complete(evnt)
 
-    def append_c2c(self, arr_base, arr_add):
+    def append_c2c(self, arr_base, arr_add, wait_for=None):
         arr_size = arr_base.size
         WGS, WGS_tot = self.get_wgs(arr_size)
-        self._append_c2c_knl(self.queue, (WGS_tot, ), (WGS, ),
-                             arr_base.data, arr_add.data,
-                             np.uint32(arr_size)).wait()
+        evnt = self._append_c2c_knl(self.queue, (WGS_tot, ), (WGS, ),
+                                    arr_base.data, arr_add.data,
+                                    np.uint32(arr_size), wait_for=wait_for)
+        return self.complete(evnt)
 
-    def mult_elementwise(self, x, z):
+    def mult_elementwise(self, x, z, wait_for=None):
         arr_size = x.size
         WGS, WGS_tot = self.get_wgs(arr_size)
-        self._mult_elementwise_knl(self.queue, (WGS_tot, ), (WGS, ),
-            x.data, z.data, np.uint32(arr_size) ).wait()
+        evnt = self._mult_elementwise_knl(self.queue, (WGS_tot, ), (WGS, ),
+            x.data, z.data, np.uint32(arr_size), wait_for=wait_for)
+        return self.complete(evnt)
 
-    def axpbyz(self, a, x, b, y, z):
+    def axpbyz(self, a, x, b, y, z, wait_for=None):
         arr_size = x.size
         WGS, WGS_tot = self.get_wgs(arr_size)
-        self._axpbyz_c2c_knl(self.queue, (WGS_tot, ), (WGS, ),
-                             np.complex128(a), x.data,
-                             np.complex128(b), y.data,
-                             z.data, np.uint32(arr_size) ).wait()
+        evnt = self._axpbyz_c2c_knl(self.queue, (WGS_tot, ), (WGS, ),
+                                    np.complex128(a), x.data,
+                                    np.complex128(b), y.data,
+                                    z.data, np.uint32(arr_size),
+                                    wait_for=wait_for)
+        return self.complete(evnt)
 
-    def zpaxz(self, z, a, x):
+    def zpaxz(self, z, a, x, wait_for=None):
         arr_size = x.size
         WGS, WGS_tot = self.get_wgs(arr_size)
-        self._zpaxz_c2c_knl(self.queue, (WGS_tot, ), (WGS, ),
-                            np.complex128(a), x.data,
-                            z.data, np.uint32(arr_size) ).wait()
+        evnt = self._zpaxz_c2c_knl(self.queue, (WGS_tot, ), (WGS, ),
+                                   np.complex128(a), x.data,
+                                   z.data, np.uint32(arr_size),
+                                   wait_for=wait_for)
+        return self.complete(evnt)
 
 
-    def ab_dot_x(self, a, b, x, z):
+    def ab_dot_x(self, a, b, x, z, wait_for=None):
         arr_size = x.size
         WGS, WGS_tot = self.get_wgs(arr_size)
-        self._ab_dot_x_knl(self.queue, (WGS_tot, ), (WGS, ),
-                           np.complex128(a), b.data, x.data,
-                           z.data, np.uint32(self.Args['NxNrm1']),
-                           np.uint32(self.Args['Nx']) ).wait()
+        evnt = self._ab_dot_x_knl(self.queue, (WGS_tot, ), (WGS, ),
+                                  np.complex128(a), b.data, x.data,
+                                  z.data, np.uint32(self.Args['NxNrm1']),
+                                  np.uint32(self.Args['Nx']),
+                                  wait_for=wait_for)
+        return self.complete(evnt)
+
+    def pack_columns(self, arrs, ix0, ncols):
+        """
+        Copy the columns [ix0, ix0+ncols) along the last axis of the
+        arrays into one contiguous double device buffer, the arrays
+        following each other. Complex arrays are copied as the double
+        ones with twice more columns (complex64 with the same columns)
+        """
+        sizes = [arr.size // arr.shape[-1] * ncols * (arr.dtype.itemsize//8)
+                 for arr in arrs]
+        buff = self.dev_arr(dtype=np.double, shape=(sum(sizes), ))
+
+        buff_offset = 0
+        for arr, size in zip(arrs, sizes):
+            scale = arr.dtype.itemsize // 8
+            WGS, WGS_tot = self.get_wgs(size)
+            evnt = self._get_columns_knl(self.queue, (WGS_tot, ), (WGS, ),
+                                         arr.data, buff.data,
+                                         np.uint32(arr.shape[-1]*scale),
+                                         np.uint32(ix0*scale),
+                                         np.uint32(ncols*scale),
+                                         np.uint32(size),
+                                         np.uint32(buff_offset))
+            self.complete(evnt)
+            buff_offset += size
+        return buff
+
+    def unpack_columns(self, arrs, buff, ix0, ncols, add=False):
+        """
+        Write or add the buffer made by pack_columns to the columns
+        [ix0, ix0+ncols) along the last axis of the arrays
+        """
+        buff_offset = 0
+        for arr in arrs:
+            scale = arr.dtype.itemsize // 8
+            size = arr.size // arr.shape[-1] * ncols * scale
+            WGS, WGS_tot = self.get_wgs(size)
+            evnt = self._set_columns_knl(self.queue, (WGS_tot, ), (WGS, ),
+                                         arr.data, buff.data,
+                                         np.uint32(arr.shape[-1]*scale),
+                                         np.uint32(ix0*scale),
+                                         np.uint32(ncols*scale),
+                                         np.uint32(size),
+                                         np.uint32(buff_offset),
+                                         np.uint32(add))
+            self.complete(evnt)
+            buff_offset += size
+
+    def sum_sq_cols(self, fld, weights, out, factor=1.):
+        """
+        Add the squared modules of the 2D field summed along the first
+        axis with the weights to the device array out (of the length
+        of the last axis)
+        """
+        Nr, Nx = fld.shape
+        if fld.dtype == np.double:
+            sum_knl = self._sum_sq_cols_d_knl
+        else:
+            sum_knl = self._sum_sq_cols_c_knl
+
+        WGS, WGS_tot = self.get_wgs(Nx)
+        evnt = sum_knl(self.queue, (WGS_tot, ), (WGS, ), fld.data,
+                       weights.data, out.data, np.double(factor),
+                       np.uint32(Nx), np.uint32(Nr))
+        return self.complete(evnt)
+
+    def histogram(self, vals, weights, vmin, vmax, num_bins,
+                  num_groups=64):
+        """
+        Get the histogram of the double values with the weights in
+        num_bins bins of [vmin, vmax) as a device array. The partial
+        histograms of the work-groups are summed by the second kernel
+        """
+        num_p = vals.size
+        num_groups = max(1, min(num_groups,
+                                int(np.ceil(num_p / self.WGS))))
+        hist_grps = self.dev_arr(dtype=np.double,
+                                 shape=(num_groups, num_bins))
+        hist = self.dev_arr(dtype=np.double, shape=num_bins)
+
+        evnt = self._histogram_w_knl(self.queue,
+            (num_groups*self.WGS, ), (self.WGS, ),
+            vals.data, weights.data, hist_grps.data,
+            LocalMemory(4*self.WGS), LocalMemory(8*self.WGS),
+            LocalMemory(8*num_bins), np.double(vmin),
+            np.double(num_bins / (vmax - vmin)), np.uint32(num_bins),
+            np.uint32(num_p))
+        self.complete(evnt)
+
+        self.sum_rows(hist_grps, hist)
+        return hist
+
+    def sum_rows(self, arr, out):
+        """
+        Sum the rows of the 2D double device array into the device
+        array out (of the length of the last axis)
+        """
+        nrows, ncols = arr.shape
+        WGS, WGS_tot = self.get_wgs(ncols)
+        evnt = self._sum_rows_d_knl(self.queue, (WGS_tot, ), (WGS, ),
+                                    arr.data, out.data, np.uint32(ncols),
+                                    np.uint32(nrows))
+        return self.complete(evnt)
+
+    def copy_to(self, arr, arr_out, offset=0):
+        """
+        Enqueue the copy of the contiguous device array into the
+        device array arr_out starting from the element offset
+        """
+        if arr.size == 0:
+            return enqueue_barrier(self.queue)
+
+        evnt = enqueue_copy(self.queue, arr_out.base_data, arr.base_data,
+                            byte_count=arr.nbytes, src_offset=arr.offset,
+                            dst_offset=arr_out.offset
+                                       + offset*arr_out.dtype.itemsize)
+        return self.complete(evnt)
 
     def import_comm(self, comm):
         self.comm = comm
@@ -148,9 +393,32 @@ class GenericMethodsCL:
         self.thr = comm.thr
         self.dev_type = comm.dev_type
         self.plat_name = comm.plat_name
+        self.asynchronous = comm.asynchronous
+        self.part_precision = comm.part_precision
+        self.part_dtype, self.part_real = \
+            part_precision_types[comm.part_precision]
+        self.fld_precision = comm.fld_precision
+        self.fld_dtype, self.fld_cdtype, self.fld_real = \
+            fld_precision_types[comm.fld_precision]
+
+class ProgramKernels:
+    """
+    Built program which creates each of its kernels only once, so
+    they can be shared between the instances using the same context
+    """
+    def __init__(self, prg):
+        self.prg = prg
+        self.kernels = {}
+
+    def __getattr__(self, name):
+        if name not in self.kernels:
+            self.kernels[name] = Kernel(self.prg, name)
+        return self.kernels[name]
 
 class Communicator:
-    def __init__(self, **ctx_kw_args):
+    def __init__(self, asynchronous=False, part_precision='double',
+                 fld_precision='double', cache_dir=default_cache_dir,
+                 **ctx_kw_args):
         print("""
 \t############ WELCOME TO CHIMERA.CL ############
 """)
@@ -166,6 +434,33 @@ class Communicator:
         self.ctx = create_some_context(**ctx_kw_args)
         self.queue = CommandQueue(self.ctx)
 
+        # In the asynchronous mode methods do not block the host after
+        # the launches, and the host is synchronized only by the data
+        # transfers. The queue is in-order, so that the launches are
+        # executed in the order they are enqueued.
+        self.asynchronous = asynchronous
+
+        # Precision of the particles storage, 'double' or 'single'
+        # (see part_precision_types)
+        if part_precision not in part_precision_types:
+            print("Particles precision {} is not known, 'double' is used".
+                  format(part_precision))
+            part_precision = 'double'
+        self.part_precision = part_precision
+
+        # Precision of the deposition buffers and of the stacks of fields
+        # in the transforms, 'double' or 'single' (see fld_precision_types)
+        if fld_precision not in fld_precision_types:
+            print("Fields precision {} is not known, 'double' is used".
+                  format(fld_precision))
+            fld_precision = 'double'
+        self.fld_precision = fld_precision
+
+        # Built programs are registered per context, and their binaries
+        # are stored in the cache_dir (set it to None to disable)
+        self.programs = {}
+        self.cache_dir = cache_dir
+
         api = ocl_api()
         self.thr = api.Thread(cqd=self.queue)
 
@@ -193,3 +488,51 @@ class Communicator:
             self.dot_method = 'NumPy'
         else:
             self.dot_method = 'Reikna'
+
+    def get_program(self, sources, block_size):
+        """
+        Get the built program from the registry, or from the binary
+        on disk, or build it from the sources. The key includes the
+        source, block size, compiler options and the device
+        """
+        dev = self.queue.device
+        key_items = [sources, str(block_size), ' '.join(compiler_options),
+                     dev.name, dev.platform.name, dev.platform.version,
+                     dev.driver_version]
+        key = sha1('\n'.join(key_items).encode()).hexdigest()
+
+        if key in self.programs:
+            return self.programs[key]
+
+        prg = None
+        if self.cache_dir is not None:
+            fname = os.path.join(self.cache_dir, key + '.bin')
+            if os.path.exists(fname):
+                binary = open(fname, 'rb').read()
+                try:
+                    prg = Program(self.ctx, [dev, ], [binary, ]).\
+                        build(options=compiler_options)
+                except CLError:
+                    prg = None
+
+        if prg is None:
+            prg = Program(self.ctx, sources).build(options=compiler_options)
+
+            if self.cache_dir is not None:
+                self._store_binary(prg, fname)
+
+        self.programs[key] = ProgramKernels(prg)
+        return self.programs[key]
+
+    def _store_binary(self, prg, fname):
+        devices = prg.get_info(program_info.DEVICES)
+        binary = prg.get_info(program_info.BINARIES)\
+            [devices.index(self.queue.device)]
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            fname_tmp = fname + '.' + str(os.getpid())
+            with open(fname_tmp, 'wb') as f:
+                f.write(binary)
+            os.replace(fname_tmp, fname)
+        except OSError:
+            print('\t\tCannot write the program binary to', self.cache_dir)
@@ -1,13 +1,9 @@
 import numpy as np
 
-from pyopencl import Program
 from pyopencl import enqueue_marker, enqueue_barrier
 
 from .generic_methods_cl import GenericMethodsCL
-from .generic_methods_cl import compiler_options
-
-from chimeraCL import __path__ as src_path
-src_path = src_path[0] + '/kernels/'
+from .particles_methods_cl import part_layout_defines
 
 
 class GridMethodsCL(GenericMethodsCL):
@@ -15,17 +11,16 @@ class GridMethodsCL(GenericMethodsCL):
         self.init_generic_methods()
         self.set_global_working_group_size()
 
-        grid_sources = []
-        grid_sources.append(''.join(open(src_path+"grid_generic.cl")\
-              .readlines()) )
-        grid_sources.append(''.join( \
-              open(src_path+"grid_deposit_m"+str(self.Args['M'])+".cl")\
-              .readlines() ) )
-
-        grid_sources = self.block_def_str + ''.join(grid_sources)
-
-        prg = Program(self.ctx, grid_sources).\
-            build(options=compiler_options)
+        self._tile_defs = {'TILE_NX': self.Args['TileNx'],
+                           'TILE_NR': self.Args['TileNr'],
+                           'TILE_GL': self.Args['TileGL'],
+                           'TILE_GU': self.Args['TileGU']}
+        self._shape_args = {'M': self.Args['M'],
+                            'order': self.Args['ShapeOrder'],
+                            'S': self.Args['ShapeNodes'],
+                            'lo': self.Args['ShapeOffset']}
+        self._layout_knls = {}
+        prg = self._build_layout_kernels('SoA')
 
         self._divide_by_dv_d_knl = prg.divide_by_dv_d
         self._divide_by_dv_c_knl = prg.divide_by_dv_c
@@ -33,15 +28,38 @@ class GridMethodsCL(GenericMethodsCL):
         self._treat_axis_c_knl = prg.treat_axis_c
         self._warp_axis_m0_d_knl = prg.warp_axis_m0_d
         self._warp_axis_m1plus_c_knl = prg.warp_axis_m1plus_c
-
-        self._depose_scalar_knl = prg.depose_scalar
-        self._depose_vector_knl = prg.depose_vector
-        self._gather_and_push_knl = prg.gather_and_push
+        self._add_tile_halo_d_knl = prg.add_tile_halo_d
+        self._add_tile_halo_c_knl = prg.add_tile_halo_c
 
         if 'vec_comps' not in self.Args:
             self.Args['vec_comps'] = self.Args['default_vec_comps']
 
-    def depose_scalar(self, parts, src_scalar, dest_fld, charge):
+    def _build_layout_kernels(self, layout):
+        """
+        Build the deposition and gather kernels for the particles
+        layout ('SoA' or 'AoS'), which are kept for the later calls
+        """
+        defines = dict(self._tile_defs, **part_layout_defines[layout])
+        prg = self.build_program(["particles_layout.cl", "grid_generic.cl",
+                                  "grid_deposit.mako"], defines=defines,
+                                 render_args=self._shape_args)
+
+        self._layout_knls[layout] = {
+            'depose_scalar': prg.depose_scalar,
+            'depose_vector': prg.depose_vector,
+            'depose_scalar_tiles': prg.depose_scalar_tiles,
+            'depose_vector_tiles': prg.depose_vector_tiles,
+            'gather_and_push': prg.gather_and_push}
+        return prg
+
+    def _get_layout_kernels(self, parts):
+        layout = parts.Args['Layout']
+        if layout not in self._layout_knls:
+            self._build_layout_kernels(layout)
+        return self._layout_knls[layout]
+
+    def depose_scalar(self, parts, src_scalar, dest_fld, charge,
+                      wait_for=None):
         WGS, WGS_tot = self.get_wgs(self.Args['NxNr_4'])
 
         if parts.Args['Np'] <= 0:
@@ -57,18 +75,30 @@ class GridMethodsCL(GenericMethodsCL):
         dest_fld += '_m'
         fld_str = [dest_fld + str(m) for m in range(self.Args['M']+1)]
 
-        args_part = [parts.DataDev[arg].data for arg in part_str]
+        # with the packed layout the components share the records buffer
+        args_part = [parts.DataDev[arg].base_data for arg in part_str]
+        knls = self._get_layout_kernels(parts)
+
+        if self.Args['DepositTiles']:
+            return self._depose_tiles(knls['depose_scalar_tiles'],
+                args_part + [np.int8(charge),], fld_str, wait_for)
+
         args_grid = [self.DataDev[arg].data for arg in grid_str]
         args_fld = [self.DataDev[arg].data for arg in fld_str]
 
         args = args_part + [np.int8(charge),] + args_grid + args_fld
 
-        for i_off in np.arange(4).astype(np.uint32):
-            self._depose_scalar_knl(self.queue,
-                                    (WGS_tot,),(WGS,),
-                                    i_off, *args).wait()
+        num_offsets = self.Args['ShapeNodes']**2
+        for i_off in np.arange(num_offsets).astype(np.uint32):
+            evnt = knls['depose_scalar'](self.queue,
+                                         (WGS_tot,),(WGS,),
+                                         i_off, *args, wait_for=wait_for)
+            wait_for = [evnt, ]
 
-    def depose_vector(self, parts, vec, factors, vec_fld, charge):
+        return self.complete(evnt)
+
+    def depose_vector(self, parts, vec, factors, vec_fld, charge,
+                      wait_for=None):
 
         part_str =  ['sort_indx',] + self.Args['vec_comps'] + vec + factors + \
                      ['cell_offset',]
@@ -82,90 +112,153 @@ class GridMethodsCL(GenericMethodsCL):
             for comp in self.Args['vec_comps']:
                 fld_str.append(vec_fld + comp + '_m' + str(m))
 
-        args_part = [parts.DataDev[arg].data for arg in part_str]
+        args_part = [parts.DataDev[arg].base_data for arg in part_str]
+        knls = self._get_layout_kernels(parts)
+
+        if self.Args['DepositTiles']:
+            return self._depose_tiles(knls['depose_vector_tiles'],
+                args_part + [np.int8(charge),], fld_str, wait_for)
+
         args_grid = [self.DataDev[arg].data for arg in grid_str]
         args_fld = [self.DataDev[arg].data for arg in fld_str]
 
         args_dep = args_part + [np.int8(charge),] + args_grid + args_fld
 
         WGS, WGS_tot = self.get_wgs(self.Args['NxNr_4'])
-        for i_off in np.arange(4).astype(np.uint32):
-            self._depose_vector_knl(self.queue,
-                                    (WGS_tot,),(WGS,),
-                                    i_off, *args_dep).wait()
+        num_offsets = self.Args['ShapeNodes']**2
+        for i_off in np.arange(num_offsets).astype(np.uint32):
+            evnt = knls['depose_vector'](self.queue,
+                                         (WGS_tot,),(WGS,),
+                                         i_off, *args_dep,
+                                         wait_for=wait_for)
+            wait_for = [evnt, ]
+
+        return self.complete(evnt)
+
+
+    def _depose_tiles(self, knl, args_dep, fld_str, wait_for=None):
+        """
+        Launch the tile-based deposition kernel with a work-group per
+        tile, and add the tiles halos to the fields
+        """
+        grid_str = ['Nx', 'Xmin', 'dx_inv',
+                    'Nr', 'Rmin', 'dr_inv']
+
+        args_grid = [self.DataDev[arg].data for arg in grid_str]
+        args_fld = [self.DataDev[arg].data for arg in fld_str]
+        args_halo = [self.DataDev[arg + '_halo'].data for arg in fld_str]
+
+        args = args_dep + args_grid + [np.uint32(self.Args['NTilesX']), ] \
+               + args_fld + args_halo
 
+        WGS = self.Args['TileNx'] * self.Args['TileNr']
+        WGS_tot = self.Args['NTilesX'] * self.Args['NTilesR'] * WGS
+        evnt = knl(self.queue, (WGS_tot, ), (WGS, ), *args,
+                   wait_for=wait_for)
 
-    def postproc_depose_scalar(self, fld):
+        WGS, WGS_tot = self.get_wgs(self.Args['NxNr'])
+        evnts = []
+        for fld in fld_str:
+            if self.DataDev[fld].dtype == np.double:
+                halo_knl = self._add_tile_halo_d_knl
+            else:
+                halo_knl = self._add_tile_halo_c_knl
+
+            evnts.append(halo_knl(self.queue, (WGS_tot, ), (WGS, ),
+                self.DataDev[fld].data, self.DataDev[fld + '_halo'].data,
+                self.DataDev['NxNr'].data, self.DataDev['Nx'].data,
+                np.uint32(self.Args['NTilesX']),
+                np.uint32(self.Args['NTilesR']), wait_for=[evnt, ]))
+
+        evnt = enqueue_barrier(self.queue, wait_for=evnts)
+        return self.complete(evnt)
+
+    def postproc_depose_scalar(self, fld, wait_for=None):
         # Correct near axis deposition
         args_grid = [self.DataDev[fld+'_m'+str(m)].data \
                      for m in range(self.Args['M']+1)]
 
         WGS, WGS_tot = self.get_wgs(self.Args['Nx'])
-        enqueue_barrier(self.queue)
-        self._treat_axis_d_knl(self.queue, (WGS_tot,), (WGS,),
-            args_grid[0], np.uint32(self.Args['Nx'])).wait()
-
+        evnts = [self._treat_axis_d_knl(self.queue, (WGS_tot,), (WGS,),
+                     args_grid[0], np.uint32(self.Args['Nx']),
+                     wait_for=wait_for), ]
 
         for m in range(1,self.Args['M']+1):
-            self._treat_axis_c_knl(self.queue, (WGS_tot,), (WGS,),
-                args_grid[m], np.uint32(self.Args['Nx'])).wait()
+            evnts.append(self._treat_axis_c_knl(self.queue, (WGS_tot,),
+                (WGS,), args_grid[m], np.uint32(self.Args['Nx']),
+                wait_for=wait_for))
 
         # Divide by radius
         WGS, WGS_tot = self.get_wgs(self.Args['NxNr'])
         grid_str =  ['NxNr','Nx','dV_inv']
         grid_args = [self.DataDev[arg].data for arg in grid_str]
 
-        enqueue_barrier(self.queue)
-        self._divide_by_dv_d_knl(self.queue,(WGS_tot,), (WGS,),
-                                 args_grid[0],*grid_args).wait()
+        evnts[0] = self._divide_by_dv_d_knl(self.queue,(WGS_tot,), (WGS,),
+                                            args_grid[0],*grid_args,
+                                            wait_for=evnts[:1])
 
         for m in range(1,self.Args['M']+1):
-            self._divide_by_dv_c_knl(self.queue,(WGS_tot,), (WGS,),
-                                     args_grid[m],*grid_args).wait()
+            evnts[m] = self._divide_by_dv_c_knl(self.queue,(WGS_tot,), (WGS,),
+                                                args_grid[m],*grid_args,
+                                                wait_for=evnts[m:m+1])
+
+        evnt = enqueue_barrier(self.queue, wait_for=evnts)
+        return self.complete(evnt)
 
-    def postproc_depose_vector(self, vec_fld):
+    def postproc_depose_vector(self, vec_fld, wait_for=None):
         args_raddiv_str =  ['NxNr','Nx','dV_inv']
         args_raddiv = [self.DataDev[arg].data for arg in args_raddiv_str]
 
+        evnts = []
         for fld in [vec_fld + comp for comp in self.Args['vec_comps']]:
             # Correct near axis deposition
             args_fld = [self.DataDev[fld+'_m'+str(m)].data \
                          for m in range(self.Args['M']+1)]
 
             WGS, WGS_tot = self.get_wgs(self.Args['Nx'])
-            self._treat_axis_d_knl(self.queue, (WGS_tot,), (WGS,),
-                args_fld[0], np.uint32(self.Args['Nx'])).wait()
-
-            for m in range(1,self.Args['M']+1):
-                self._treat_axis_c_knl(self.queue, (WGS_tot, ), (WGS, ),
-                    args_fld[m], np.uint32(self.Args['Nx'])).wait()
+            evnt = self._treat_axis_d_knl(self.queue, (WGS_tot,), (WGS,),
+                args_fld[0], np.uint32(self.Args['Nx']), wait_for=wait_for)
 
             # Divide by radius
             WGS, WGS_tot = self.get_wgs(self.Args['NxNr'])
-            enqueue_barrier(self.queue)
-            self._divide_by_dv_d_knl(self.queue, (WGS_tot, ), (WGS, ),
-                                      args_fld[0], *args_raddiv).wait()
+            evnts.append(self._divide_by_dv_d_knl(self.queue,
+                (WGS_tot, ), (WGS, ), args_fld[0], *args_raddiv,
+                wait_for=[evnt, ]))
 
             for m in range(1,self.Args['M']+1):
-                self._divide_by_dv_c_knl(self.queue,(WGS_tot, ), (WGS, ),
-                                         args_fld[m], *args_raddiv).wait()
+                WGS, WGS_tot = self.get_wgs(self.Args['Nx'])
+                evnt = self._treat_axis_c_knl(self.queue, (WGS_tot, ),
+                    (WGS, ), args_fld[m], np.uint32(self.Args['Nx']),
+                    wait_for=wait_for)
+
+                WGS, WGS_tot = self.get_wgs(self.Args['NxNr'])
+                evnts.append(self._divide_by_dv_c_knl(self.queue,
+                    (WGS_tot, ), (WGS, ), args_fld[m], *args_raddiv,
+                    wait_for=[evnt, ]))
 
-    def preproc_project_vec(self, vec_fld):
+        evnt = enqueue_barrier(self.queue, wait_for=evnts)
+        return self.complete(evnt)
+
+    def preproc_project_vec(self, vec_fld, wait_for=None):
         WGS, WGS_tot = self.get_wgs(self.Args['Nx'])
+        evnts = []
         for comp in self.Args['vec_comps']:
             fld = vec_fld + comp
 
-            self._warp_axis_m0_d_knl(self.queue, (WGS_tot, ), (WGS, ),
-                                     self.DataDev[fld+'_m0'].data,
-                                     np.uint32(self.Args['Nx'])
-                                    ).wait()
+            evnts.append(self._warp_axis_m0_d_knl(self.queue,
+                (WGS_tot, ), (WGS, ), self.DataDev[fld+'_m0'].data,
+                np.uint32(self.Args['Nx']), wait_for=wait_for))
 
             for m in range(1,self.Args['M']+1):
-                self._warp_axis_m1plus_c_knl(self.queue, (WGS_tot, ), (WGS, ),
+                evnts.append(self._warp_axis_m1plus_c_knl(self.queue,
+                    (WGS_tot, ), (WGS, ),
                     self.DataDev[fld + '_m' + str(m)].data,
-                    np.uint32(self.Args['Nx'])).wait()
+                    np.uint32(self.Args['Nx']), wait_for=wait_for))
+
+        evnt = enqueue_barrier(self.queue, wait_for=evnts)
+        return self.complete(evnt)
 
-    def _gather_and_push(self, parts, flds):
+    def _gather_and_push(self, parts, flds, wait_for=None):
         part_str = ['x', 'y', 'z', 'px', 'py', 'pz', 'g_inv',
                     'sort_indx','cell_offset', 'FactorPush']
 
@@ -179,14 +272,15 @@ class GridMethodsCL(GenericMethodsCL):
                 for comp in self.Args['vec_comps']:
                     fld_str.append(fld + comp + '_m' + str(m))
 
-        args_parts = [parts.DataDev[arg].data for arg in part_str]
+        args_parts = [parts.DataDev[arg].base_data for arg in part_str]
         args_grid = [self.DataDev[arg].data for arg in grid_str]
         args_fld = [self.DataDev[arg].data for arg in fld_str]
-        args_num_p = [np.uint32(parts.Args['Np']),
-                      np.uint32(parts.Args['Np_stay'])]
+        args_num_p = [np.uint32(parts.Args['Np']), ]
 
         args = args_parts + args_num_p + args_grid + args_fld
 
         WGS, WGS_tot = self.get_wgs(parts.Args['Np'])
-        self._gather_and_push_knl(self.queue, (WGS_tot, ), (WGS, ),
-                                  *args).wait()
+        knl = self._get_layout_kernels(parts)['gather_and_push']
+        evnt = knl(self.queue, (WGS_tot, ), (WGS, ), *args,
+                   wait_for=wait_for)
+        return self.complete(evnt)
@@ -1,16 +1,28 @@
 import numpy as np
 
 from pyopencl.clrandom import ThreefryGenerator
-from pyopencl.array import arange, cumsum, to_device
-from pyopencl import enqueue_marker, enqueue_barrier
-from pyopencl import Program
+from pyopencl.array import Array, arange, cumsum, to_device
+from pyopencl import enqueue_marker, enqueue_barrier, enqueue_copy
+from pyopencl import LocalMemory
 from pyopencl.clmath import sqrt as sqrt
 
 from .generic_methods_cl import GenericMethodsCL
-from .generic_methods_cl import compiler_options
 
-from chimeraCL import __path__ as src_path
-src_path = src_path[0] + '/kernels/'
+# components of the packed particle records (AoS layout) in the order
+# of COMP_* indices in particles_layout.cl
+part_record_comps = ['x', 'y', 'z', 'px', 'py', 'pz', 'w', 'g_inv']
+
+# macros of the particle layouts, and the packed records are kept
+# in double precision
+part_layout_defines = {
+    'SoA': {'PART_STRIDE': 1, 'PART_PACKED': 0},
+    'AoS': {'PART_STRIDE': len(part_record_comps), 'PART_PACKED': 1,
+            'PART_REAL': 'double'}
+    }
+
+# particles stored farther than this from their predecessors
+# in the sorted order are counted by sort_locality
+locality_window = 32
 
 
 class ParticleMethodsCL(GenericMethodsCL):
@@ -21,22 +33,43 @@ class ParticleMethodsCL(GenericMethodsCL):
 
         self._generator_knl = ThreefryGenerator(context=self.ctx)
 
-        particles_sources = ''.join(
-                open(src_path + "particles_generic.cl").readlines())
-
-        particles_sources = self.block_def_str + particles_sources
-
-        prg = Program(self.ctx, particles_sources).\
-            build(options=compiler_options)
+        prg = self.build_program(["particles_layout.cl",
+                                  "particles_generic.cl"],
+            defines=part_layout_defines[self.Args['Layout']])
 
         self._data_align_dbl_knl = prg.data_align_dbl
+        self._data_align_part_knl = prg.data_align_part
         self._data_align_int_knl = prg.data_align_int
+        self._data_align_record_knl = prg.data_align_record
+        self._data_pack_comp_knl = prg.data_pack_comp
+        self._data_gather_comp_knl = prg.data_gather_comp
+        self._count_sort_jumps_knl = prg.count_sort_jumps
+        self._inject_grid_knl = prg.inject_grid
+        self._stay_mask_knl = prg.stay_mask
+        self._range_mask_knl = prg.range_mask
+        self._compact_index_knl = prg.compact_index
+        self._select_knls = {}
+        self._reduce_knls = {}
+        self._remap_sort_index_knl = prg.remap_sort_index
+        self._inject_momenta_knl = prg.inject_momenta
+        self._profiles_sent = None
         self._index_and_sum_knl = prg.index_and_sum_in_cell
         self._sort_knl = prg.sort
+        self._index_and_count_movers_knl = prg.index_and_count_movers
+        self._push_index_and_sum_knl = prg.push_xyz_index_and_sum_in_cell
+        self._push_index_and_count_movers_knl = \
+            prg.push_xyz_index_and_count_movers
+        self._update_sum_in_cell_knl = prg.update_sum_in_cell
+        self._sort_incremental_knl = prg.sort_incremental
+        self._stay_sorted_knl = prg.stay_sorted
         self._push_xyz_knl = prg.push_xyz
         self._fill_grid_knl = prg.fill_grid
         self._profile_by_interpolant_knl = prg.profile_by_interpolant
 
+        # pinned buffer for the number of staying particles of the sort
+        self._num_stay_host = self.host_arr(shape=(1, ), dtype=np.uint32)
+        self._num_stay_evnt = None
+
     def add_new_particles(self, source=None):
 
         if source is None:
@@ -53,16 +86,82 @@ class ParticleMethodsCL(GenericMethodsCL):
         else:
             args_strs = ['x', 'y', 'z','w']
 
+        if full_Np > self.Args['Np_capacity']:
+            self._grow_capacity(full_Np, args_strs)
+
+        if self.Args['Layout'] == 'AoS':
+            if new_Np > 0:
+                self._pack_comps(DataSrc, args_strs, old_Np, new_Np)
+            self._set_record_views(full_Np)
+            self.reset_num_parts()
+            self.flag_sorted = False
+            return
+
+        # new particles are appended in place after the old ones,
+        # and converted to the storage precision if needed
         for arg in args_strs:
-            buff = self.dev_arr(dtype=self.DataDev[arg].dtype,
-                                shape=full_Np)
-            buff[:old_Np] = self.DataDev[arg]
-            buff[old_Np:] = DataSrc[arg+'_new']
-            self.DataDev[arg] = buff
+            buff = self.DataDev[arg + '_buff']
+            if new_Np > 0:
+                arr_new = DataSrc[arg+'_new']
+                if arr_new.dtype != buff.dtype:
+                    arr_new = arr_new.astype(buff.dtype)
+                buff[old_Np:full_Np] = arr_new
+            self.DataDev[arg] = buff[:full_Np]
 
         self.reset_num_parts()
         self.flag_sorted = False
 
+    def _pack_comps(self, DataSrc, comps, old_Np, new_Np):
+        """
+        Write the new particles components into the packed records
+        after the old_Np ones
+        """
+        rec_buff = self.DataDev['rec_buff']
+        WGS, WGS_tot = self.get_wgs(new_Np)
+        evnts = []
+        for comp in comps:
+            arr_new = DataSrc[comp + '_new']
+            if arr_new.dtype != np.double:
+                arr_new = arr_new.astype(np.double)
+
+            evnts.append(self._data_pack_comp_knl(self.queue,
+                (WGS_tot, ), (WGS, ), arr_new.data, rec_buff.data,
+                np.uint32(part_record_comps.index(comp)),
+                np.uint32(old_Np), np.uint32(new_Np)))
+
+        evnt = enqueue_barrier(self.queue, wait_for=evnts)
+        return self.complete(evnt)
+
+    def _set_record_views(self, Np):
+        """
+        Set the components of the packed layout as the strided views
+        of the first Np records
+        """
+        Nc = len(part_record_comps)
+        rec_buff = self.DataDev['rec_buff']
+        self.DataDev['rec'] = rec_buff[:Np*Nc]
+
+        for k, comp in enumerate(part_record_comps):
+            if Np == 0:
+                self.DataDev[comp] = rec_buff[:0]
+            else:
+                self.DataDev[comp] = Array(self.queue, (Np, ), np.double,
+                    strides=(Nc*rec_buff.dtype.itemsize, ),
+                    data=rec_buff.base_data, offset=k*rec_buff.dtype.itemsize)
+
+    def get_comp(self, comp, i_start=0):
+        """
+        Copy the particles component to the host, starting from
+        the particle i_start
+        """
+        Np = self.DataDev['x'].size
+        if self.Args['Layout'] == 'SoA':
+            return self.DataDev[comp][i_start:Np].get()
+
+        Nc = len(part_record_comps)
+        recs = self.DataDev['rec_buff'][i_start*Nc:Np*Nc].get()
+        return recs[part_record_comps.index(comp)::Nc]
+
     def make_new_domain(self, parts_in, density_profiles=None):
 
         xmin, xmax, rmin, rmax = \
@@ -93,7 +192,8 @@ class ParticleMethodsCL(GenericMethodsCL):
         gn_args += list(np.array(self.Args['Nppc'], dtype=np.uint32))
 
         WGS, WGS_tot = self.get_wgs(Ncells_loc)
-        self._fill_grid_knl(self.queue, (WGS_tot, ), (WGS, ), *gn_args).wait()
+        evnt = self._fill_grid_knl(self.queue, (WGS_tot, ), (WGS, ), *gn_args)
+        self.complete(evnt)
 
         self.DataDev['w_new'] *= self.Args['w0']
 
@@ -112,28 +212,7 @@ class ParticleMethodsCL(GenericMethodsCL):
                                   coord=coord, weight='w_new')
 
         if 'Immobile' not in self.Args.keys():
-
-            for arg in ['px', 'py', 'pz']:
-
-                if 'd'+arg not in parts_in and arg+'_c' not in parts_in:
-                    self.DataDev[arg+'_new'] = self.dev_arr(shape=Np, val=0,
-                                                            dtype=np.double)
-                    parts_in[arg+'_c'] = 0
-                    parts_in['d'+arg] = 0
-                else:
-                    self.DataDev[arg+'_new'] = self.dev_arr(shape=Np,
-                                                            dtype=np.double)
-
-                    if arg+'_c' not in parts_in:
-                        parts_in[arg+'_c'] = 0
-
-                    if 'd'+arg in parts_in:
-                        self._fill_arr_randn(self.DataDev[arg+'_new'],
-                                             mu=parts_in[arg+'_c'],
-                                             sigma=parts_in['d'+arg])
-                    else:
-                        parts_in['d'+arg] = 0
-                        self.DataDev[arg+'_new'].fill(parts_in[arg+'_c'])
+            self._make_new_momenta(parts_in, Np)
 
             momnt = np.sum([parts_in[key]**2 for key in ('px_c','py_c','pz_c',
                                                          'dpx','dpy','dpz',)])
@@ -146,6 +225,161 @@ class ParticleMethodsCL(GenericMethodsCL):
                 self.DataDev['g_inv_new'] = self.dev_arr(shape=Np,val=1.0,
                     dtype=np.double)
 
+    def _make_new_momenta(self, parts_in, Np):
+        for arg in ['px', 'py', 'pz']:
+
+            if 'd'+arg not in parts_in and arg+'_c' not in parts_in:
+                self.DataDev[arg+'_new'] = self.dev_arr(shape=Np, val=0,
+                                                        dtype=np.double)
+                parts_in[arg+'_c'] = 0
+                parts_in['d'+arg] = 0
+            else:
+                self.DataDev[arg+'_new'] = self.dev_arr(shape=Np,
+                                                        dtype=np.double)
+
+                if arg+'_c' not in parts_in:
+                    parts_in[arg+'_c'] = 0
+
+                if 'd'+arg in parts_in:
+                    self._fill_arr_randn(self.DataDev[arg+'_new'],
+                                         mu=parts_in[arg+'_c'],
+                                         sigma=parts_in['d'+arg])
+                else:
+                    parts_in['d'+arg] = 0
+                    self.DataDev[arg+'_new'].fill(parts_in[arg+'_c'])
+
+    def inject_new_domain(self, parts_in, density_profiles=None,
+                          source=None):
+        """
+        Generate the particles of the domain directly into the storage
+        after the present ones, with the density profiles applied in
+        the same kernel. The cells are added from Xmin to cover the
+        particles below Xmax, and the particles of the last cell beyond
+        it are removed by the next sorting. If the source species is
+        given, its random inputs are used, so the particles coincide
+        with the source ones. Nothing is read from the device: the right
+        limit of the plasma is half a particle step after the last
+        particle below Xmax.
+        """
+        xmin, xmax, rmin, rmax = \
+          [parts_in[arg] for arg in ['Xmin', 'Xmax', 'Rmin', 'Rmax']]
+        dx, dr, ddx = self.Args['dx'], self.Args['dr'], self.Args['ddx']
+        Nppc_x = self.Args['Nppc'][0]
+        Ncols_x = int( np.ceil((xmax-xmin) / ddx - 0.5) )
+        Nx_loc = int( np.ceil(Ncols_x / Nppc_x) + 1)
+        Nr_loc = int( np.round((rmax-rmin) / dr) + 1)
+        Ncells_loc = (Nx_loc-1)*(Nr_loc-1)
+        new_Np = int(Ncells_loc*np.prod(self.Args['Nppc']))
+
+        if Nx_loc < 2 or new_Np <= 0:
+            return
+
+        self.Args['right_lim'] = xmin + ddx*Ncols_x
+        self.DataDev['right_lim'].fill(self.Args['right_lim'])
+
+        if source is None:
+            DataSrc = self.DataDev
+            DataSrc['theta_new'] = self.dev_arr(shape=Ncells_loc,
+                                                dtype=np.double)
+            self._fill_arr_rand(DataSrc['theta_new'], xmin=0, xmax=2*np.pi)
+        else:
+            DataSrc = source.DataDev
+
+        old_Np = self.DataDev['x'].size
+        full_Np = old_Np + new_Np
+
+        if 'Immobile' not in self.Args.keys():
+            args_strs = ['x', 'y', 'z', 'px', 'py', 'pz', 'w', 'g_inv']
+        else:
+            args_strs = ['x', 'y', 'z','w']
+
+        if full_Np > self.Args['Np_capacity']:
+            self._grow_capacity(full_Np, args_strs)
+
+        args = [self._storage_data(arg) for arg in ['x', 'y', 'z', 'w']]
+        args += [DataSrc['theta_new'].data, np.uint32(old_Np),
+                 np.double(xmin), np.double(dx),
+                 np.double(rmin), np.double(dr),
+                 np.double(self.Args['w0']),
+                 np.uint32(Nx_loc), np.uint32(Ncells_loc)]
+        args += list(np.array(self.Args['Nppc'], dtype=np.uint32))
+        args += self._get_profile_tables(density_profiles)
+
+        WGS, WGS_tot = self.get_wgs(Ncells_loc)
+        evnt = self._inject_grid_knl(self.queue, (WGS_tot, ), (WGS, ), *args)
+        self.complete(evnt)
+
+        if 'Immobile' not in self.Args.keys():
+            if source is None or DataSrc.get('px_new') is None:
+                DataSrc = self.DataDev
+                self._make_new_momenta(parts_in, new_Np)
+
+            args = [self._storage_data(arg)
+                    for arg in ['px', 'py', 'pz', 'g_inv']]
+            args += [DataSrc[arg + '_new'].data for arg in ['px', 'py', 'pz']]
+
+            WGS, WGS_tot = self.get_wgs(new_Np)
+            evnt = self._inject_momenta_knl(self.queue, (WGS_tot, ), (WGS, ),
+                                            *args, np.uint32(old_Np),
+                                            np.uint32(new_Np))
+            self.complete(evnt)
+
+        if self.Args['Layout'] == 'AoS':
+            self._set_record_views(full_Np)
+        else:
+            for arg in args_strs:
+                self.DataDev[arg] = self.DataDev[arg + '_buff'][:full_Np]
+
+        self.reset_num_parts()
+        self.flag_sorted = False
+
+    def _storage_data(self, comp):
+        # buffer holding the particles component
+        if self.Args['Layout'] == 'AoS':
+            return self.DataDev['rec_buff'].data
+        else:
+            return self.DataDev[comp + '_buff'].data
+
+    def _get_profile_tables(self, density_profiles):
+        """
+        Get the kernel arguments of the longitudinal density profiles,
+        which are concatenated into the tables with offsets of each.
+        The tables are sent to the device once.
+        """
+        if density_profiles is None:
+            return [None, None, None, None, np.uint32(0)]
+
+        if self._profiles_sent is not density_profiles:
+            x_tab, f_tab, dxm1_tab, offsets = [], [], [], [0, ]
+            for profile in density_profiles:
+                if profile['coord'] != 'x':
+                    print('Only longitudinal profiling is implemented')
+                    continue
+
+                x_prf = np.array(profile['points'], dtype=np.double)
+                f_prf = np.array(profile['values'], dtype=np.double)
+                x_tab.append(x_prf)
+                f_tab.append(f_prf)
+                dxm1_tab.append(np.r_[1./(x_prf[1:] - x_prf[:-1]), 0.])
+                offsets.append(offsets[-1] + x_prf.size)
+
+            if len(x_tab) > 0:
+                for arg, tab in zip(['x', 'f', 'dxm1'],
+                                    [x_tab, f_tab, dxm1_tab]):
+                    self.DataDev['prf_' + arg] = \
+                        self.dev_arr(val=np.concatenate(tab))
+                self.DataDev['prf_offset'] = \
+                    self.dev_arr(val=np.array(offsets, dtype=np.uint32))
+            self._profiles_sent = density_profiles
+            self._num_profiles = len(x_tab)
+
+        if self._num_profiles == 0:
+            return [None, None, None, None, np.uint32(0)]
+
+        return [self.DataDev[arg].data for arg in
+                ['prf_x', 'prf_f', 'prf_dxm1', 'prf_offset']] + \
+               [np.uint32(self._num_profiles), ]
+
     def make_new_beam(self, parts_in):
         Np = parts_in['Np']
 
@@ -196,14 +430,16 @@ class ParticleMethodsCL(GenericMethodsCL):
         dxm1_loc = self.dev_arr(val=dxm1_loc)
 
         WGS, WGS_tot = self.get_wgs(Np)
-        self._profile_by_interpolant_knl(self.queue, (WGS_tot, ), (WGS, ),
-                                         self.DataDev[coord].data,
-                                         self.DataDev[weight].data,
-                                         np.uint32(Np), x_loc.data,
-                                         f_loc.data, dxm1_loc.data,
-                                         np.uint32(Nx_loc)).wait()
-
-    def push_coords(self, mode='half'):
+        evnt = self._profile_by_interpolant_knl(self.queue,
+                                                (WGS_tot, ), (WGS, ),
+                                                self.DataDev[coord].data,
+                                                self.DataDev[weight].data,
+                                                np.uint32(Np), x_loc.data,
+                                                f_loc.data, dxm1_loc.data,
+                                                np.uint32(Nx_loc))
+        return self.complete(evnt)
+
+    def push_coords(self, mode='half', wait_for=None):
         if self.Args['Np']==0:
             return
 
@@ -218,11 +454,21 @@ class ParticleMethodsCL(GenericMethodsCL):
             which_dt = 'dt'
 
         args_strs =  ['x', 'y', 'z', 'px', 'py', 'pz', 'g_inv', which_dt, 'Np']
-        args = [self.DataDev[arg].data for arg in args_strs]
-        self._push_xyz_knl(self.queue, (WGS_tot, ), (WGS, ), *args).wait()
+        args = [self.DataDev[arg].base_data for arg in args_strs]
+        evnt = self._push_xyz_knl(self.queue, (WGS_tot, ), (WGS, ), *args,
+                                  wait_for=wait_for)
         self.flag_sorted = False
+        return self.complete(evnt)
+
+    def index_sort(self, grid, push_dt=None):
+        """
+        Sort the particles by cells. If the push_dt ('dt' or 'dt_2')
+        is given, the coordinates are first advanced in the same pass
+        """
+        if self.Args['SortIncremental'] and self.flag_sort_valid \
+          and self.DataDev['sum_in_cell'].size == grid.Args['Nxm1Nrm1']+1:
+            return self.index_sort_incremental(grid, push_dt=push_dt)
 
-    def index_sort(self, grid):
         WGS, WGS_tot = self.get_wgs(self.Args['Np'])
 
         self.DataDev['indx_in_cell'] = self.dev_arr(dtype=np.uint32,
@@ -236,54 +482,716 @@ class ParticleMethodsCL(GenericMethodsCL):
         grid_strs =  ['Nx', 'Xmin', 'dx_inv',
                       'Nr', 'Rmin', 'dr_inv']
 
-        args = [self.DataDev[arg].data for arg in part_strs] + \
+        if push_dt is None:
+            index_knl = self._index_and_sum_knl
+        else:
+            index_knl = self._push_index_and_sum_knl
+            part_strs = part_strs[:3] + ['px', 'py', 'pz', 'g_inv',
+                                         push_dt] + part_strs[3:]
+
+        # with the packed layout the components share the records buffer
+        args = [self.DataDev[arg].base_data for arg in part_strs] + \
                [self.DataDev['indx_in_cell'].data, ] + \
                [grid.DataDev[arg].data for arg in grid_strs]
 
-        self._index_and_sum_knl(self.queue, (WGS_tot, ), (WGS, ), *args).wait()
+        evnt = index_knl(self.queue, (WGS_tot, ), (WGS, ), *args)
+        self.complete(evnt)
 
         self.DataDev['cell_offset'] = self._cumsum(self.DataDev['sum_in_cell'],
             allocator=self.DataDev['cell_offset_mp'])
 
         self.set_to(self.DataDev['sum_in_cell'], 0)
-
-        self.Args['Np_stay'] = self.DataDev['cell_offset'][-2].get().item()
+        self._fetch_num_stay()
 
         self.DataDev['sort_indx'] = self.dev_arr(dtype=np.uint32,
             shape=self.Args['Np'], allocator=self.DataDev['sort_indx_mp'])
 
         WGS, WGS_tot = self.get_wgs(self.Args['Np'])
-        self._sort_knl(self.queue, (WGS_tot, ), (WGS, ),
-                       self.DataDev['cell_offset'].data,
-                       self.DataDev['indx_in_cell'].data,
-                       self.DataDev['sum_in_cell'].data,
-                       self.DataDev['sort_indx'].data,
-                       np.uint32(self.Args['Np'])).wait()
+        evnt = self._sort_knl(self.queue, (WGS_tot, ), (WGS, ),
+                              self.DataDev['cell_offset'].data,
+                              self.DataDev['indx_in_cell'].data,
+                              self.DataDev['sum_in_cell'].data,
+                              self.DataDev['sort_indx'].data,
+                              np.uint32(self.Args['Np']),
+                              np.uint32(grid.Args['Nxm1Nrm1']+1),
+                              self.DataDev['num_movers'].data,
+                              np.uint32(0))
+        self.flag_sort_valid = True
+        return self.complete(evnt)
+
+    def index_sort_incremental(self, grid, push_dt=None):
+        """
+        Update the sorting from the previous one: only the particles
+        which changed their cells are counted and relocated. If their
+        fraction exceeds SortMoversMax, the counting sort is redone
+        with the updated sums of particles per cell. The choice is made
+        on the device, so the host is not synchronized.
+        """
+        Ncells = grid.Args['Nxm1Nrm1']+1
+        Np = self.Args['Np']
+
+        sum_out_cell = self.dev_arr(val=0, dtype=np.uint32, shape=Ncells,
+            allocator=self.DataDev['sum_in_cell_mp'])
+        sum_new_cell = self.dev_arr(val=0, dtype=np.uint32, shape=Ncells,
+            allocator=self.DataDev['sum_in_cell_mp'])
+        moved = self.dev_arr(dtype=np.uint32, shape=Np,
+                             allocator=self.DataDev['indx_in_cell_mp'])
+        self.set_to(self.DataDev['num_movers'], 0)
+
+        part_strs =  ['x', 'y', 'z', 'Np', 'indx_in_cell']
+        grid_strs =  ['Nx', 'Xmin', 'dx_inv',
+                      'Nr', 'Rmin', 'dr_inv']
+
+        if push_dt is None:
+            index_knl = self._index_and_count_movers_knl
+        else:
+            index_knl = self._push_index_and_count_movers_knl
+            part_strs = part_strs[:3] + ['px', 'py', 'pz', 'g_inv',
+                                         push_dt] + part_strs[3:]
+
+        args = [self.DataDev[arg].base_data for arg in part_strs] + \
+               [moved.data, sum_out_cell.data, sum_new_cell.data,
+                self.DataDev['num_movers'].data] + \
+               [grid.DataDev[arg].data for arg in grid_strs]
+
+        WGS, WGS_tot = self.get_wgs(Np)
+        evnt = index_knl(self.queue, (WGS_tot, ), (WGS, ), *args)
+        self.complete(evnt)
+
+        WGS, WGS_tot = self.get_wgs(Ncells)
+        evnt = self._update_sum_in_cell_knl(self.queue, (WGS_tot, ), (WGS, ),
+                                            self.DataDev['sum_in_cell'].data,
+                                            sum_out_cell.data,
+                                            sum_new_cell.data,
+                                            np.uint32(Ncells))
+        self.complete(evnt)
+
+        cell_offset_old = self.DataDev['cell_offset']
+        sort_indx_old = self.DataDev['sort_indx']
+
+        self.DataDev['cell_offset'] = self._cumsum(self.DataDev['sum_in_cell'],
+            allocator=self.DataDev['cell_offset_mp'])
+        self._fetch_num_stay()
+
+        self.DataDev['sort_indx'] = self.dev_arr(dtype=np.uint32,
+            shape=Np, allocator=self.DataDev['sort_indx_mp'])
+
+        # with more movers than this the counting sort is made,
+        # and the incremental one is skipped
+        movers_min = np.uint32(int(self.Args['SortMoversMax'] * Np) + 1)
+
+        WGS, WGS_tot = self.get_wgs(Np)
+        stay = self.dev_arr(dtype=np.uint32, shape=Np,
+                            allocator=self.DataDev['indx_in_cell_mp'])
+        evnt = self._stay_sorted_knl(self.queue, (WGS_tot, ), (WGS, ),
+                                     moved.data, sort_indx_old.data,
+                                     stay.data, np.uint32(Np))
+        self.complete(evnt)
+        stay_offset = self._cumsum(stay,
+                                   allocator=self.DataDev['indx_in_cell_mp'])
+
+        evnt = self._sort_incremental_knl(self.queue, (WGS_tot, ), (WGS, ),
+                                          cell_offset_old.data,
+                                          self.DataDev['cell_offset'].data,
+                                          self.DataDev['indx_in_cell'].data,
+                                          moved.data, stay_offset.data,
+                                          sum_new_cell.data,
+                                          sort_indx_old.data,
+                                          self.DataDev['sort_indx'].data,
+                                          np.uint32(Np),
+                                          self.DataDev['num_movers'].data,
+                                          movers_min)
+        self.complete(evnt)
+
+        # sum_out_cell is reused as the counter of the counting sort
+        self.set_to(sum_out_cell, 0)
+        evnt = self._sort_knl(self.queue, (WGS_tot, ), (WGS, ),
+                              self.DataDev['cell_offset'].data,
+                              self.DataDev['indx_in_cell'].data,
+                              sum_out_cell.data,
+                              self.DataDev['sort_indx'].data,
+                              np.uint32(Np), np.uint32(Ncells),
+                              self.DataDev['num_movers'].data, movers_min)
+        return self.complete(evnt)
+
+    def _fetch_num_stay(self):
+        """
+        Copy the number of particles staying on the grid (Np_stay)
+        from the last sort to the host without blocking. It is read
+        by sync_num_stay, when it is needed by the host
+        """
+        self._num_stay_evnt = self.get_async(
+            self.DataDev['cell_offset'][-2:-1], self._num_stay_host)
+
+    def sync_num_stay(self):
+        """
+        Wait for the number of staying particles from the last sort,
+        and set it to Args['Np_stay']
+        """
+        if self._num_stay_evnt is not None:
+            self._num_stay_evnt.wait()
+            self.Args['Np_stay'] = int(self._num_stay_host[0])
+            self._num_stay_evnt = None
 
     def align_and_damp(self, comps_align):
-        if self.Args['Np_stay'] == 0:
-            for comp in comps_align + ['sort_indx',]:
-                self.DataDev[comp] = self.dev_arr(shape=0,
-                    dtype=self.DataDev[comp].dtype)
+        """
+        Copy the particles into the sorted order, and remove the ones
+        which left the grid. If no particles are removed, the sorting
+        stays valid for the incremental update.
+        """
+        self.sync_num_stay()
+        Np_stay = self.Args['Np_stay']
+        keep_sort = self.flag_sort_valid and Np_stay == self.Args['Np']
+        self.sorts_since_align = 0
+        self.sorts_since_compact = 0
+
+        if Np_stay == 0:
+            if self.Args['Layout'] == 'AoS':
+                self._set_record_views(0)
+            else:
+                for comp in comps_align:
+                    self.DataDev[comp] = self.DataDev[comp + '_buff'][:0]
+            self.DataDev['sort_indx'] = self.dev_arr(shape=0,
+                dtype=self.DataDev['sort_indx'].dtype)
             self.reset_num_parts()
             return
 
-        WGS, WGS_tot = self.get_wgs(self.Args['Np_stay'])
+        self._copy_by_index(comps_align,
+                            self.DataDev['sort_indx'][:Np_stay])
+
+        if keep_sort:
+            indx_in_cell = self.dev_arr(dtype=np.uint32, shape=Np_stay,
+                allocator=self.DataDev['indx_in_cell_mp'])
+
+            WGS, WGS_tot = self.get_wgs(Np_stay)
+            evnt = self._data_align_int_knl(self.queue, (WGS_tot, ), (WGS, ),
+                self.DataDev['indx_in_cell'].data, indx_in_cell.data,
+                self.DataDev['sort_indx'].data, self.DataDev['Np'].data)
+            self.complete(evnt)
+            self.DataDev['indx_in_cell'] = indx_in_cell
+
+        self.DataDev['sort_indx'] = arange(self.queue, 0, Np_stay, 1,
+            dtype=np.uint32, allocator=self.DataDev['sort_indx_mp'])
+        self.reset_num_parts()
+        self.flag_sort_valid = keep_sort
+
+    def _copy_by_index(self, comps, indx):
+        """
+        Copy the particles components in the order of the indx array
+        to the start of the storage, which is then truncated to the
+        size of indx
+        """
+        if self.Args['AlignSingleBuffer']:
+            self._align_single_buffer(comps, indx)
+        elif self.Args['Layout'] == 'AoS':
+            self._align_records(indx)
+        else:
+            self._align_comps(comps, indx)
+
+    def _align_comps(self, comps_align, indx):
+        # particles are aligned into the second (ping-pong) buffer,
+        # which then becomes the storage of the component
+        Np_stay = indx.size
+        WGS, WGS_tot = self.get_wgs(Np_stay)
         for comp in comps_align:
-            buff_parts = self.dev_arr(dtype=self.DataDev[comp].dtype,
-                                      shape=(self.Args['Np_stay'], ))
-
-            self._data_align_dbl_knl(self.queue, (WGS_tot, ), (WGS, ),
-                                     self.DataDev[comp].data,
-                                     buff_parts.data,
-                                     self.DataDev['sort_indx'].data,
-                                     np.uint32(self.Args['Np_stay'])).wait()
-            self.DataDev[comp] = buff_parts
-
-        self.DataDev['sort_indx'] = arange(self.queue, 0,
-                                           self.Args['Np_stay'], 1,
-                                           dtype=np.uint32)
+            buff = self.DataDev[comp + '_buff']
+            buff_swap = self.DataDev[comp + '_swap']
+            if buff_swap is None:
+                buff_swap = self.dev_arr(dtype=buff.dtype,
+                                         shape=self.Args['Np_capacity'])
+
+            if buff.dtype == np.double:
+                align_knl = self._data_align_dbl_knl
+            else:
+                align_knl = self._data_align_part_knl
+
+            evnt = align_knl(self.queue, (WGS_tot, ), (WGS, ),
+                             self.DataDev[comp].data, buff_swap.data,
+                             indx.data, np.uint32(Np_stay))
+            self.complete(evnt)
+
+            self.DataDev[comp + '_buff'] = buff_swap
+            self.DataDev[comp + '_swap'] = buff
+            self.DataDev[comp] = buff_swap[:Np_stay]
+
+    def _align_records(self, indx):
+        """
+        Align the packed records with a single pass, where the whole
+        record of each particle is moved at once
+        """
+        Np_stay = indx.size
+        rec_buff = self.DataDev['rec_buff']
+        rec_swap = self.DataDev['rec_swap']
+        if rec_swap is None:
+            rec_swap = self.dev_arr(dtype=np.double, shape=rec_buff.size)
+
+        WGS, WGS_tot = self.get_wgs(Np_stay)
+        evnt = self._data_align_record_knl(self.queue,
+            (WGS_tot, ), (WGS, ), rec_buff.data, rec_swap.data,
+            indx.data, np.uint32(Np_stay))
+        self.complete(evnt)
+
+        self.DataDev['rec_buff'] = rec_swap
+        self.DataDev['rec_swap'] = rec_buff
+        self._set_record_views(Np_stay)
+
+    def _align_single_buffer(self, comps_align, indx):
+        """
+        Align the components one by one through a single scratch
+        array, which is copied back to the storage. This costs
+        an extra copy, but the ping-pong buffers are released, so
+        only one component is allocated in addition to the storage.
+        """
+        Np_stay = indx.size
+        scratch = self.dev_arr(dtype=np.double, shape=Np_stay)
+
+        WGS, WGS_tot = self.get_wgs(Np_stay)
+        for comp in comps_align:
+            if self.Args['Layout'] == 'AoS':
+                i_comp = np.uint32(part_record_comps.index(comp))
+                evnt = self._data_gather_comp_knl(self.queue,
+                    (WGS_tot, ), (WGS, ), self.DataDev['rec_buff'].data,
+                    scratch.data, indx.data, i_comp, np.uint32(Np_stay))
+                evnt = self._data_pack_comp_knl(self.queue,
+                    (WGS_tot, ), (WGS, ), scratch.data,
+                    self.DataDev['rec_buff'].data, i_comp,
+                    np.uint32(0), np.uint32(Np_stay), wait_for=[evnt, ])
+                self.complete(evnt)
+                continue
+
+            buff = self.DataDev[comp + '_buff']
+            if buff.dtype == np.double:
+                align_knl = self._data_align_dbl_knl
+            else:
+                align_knl = self._data_align_part_knl
+
+            evnt = align_knl(self.queue, (WGS_tot, ), (WGS, ),
+                             buff.data, scratch.data,
+                             indx.data, np.uint32(Np_stay))
+            evnt = enqueue_copy(self.queue, buff.data, scratch.data,
+                                byte_count=Np_stay*buff.dtype.itemsize,
+                                wait_for=[evnt, ])
+            self.complete(evnt)
+
+            self.DataDev[comp + '_swap'] = None
+            self.DataDev[comp] = buff[:Np_stay]
+
+        if self.Args['Layout'] == 'AoS':
+            self.DataDev['rec_swap'] = None
+            self._set_record_views(Np_stay)
+
+    def compact_and_damp(self, comps_compact):
+        """
+        Remove the particles which left the grid, keeping the order of
+        the others. The staying particles are found from the last sort
+        and moved with a prefix sum over their mask, and the sorting
+        is remapped to stay valid.
+        """
+        self.sync_num_stay()
+        Np, Np_stay = self.Args['Np'], self.Args['Np_stay']
+        if Np_stay == Np or not self.flag_sort_valid:
+            return
+
+        Ncells = self.DataDev['sum_in_cell'].size
+        stay = self.dev_arr(dtype=np.uint32, shape=Np,
+                            allocator=self.DataDev['sort_indx_mp'])
+        compact_indx = self.dev_arr(dtype=np.uint32, shape=Np_stay,
+                                    allocator=self.DataDev['sort_indx_mp'])
+
+        WGS, WGS_tot = self.get_wgs(Np)
+        evnt = self._stay_mask_knl(self.queue, (WGS_tot, ), (WGS, ),
+                                   self.DataDev['indx_in_cell'].data,
+                                   stay.data, np.uint32(Ncells-1),
+                                   np.uint32(Np))
+        self.complete(evnt)
+
+        stay_offset = self._cumsum(stay,
+                                   allocator=self.DataDev['sort_indx_mp'])
+
+        evnt = self._compact_index_knl(self.queue, (WGS_tot, ), (WGS, ),
+                                       stay_offset.data, compact_indx.data,
+                                       np.uint32(Np))
+        self.complete(evnt)
+
+        self._copy_by_index(comps_compact, compact_indx)
+
+        # sorting of the staying particles is kept with the new indices
+        sort_indx = self.dev_arr(dtype=np.uint32, shape=Np_stay,
+                                 allocator=self.DataDev['sort_indx_mp'])
+        WGS, WGS_tot = self.get_wgs(Np_stay)
+        evnt = self._remap_sort_index_knl(self.queue, (WGS_tot, ), (WGS, ),
+                                          self.DataDev['sort_indx'].data,
+                                          stay_offset.data, sort_indx.data,
+                                          np.uint32(Np_stay))
+        self.complete(evnt)
+        self.DataDev['sort_indx'] = sort_indx
+
+        self.reset_num_parts()
+
+        indx_in_cell = self.dev_arr(dtype=np.uint32, shape=Np_stay,
+                                    allocator=self.DataDev['indx_in_cell_mp'])
+        evnt = self._data_align_int_knl(self.queue, (WGS_tot, ), (WGS, ),
+                                        self.DataDev['indx_in_cell'].data,
+                                        indx_in_cell.data, compact_indx.data,
+                                        self.DataDev['Np'].data)
+        self.complete(evnt)
+        self.DataDev['indx_in_cell'] = indx_in_cell
+
+        self.DataDev['sum_in_cell'][Ncells-1:].fill(0)
+        self.DataDev['cell_offset'][Ncells:].fill(Np_stay)
+        self.flag_sort_valid = True
+        self.sorts_since_compact = 0
+
+    def extract_parts(self, xmin, xmax):
+        """
+        Remove the particles outside of the interval [xmin, xmax), and
+        return their components on the host as the dictionaries of the
+        particles on the left and on the right of it (None if empty).
+        Only the leaving particles are transferred, and the others are
+        compacted on the device keeping their order.
+        """
+        if self.Args['Np'] == 0:
+            return None, None
+
+        if 'Immobile' in self.Args.keys():
+            comps = ['x', 'y', 'z', 'w']
+        else:
+            comps = ['x', 'y', 'z', 'px', 'py', 'pz', 'g_inv', 'w']
+
+        indx_out = self._range_index(xmin, xmax, inside=0)
+        Np_out = indx_out.size
+        if Np_out == 0:
+            return None, None
+
+        # all components are gathered as the rows of one double array,
+        # which is copied to the host by a single transfer
+        gather_knl = self._get_select_knls((), tuple(comps))[1]
+        args = [self._storage_data(comp) for comp in comps]
+        data_dev = self.dev_arr(dtype=np.double, shape=(len(comps), Np_out))
+        WGS, WGS_tot = self.get_wgs(Np_out)
+        evnt = gather_knl(self.queue, (WGS_tot, ), (WGS, ), *args,
+                          data_dev.data, indx_out.data, np.uint32(Np_out))
+        self.complete(evnt)
+
+        data_host = np.empty(data_dev.shape, dtype=np.double)
+        self.get_async(data_dev, data_host).wait()
+        data_out = dict(zip(comps, data_host))
+
+        # number of the remaining particles is known
+        indx_in = self._range_index(xmin, xmax, inside=1,
+                                    Np_sel=self.Args['Np']-Np_out)
+        if indx_in.size > 0:
+            self._copy_by_index(comps, indx_in)
+        elif self.Args['Layout'] == 'AoS':
+            self._set_record_views(0)
+        else:
+            for comp in comps:
+                self.DataDev[comp] = self.DataDev[comp + '_buff'][:0]
+
         self.reset_num_parts()
+        self.flag_sorted = False
+
+        to_left = data_out['x'] < xmin
+        data_sides = []
+        for select in (to_left, ~to_left):
+            if select.any():
+                data_sides.append({comp: data_out[comp][select]
+                                   for comp in comps})
+            else:
+                data_sides.append(None)
+
+        return data_sides
+
+    def insert_parts(self, data):
+        """
+        Append the particles, which components are given on the host
+        (e.g. as returned by extract_parts)
+        """
+        if data is None:
+            return
+
+        for comp in data.keys():
+            self.DataDev[comp + '_new'] = self.dev_arr(data[comp])
+        self.add_new_particles()
+        self.free_added()
+
+    def _range_index(self, xmin, xmax, inside=1, Np_sel=None):
+        # indices of the particles inside or outside of [xmin, xmax)
+        # in the storage order (see _mask_index for Np_sel)
+        Np = self.Args['Np']
+        mask = self.dev_arr(dtype=np.uint32, shape=Np,
+                            allocator=self.DataDev['sort_indx_mp'])
+
+        WGS, WGS_tot = self.get_wgs(Np)
+        evnt = self._range_mask_knl(self.queue, (WGS_tot, ), (WGS, ),
+                                    self.DataDev['x'].base_data, mask.data,
+                                    np.double(xmin), np.double(xmax),
+                                    np.uint32(inside), np.uint32(Np))
+        self.complete(evnt)
+        return self._mask_index(mask, Np_sel)
+
+    def _mask_index(self, mask, Np_sel=None):
+        # indices of the particles marked by the mask, which number
+        # is read from the device unless it is given as Np_sel
+        Np = mask.size
+        WGS, WGS_tot = self.get_wgs(Np)
+        offset = self._cumsum(mask, allocator=self.DataDev['sort_indx_mp'])
+
+        if Np_sel is None:
+            # this is a blocking read, which synchronizes the host
+            Np_sel = offset[-1].get().item()
+        indx = self.dev_arr(dtype=np.uint32, shape=Np_sel,
+                            allocator=self.DataDev['sort_indx_mp'])
+        if Np_sel == 0:
+            return indx
+
+        evnt = self._compact_index_knl(self.queue, (WGS_tot, ), (WGS, ),
+                                       offset.data, indx.data, np.uint32(Np))
+        self.complete(evnt)
+        return indx
+
+    def select_parts(self, comps, selections):
+        """
+        Get the components of the particles, which satisfy all the
+        selections [comp, vmin, vmax] (vmin < comp < vmax, None for no
+        limit), as the rows of a compact double array on the device.
+        The predicates and the gather are evaluated by one kernel each,
+        and only the selected data is left to be transferred.
+        """
+        Np = self.Args['Np']
+        preds = [select[0] for select in selections]
+        select_knl, gather_knl = self._get_select_knls(tuple(preds),
+                                                       tuple(comps))
+
+        args = []
+        for comp, vmin, vmax in selections:
+            if vmin is None: vmin = -np.inf
+            if vmax is None: vmax = np.inf
+            args += [self._storage_data(comp), np.double(vmin),
+                     np.double(vmax)]
+
+        mask = self.dev_arr(dtype=np.uint32, shape=Np,
+                            allocator=self.DataDev['sort_indx_mp'])
+        WGS, WGS_tot = self.get_wgs(Np)
+        evnt = select_knl(self.queue, (WGS_tot, ), (WGS, ), *args,
+                          mask.data, np.uint32(Np))
+        self.complete(evnt)
+
+        indx = self._mask_index(mask)
+        Np_sel = indx.size
+        data_sel = self.dev_arr(dtype=np.double, shape=(len(comps), Np_sel))
+        if Np_sel == 0:
+            return data_sel
+
+        args = [self._storage_data(comp) for comp in comps]
+        WGS, WGS_tot = self.get_wgs(Np_sel)
+        evnt = gather_knl(self.queue, (WGS_tot, ), (WGS, ), *args,
+                          data_sel.data, indx.data, np.uint32(Np_sel))
+        self.complete(evnt)
+        return data_sel
+
+    def select_moments(self, selections, moments, num_groups=64):
+        """
+        Get the sums over the particles, which satisfy all the
+        selections (see select_parts), of the products of their
+        components given as the tuples moments (e.g. ('w', 'x', 'x'),
+        where 'gamma' is 1/g_inv and () counts the particles) as a
+        device array. The sums are made by one kernel and added in
+        a fixed order, and no data is transferred
+        """
+        Np = self.Args['Np']
+        moments_sum = self.dev_arr(val=0, dtype=np.double,
+                                   shape=len(moments))
+        if Np == 0:
+            return moments_sum
+
+        args, knls = self._get_reduce_args(selections, moments, None)
+        num_groups = max(1, min(num_groups, int(np.ceil(Np / self.WGS))))
+        moments_grps = self.dev_arr(dtype=np.double,
+                                    shape=(num_groups, len(moments)))
+
+        evnt = knls.select_moments(self.queue,
+            (num_groups*self.WGS, ), (self.WGS, ), *args,
+            moments_grps.data, LocalMemory(8*self.WGS), np.uint32(Np))
+        self.complete(evnt)
+
+        self.sum_rows(moments_grps, moments_sum)
+        return moments_sum
+
+    def select_histogram(self, selections, comp, vmin, vmax, num_bins):
+        """
+        Get the histogram of the component (or 'gamma') weighted by
+        'w' of the particles, which satisfy all the selections, as a
+        device array (see histogram)
+        """
+        Np = self.Args['Np']
+        if Np == 0:
+            return self.dev_arr(val=0, dtype=np.double, shape=num_bins)
+
+        args, knls = self._get_reduce_args(selections, [('w', ), ], comp)
+        vals = self.dev_arr(dtype=np.double, shape=Np,
+                            allocator=self.DataDev['sort_indx_mp'])
+        weights = self.dev_arr(dtype=np.double, shape=Np,
+                               allocator=self.DataDev['sort_indx_mp'])
+
+        WGS, WGS_tot = self.get_wgs(Np)
+        evnt = knls.select_values(self.queue, (WGS_tot, ), (WGS, ), *args,
+                                  vals.data, weights.data, np.uint32(Np))
+        self.complete(evnt)
+
+        return self.histogram(vals, weights, vmin, vmax, num_bins)
+
+    def _get_reduce_args(self, selections, moments, val):
+        # arguments of the reduction kernels, which are compiled once
+        # for each set of the predicates, moments and value
+        preds = tuple(select[0] for select in selections)
+        moments = tuple(tuple(moment) for moment in moments)
+
+        comps = []
+        for moment in moments + ((val, ), ):
+            for comp in moment:
+                if comp == 'gamma': comp = 'g_inv'
+                if comp is not None and comp not in comps:
+                    comps.append(comp)
+
+        key = (preds, moments, val)
+        if key not in self._reduce_knls:
+            self._reduce_knls[key] = self.build_program(
+                ["particles_layout.cl", "particles_reduce.mako"],
+                defines=part_layout_defines[self.Args['Layout']],
+                render_args={'preds': self._comp_args(preds),
+                             'comps': self._comp_args(comps),
+                             'moments': moments, 'val': val})
+
+        args = []
+        for comp, vmin, vmax in selections:
+            if vmin is None: vmin = -np.inf
+            if vmax is None: vmax = np.inf
+            args += [self._storage_data(comp), np.double(vmin),
+                     np.double(vmax)]
+        args += [self._storage_data(comp) for comp in comps]
+        return args, self._reduce_knls[key]
+
+    def _get_select_knls(self, preds, comps):
+        # selection kernels are compiled once for each set of
+        # the predicates and gathered components
+        if (preds, comps) not in self._select_knls:
+            prg = self.build_program(
+                ["particles_layout.cl", "particles_select.mako"],
+                defines=part_layout_defines[self.Args['Layout']],
+                render_args={'preds': self._comp_args(preds),
+                             'comps': self._comp_args(comps)})
+            self._select_knls[(preds, comps)] = (prg.select_mask,
+                                                 prg.select_gather)
+
+        return self._select_knls[(preds, comps)]
+
+    def _comp_args(self, comps):
+        # names, record indices and types of the components
+        args = []
+        for comp in comps:
+            if self.Args['Layout'] == 'AoS' or \
+              self.DataDev[comp].dtype == np.double:
+                c_type = 'double'
+            else:
+                c_type = 'PART_REAL'
+            args.append((comp, part_record_comps.index(comp), c_type))
+        return args
+
+    def sort_locality(self):
+        """
+        Get the fraction of the sorted particles, which are stored
+        farther than locality_window from their predecessors in the
+        sorted order. It is zero for the aligned particles.
+        """
+        Np = self.Args['Np']
+        if Np < 2:
+            return 0.
+
+        self.set_to(self.DataDev['num_jumps'], 0)
+        WGS, WGS_tot = self.get_wgs(Np)
+        evnt = self._count_sort_jumps_knl(self.queue, (WGS_tot, ), (WGS, ),
+                                          self.DataDev['sort_indx'].data,
+                                          self.DataDev['num_jumps'].data,
+                                          np.uint32(locality_window),
+                                          np.uint32(Np))
+        self.complete(evnt)
+
+        # this is a blocking read, which synchronizes the host
+        return self.DataDev['num_jumps'].get().item() / (Np - 1.)
+
+    def align_by_policy(self):
+        """
+        Align the particles after the sort, if it is asked by the
+        policy: every AlignEvery sorts, or when the sort_locality
+        exceeds AlignLocality
+        """
+        if self.Args['Np'] == 0:
+            return
+
+        self.sorts_since_align += 1
+        align_every = self.Args['AlignEvery']
+        locality_max = self.Args['AlignLocality']
+
+        if align_every > 0 and self.sorts_since_align >= align_every:
+            self.align_parts()
+        elif locality_max is not None \
+          and self.sort_locality() > locality_max:
+            self.align_parts()
+
+    def compact_by_policy(self):
+        """
+        Remove the particles which left the grid after the sort, if
+        it is asked by the policy: every CompactEvery sorts, or when
+        their fraction exceeds CompactFraction
+        """
+        if self.Args['Np'] == 0:
+            return
+
+        self.sorts_since_compact += 1
+        compact_every = self.Args['CompactEvery']
+        fraction_max = self.Args['CompactFraction']
+
+        if compact_every > 0 and self.sorts_since_compact >= compact_every:
+            self.compact_parts()
+        elif fraction_max is not None:
+            # this waits for Np_stay from the sort
+            self.sync_num_stay()
+            Np_out = self.Args['Np'] - self.Args['Np_stay']
+            if Np_out > fraction_max * self.Args['Np']:
+                self.compact_parts()
+
+    def _grow_capacity(self, Np, comps):
+        """
+        Reallocate the particle storage to hold at least Np particles,
+        so the capacity grows geometrically. The ping-pong buffers are
+        released and allocated again at the next alignment.
+        """
+        capacity = max(Np, int(self.Args['CapacityGrowth'] \
+                               * self.Args['Np_capacity']))
+        old_Np = self.DataDev['x'].size
+
+        if self.Args['Layout'] == 'AoS':
+            Nc = len(part_record_comps)
+            buff = self.dev_arr(dtype=np.double, shape=capacity*Nc)
+            if old_Np > 0:
+                buff[:old_Np*Nc] = self.DataDev['rec']
+            self.DataDev['rec_buff'] = buff
+            self.DataDev['rec_swap'] = None
+            self._set_record_views(old_Np)
+            self.Args['Np_capacity'] = capacity
+            return
+
+        for comp in comps:
+            buff = self.dev_arr(dtype=self.DataDev[comp].dtype,
+                                shape=capacity)
+            if old_Np > 0:
+                buff[:old_Np] = self.DataDev[comp]
+            self.DataDev[comp] = buff[:old_Np]
+            self.DataDev[comp + '_buff'] = buff
+            self.DataDev[comp + '_swap'] = None
+
+        self.Args['Np_capacity'] = capacity
 
     def reset_num_parts(self, Np=None):
         if Np is None:
@@ -291,14 +1199,103 @@ class ParticleMethodsCL(GenericMethodsCL):
         self.DataDev['Np'].fill(Np)
         self.Args['Np'] = Np
         self.Args['Np_stay'] = Np
+        self._num_stay_evnt = None
+        self.flag_sort_valid = False
+
+    def get_state(self):
+        """
+        Get the device arrays and the host values which define the
+        state of the species (used by Checkpoint). Together with the
+        sorting data and the random generator state, they allow
+        to continue the simulation exactly
+        """
+        self.sync_num_stay()
+        if self.Args['Layout'] == 'AoS':
+            comps = ['rec', ]
+        elif 'Immobile' not in self.Args.keys():
+            comps = ['x', 'y', 'z', 'px', 'py', 'pz', 'w', 'g_inv']
+        else:
+            comps = ['x', 'y', 'z','w']
+
+        state_dev = {comp: self.DataDev[comp] for comp in comps}
+        for arg in ['sort_indx', 'cell_offset',
+                    'indx_in_cell', 'sum_in_cell']:
+            if arg in self.DataDev:
+                state_dev[arg] = self.DataDev[arg]
+
+        state_host = {arg: self.Args[arg] for arg in
+                      ['Np', 'Np_stay', 'Np_capacity', 'right_lim']}
+        for arg in ['flag_sorted', 'flag_sort_valid',
+                    'sorts_since_align', 'sorts_since_compact']:
+            state_host[arg] = getattr(self, arg)
+
+        state_host['generator_key'] = np.array(self._generator_knl.key)
+        state_host['generator_counter'] = \
+            np.array(self._generator_knl.counter)
+
+        return state_dev, state_host
+
+    def set_state(self, state):
+        """
+        Set the state of the species from the host data of get_state
+        """
+        Np = int(state['Np'])
+        capacity = max(int(state['Np_capacity']), Np)
+
+        if self.Args['Layout'] == 'AoS':
+            Nc = len(part_record_comps)
+            self.DataDev['rec_buff'] = self.dev_arr(dtype=np.double,
+                                                    shape=capacity*Nc)
+            self.DataDev['rec_swap'] = None
+            self.set_from_host(self.DataDev['rec_buff'][:Np*Nc],
+                               state['rec'])
+            self._set_record_views(Np)
+        else:
+            if 'Immobile' not in self.Args.keys():
+                comps = ['x', 'y', 'z', 'px', 'py', 'pz', 'w', 'g_inv']
+            else:
+                comps = ['x', 'y', 'z','w']
+
+            for comp in comps:
+                buff = self.dev_arr(dtype=state[comp].dtype, shape=capacity)
+                self.DataDev[comp] = buff[:Np]
+                self.set_from_host(self.DataDev[comp], state[comp])
+                self.DataDev[comp + '_buff'] = buff
+                self.DataDev[comp + '_swap'] = None
+
+        self.Args['Np_capacity'] = capacity
+        self.reset_num_parts(Np)
+        self.Args['Np_stay'] = int(state['Np_stay'])
+
+        self.Args['right_lim'] = float(state['right_lim'])
+        self.DataDev['right_lim'].fill(self.Args['right_lim'])
+
+        for arg in ['sort_indx', 'cell_offset',
+                    'indx_in_cell', 'sum_in_cell']:
+            if arg in state:
+                self.DataDev[arg] = self.dev_arr(dtype=np.uint32,
+                    shape=state[arg].size,
+                    allocator=self.DataDev[arg + '_mp'])
+                self.set_from_host(self.DataDev[arg], state[arg])
+
+        self.flag_sorted = bool(state['flag_sorted'])
+        self.flag_sort_valid = bool(state['flag_sort_valid'])
+        self.sorts_since_align = int(state['sorts_since_align'])
+        self.sorts_since_compact = int(state['sorts_since_compact'])
+
+        self._generator_knl.key = [int(v) for v in state['generator_key']]
+        self._generator_knl.counter = \
+            [int(v) for v in state['generator_counter']]
 
     def _fill_arr_randn(self, arr, mu=0, sigma=1):
-        self._generator_knl.fill_normal(ary=arr, queue=self.queue,
-                                        mu=mu, sigma=sigma).wait()
+        evnt = self._generator_knl.fill_normal(ary=arr, queue=self.queue,
+                                               mu=mu, sigma=sigma)
+        return self.complete(evnt)
 
     def _fill_arr_rand(self, arr, xmin=0, xmax=1):
-        self._generator_knl.fill_uniform(ary=arr, queue=self.queue,
-                                         a=xmin,b=xmax).wait()
+        evnt = self._generator_knl.fill_uniform(ary=arr, queue=self.queue,
+                                                a=xmin,b=xmax)
+        return self.complete(evnt)
 
     def _cumsum(self, arr_in, allocator=None, output_dtype=np.uint32):
         evnt, arr_tmp = cumsum(arr_in, return_event=True,
@@ -306,7 +1303,7 @@ class ParticleMethodsCL(GenericMethodsCL):
         arr_out = self.dev_arr(dtype=output_dtype, shape=arr_tmp.size+1,
                                allocator=allocator)
         arr_out[0] = 0
-        evnt.wait()
+        self.complete(evnt)
         arr_out[1:] = arr_tmp[:]
         return arr_out
 
@@ -321,5 +1318,5 @@ class ParticleMethodsCL(GenericMethodsCL):
         else:
             args_strs = ['x', 'y', 'z','w']
 
-        for arg in args_strs:
+        for arg in args_strs + ['theta', ]:
             self.DataDev[arg+'_new'] = None
@@ -1,30 +1,22 @@
 import numpy as np
 
-from pyopencl import Program
 from pyopencl import enqueue_marker, enqueue_barrier
 from pyopencl.array import empty_like
 
 from .generic_methods_cl import GenericMethodsCL
-from .generic_methods_cl import compiler_options
-
-from chimeraCL import __path__ as src_path
-src_path = src_path[0] + '/kernels/'
 
 
 class SolverMethodsCL(GenericMethodsCL):
     def init_solver_methods(self):
-        solver_sources = []
-        solver_sources.append(''.join(open(src_path+"solver_ms_pic.cl")\
-              .readlines()) )
-
-        solver_sources = self.block_def_str + ''.join(solver_sources)
-
-        prg = Program(self.ctx, solver_sources).\
-            build(options=compiler_options)
+        prg = self.build_program(["solver_ms_pic.cl", ])
 
         self._advance_e_g_m_knl = prg.advance_e_g_m
+        self._advance_e_g_grad_m_knl = prg.advance_e_g_grad_m
+        self._stack_rot_m_knl = prg.stack_rot_m
+        self._rot_poiss_m_knl = prg.rot_poiss_m
         self._profile_edges_c_knl = prg.profile_edges_c
         self._profile_edges_d_knl = prg.profile_edges_d
+        self._profile_edges_stack_knl = prg.profile_edges_stack
 
         if 'DampCells' in self.Args:
             self._init_field_damping()
@@ -40,8 +32,9 @@ class SolverMethodsCL(GenericMethodsCL):
         self.Args['dont_keep'].append('DampProfile')
         self.Args['dont_send'].append('DampCells')
 
-    def advance_fields(self, vecs):
+    def advance_fields(self, vecs, wait_for=None):
         WGS, WGS_tot = self.get_wgs(self.Args['NxNrm1'])
+        evnts = []
         for m in range(self.Args['M']+1):
             mstr = '_m'+str(m)
             solver_str = ['NxNrm1', 'dt_inv',
@@ -59,10 +52,186 @@ class SolverMethodsCL(GenericMethodsCL):
             args_fld = [self.DataDev[arg].data for arg in fld_str]
 
             args = args_solver + args_fld
-            self._advance_e_g_m_knl(self.queue, (WGS_tot, ), (WGS, ),*args).wait()
+            evnts.append(self._advance_e_g_m_knl(self.queue,
+                (WGS_tot, ), (WGS, ), *args, wait_for=wait_for))
+
+        evnt = enqueue_barrier(self.queue, wait_for=evnts)
+        return self.complete(evnt)
+
+    def advance_fields_grad(self, scl, vecs, wait_for=None):
+        """
+        Advance the fields as `advance_fields`, with the gradient of
+        the scalar `scl` computed into the last vector within the same
+        kernel. Only the DHT-coupling of the neighbour modes is done
+        separately by the matrix products
+        """
+        WGS, WGS_tot = self.get_wgs(self.Args['NxNrm1'])
+        M = self.Args['M']
+
+        if M > 0:
+            self._get_mm1_scl(scl)
+
+        evnts = []
+        for m in range(M+1):
+            # m-1 and m+1 components
+            if m > 0:
+                self._cdot(self.DataDev['fld_buff0_c'],
+                           self.DataDev['dDHT_minus_m'+str(m)],
+                           self.DataDev[scl + '_fb_m' + str(m-1)])
+            elif M > 0:
+                self._cdot(self.DataDev['fld_buff0_c'],
+                           self.DataDev['dDHT_minus_m'+str(m)],
+                           self.DataDev['buff_fb_m-1_x'])
+
+            if m < M:
+                self._cdot(self.DataDev['fld_buff1_c'],
+                           self.DataDev['dDHT_plus_m'+str(m)],
+                           self.DataDev[scl + '_fb_m' + str(m+1)])
+
+            mstr = '_m'+str(m)
+            solver_str = ['NxNrm1', 'Nx', 'dt_inv',
+                          'MxSlv_cos(wdt)' + mstr,
+                          'MxSlv_sin(wdt)*w' + mstr,
+                          'MxSlv_1/w**2' + mstr, 'kx',
+                          scl + '_fb' + mstr,
+                          'fld_buff0_c', 'fld_buff1_c']
+
+            mstr = '_fb_m'+str(m)
+            fld_str = []
+            for v in vecs:
+                for c in self.Args['vec_comps']:
+                    fld_str.append(v+c+mstr)
 
-    def profile_edges(self, flds):
+            args = [self.DataDev[arg].data for arg in solver_str] \
+                 + [np.uint32(M > 0), np.uint32(m < M)] \
+                 + [self.DataDev[arg].data for arg in fld_str]
+
+            # buffers are reused by the next mode, so the modes are
+            # advanced in order
+            evnt = self._advance_e_g_grad_m_knl(self.queue,
+                (WGS_tot, ), (WGS, ), *args, wait_for=wait_for)
+            evnts.append(self.complete(evnt))
+
+        evnt = enqueue_barrier(self.queue, wait_for=evnts)
+        return self.complete(evnt)
+
+    def field_rot_poiss(self, fld_in, fld_out, wait_for=None):
+        """
+        Get the rotor of the vector `fld_in` multiplied by the Poisson
+        factor into `fld_out`. The neighbour modes are stacked in pairs
+        of components, so each DHT-coupling is one matrix product, and
+        the rest is done by one kernel per mode
+        """
+        WGS, WGS_tot = self.get_wgs(self.Args['NxNrm1'])
+        M = self.Args['M']
+
+        if M > 0:
+            self._get_mm1_vec(fld_in)
+
+        evnts = []
+        for m in range(M+1):
+            # m-1 and m+1 components
+            for m_nb, sgn, stack_out in ((m-1, -1., 'rot_stack1_c'),
+                                         (m+1, 1., 'rot_stack2_c')):
+                if m_nb > M or (m_nb < 0 and M == 0):
+                    continue
+
+                if m_nb >= 0:
+                    flds_nb = [fld_in + c + '_fb_m' + str(m_nb)
+                               for c in self.Args['vec_comps']]
+                else:
+                    flds_nb = ['buff_fb_m-1_' + c
+                               for c in self.Args['vec_comps']]
+
+                args = [self.DataDev['rot_stack0_c'].data] \
+                     + [self.DataDev[arg].data for arg in flds_nb] \
+                     + [np.double(sgn), self.DataDev['NxNrm1'].data,
+                        self.DataDev['Nx'].data]
+                evnt = self._stack_rot_m_knl(self.queue, (WGS_tot, ),
+                                             (WGS, ), *args)
+                self.complete(evnt)
+
+                dht_str = ['dDHT_minus_m', 'dDHT_plus_m'][m_nb > m]
+                self._rot_dot(self.DataDev[stack_out],
+                              self.DataDev[dht_str + str(m)],
+                              self.DataDev['rot_stack0_c'])
+
+            mstr = '_m'+str(m)
+            args_str = ['NxNrm1', 'Nx', 'kx', 'Poiss' + mstr,
+                        fld_in + 'y_fb' + mstr, fld_in + 'z_fb' + mstr,
+                        'rot_stack1_c', 'rot_stack2_c']
+            args = [self.DataDev[arg].data for arg in args_str] \
+                 + [np.uint32(M > 0), np.uint32(m < M)] \
+                 + [self.DataDev[fld_out + c + '_fb' + mstr].data
+                    for c in self.Args['vec_comps']]
+
+            evnt = self._rot_poiss_m_knl(self.queue, (WGS_tot, ), (WGS, ),
+                                         *args, wait_for=wait_for)
+            evnts.append(self.complete(evnt))
+
+        evnt = enqueue_barrier(self.queue, wait_for=evnts)
+        return self.complete(evnt)
+
+    def profile_edges_fb(self, flds, wait_for=None):
+        """
+        Multiply the edges of the spectral fields by the damping
+        profile in (x, kr)-space. The fields of all modes are stacked
+        once, and the profile is applied to the stack between the FFTs,
+        so no real space fields are written
+        """
+        stacks = self._get_fld_stacks(len(flds))
+        modes = range(self.Args['M']+1)
+        flds_fb = [fld + '_fb_m' for fld in flds]
+
+        self._copy_stack(self._stack_fld_c_knl, stacks['c1'],
+                         flds_fb, modes, 0)
+        stacks['fft'][1](stacks['c0'], stacks['c1'],
+                         self._get_phase_shift(1))
+
+        stack = stacks['c0']
+
+        # edges of a subdomain are not damped, but are taken
+        # from the neighbours
+        Nf = [2*self.Args['DampCells'], ] * 2
+        if 'Decomposition' in self.Args:
+            decomp = self.Args['Decomposition']
+            decomp.exchange_guards(self, stack)
+            for side in range(2):
+                if decomp.get_guards(self)[side] > 0:
+                    Nf[side] = 0
+
+        WGS, WGS_tot = self.get_wgs(stack.size)
+        evnt = self._profile_edges_stack_knl(self.queue,
+            (WGS_tot, ), (WGS, ), stack.data,
+            self.DataDev['DampProfile'].data,
+            np.uint32(stack.size), np.uint32(stack[0].size),
+            np.uint32(self.Args['Nx']), np.uint32(Nf[0]),
+            np.uint32(Nf[1]), wait_for=wait_for)
+        self.complete(evnt)
+
+        stacks['fft'][0](stacks['c1'], stacks['c0'],
+                         self._get_phase_shift(0))
+        return self._copy_stack(self._unstack_fld_c_knl, stacks['c1'],
+                                flds_fb, modes, 0)
+
+    def _init_solver_data_on_dev(self):
+        # the stacks of pairs of components for the fused rotor, and
+        # the matrix product compiled for them (see _get_fld_stacks)
+        for i_stack in range(3):
+            self.DataDev['rot_stack{:d}_c'.format(i_stack)] = self.dev_arr(
+                val=0, dtype=self.fld_cdtype,
+                shape=(self.Args['Nr']-1, 2*self.Args['Nx']))
+
+        input_transform = self.dev_arr(dtype=np.double,
+                                       shape=(self.Args['Nr']-1,
+                                              self.Args['Nr']-1))
+        self._rot_dot = self._make_dot(input_transform,
+                                       self.DataDev['rot_stack0_c'],
+                                       self.DataDev['rot_stack1_c'])
+
+    def profile_edges(self, flds, wait_for=None):
         WGS, WGS_tot = self.get_wgs(self.Args['NxNr'])
+        evnts = []
 
         for fld in flds:
             for comp in self.Args['vec_comps']:
@@ -74,10 +243,13 @@ class SolverMethodsCL(GenericMethodsCL):
                     elif self.DataDev[fld_str].dtype==np.complex128:
                         profiler = self._profile_edges_c_knl
 
-                    profiler(self.queue, (WGS_tot, ), (WGS, ),
-                             self.DataDev[fld_str].data,
-                             self.DataDev['DampProfile'].data,
-                             np.uint32(self.Args['NxNr']),
-                             np.uint32(self.Args['Nx']),
-                             np.uint32(2*self.Args['DampCells'])
-                            ).wait()
+                    evnts.append(profiler(self.queue, (WGS_tot, ), (WGS, ),
+                        self.DataDev[fld_str].data,
+                        self.DataDev['DampProfile'].data,
+                        np.uint32(self.Args['NxNr']),
+                        np.uint32(self.Args['Nx']),
+                        np.uint32(2*self.Args['DampCells']),
+                        wait_for=wait_for))
+
+        evnt = enqueue_barrier(self.queue, wait_for=evnts)
+        return self.complete(evnt)
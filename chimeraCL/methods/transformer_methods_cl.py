@@ -1,16 +1,13 @@
 import numpy as np
 
-from pyopencl import Program
 from pyopencl import enqueue_barrier
 from pyopencl.array  import to_device, empty_like
 from reikna.fft import FFT
 from reikna.linalg import MatrixMul
+from reikna.core import Transformation, Parameter, Annotation, Type
+from reikna.cluda import functions
 
 from .generic_methods_cl import GenericMethodsCL
-from .generic_methods_cl import compiler_options
-
-from chimeraCL import __path__ as src_path
-src_path = src_path[0] + '/kernels/'
 
 
 class TransformerMethodsCL(GenericMethodsCL):
@@ -18,30 +15,38 @@ class TransformerMethodsCL(GenericMethodsCL):
         self.init_generic_methods()
         self.set_global_working_group_size()
 
-        transformer_sources = []
-        transformer_sources.append(
-            ''.join(open(src_path+"transformer_generic.cl").readlines()) )
-
-        transformer_sources = self.block_def_str + ''.join(transformer_sources)
-
-        prg = Program(self.ctx, transformer_sources).\
-            build(options=compiler_options)
+        prg = self.build_program(["transformer_generic.cl", ])
 
         self._phase_knl = {0: prg.get_phase_minus,
                            1: prg.get_phase_plus}
         self._multiply_by_phase_knl = prg.multiply_by_phase
         self._get_m1_knl = prg.get_m1
 
-        self._prepare_fft()
+        self._stack_fld_d_knl = prg.stack_fld_d
+        self._stack_fld_d2c_knl = prg.stack_fld_d2c
+        self._stack_fld_c_knl = prg.stack_fld_c
+        self._unstack_fld_d_knl = prg.unstack_fld_d
+        self._unstack_fld_c2d_knl = prg.unstack_fld_c2d
+        self._unstack_fld_c_knl = prg.unstack_fld_c
+
+        self._fld_stacks = {}
+        self._fld_stacks_capacity = 0
+        self._phs_shft_xmin = [None, None]
         self._prepare_dot()
 
     def transform_field(self, arg_cmp, dir, mode):
-        # do the phase shift
-        WGS, WGS_tot = self.get_wgs(self.Args['Nx'])
+        self.transform_fields([arg_cmp, ], dir, mode)
+
+    def transform_fields(self, flds, dir, mode):
+        """
+        Transform the group of fields at once. All fields of all modes
+        are copied into the stack, which is transformed by one DHT per
+        dtype (0 mode is real) and one FFT
+        """
+        if len(flds) == 0:
+            return
 
-        args = [self.DataDev['phs_shft'].data, self.DataDev['kx'].data,
-                np.double(self.Args['Xmin']), np.uint32(self.Args['Nx']) ]
-        self._phase_knl[dir](self.queue, (WGS_tot, ), (WGS, ), *args).wait()
+        stacks = self._get_fld_stacks(len(flds))
 
         if mode=='full':
             forward = self._transform_forward
@@ -51,17 +56,35 @@ class TransformerMethodsCL(GenericMethodsCL):
             backward = self._half_transform_backward
 
         if dir == 0:
-            dht_arg = 'DHT_m'
-            arg_in = arg_cmp + '_m'
-            arg_out = arg_cmp + '_fb_m'
+            flds_in = [fld + '_m' for fld in flds]
+            flds_out = [fld + '_fb_m' for fld in flds]
             transformer = forward
         elif dir == 1:
-            dht_arg = 'DHT_inv_m'
-            arg_in = arg_cmp + '_fb_m'
-            arg_out = arg_cmp + '_m'
+            flds_in = [fld + '_fb_m' for fld in flds]
+            flds_out = [fld + '_m' for fld in flds]
             transformer = backward
 
-        transformer(dht_arg, arg_in, arg_out, self.DataDev['phs_shft'])
+        transformer(flds_in, flds_out, stacks, self._get_phase_shift(dir))
+
+    def _get_phase_shift(self, dir):
+        """
+        Get the phase shift exp(-/+ i*kx*Xmin) of the transforms,
+        which is recomputed only when the frame origin is moved
+        """
+        phs_shft = self.DataDev['phs_shft_' + str(dir)]
+
+        if self._phs_shft_xmin[dir] != self.Args['Xmin']:
+            WGS, WGS_tot = self.get_wgs(self.Args['Nx'])
+
+            args = [phs_shft.data, self.DataDev['kx'].data,
+                    np.double(self.Args['Xmin']),
+                    np.uint32(self.Args['Nx']) ]
+            evnt = self._phase_knl[dir](self.queue, (WGS_tot, ), (WGS, ),
+                                        *args)
+            self.complete(evnt)
+            self._phs_shft_xmin[dir] = self.Args['Xmin']
+
+        return phs_shft
 
     def field_poiss_vec(self, fld):
         for m in range(0,self.Args['M']+1):
@@ -272,7 +295,8 @@ class TransformerMethodsCL(GenericMethodsCL):
                    + [self.DataDev[arg].data for arg in arg_str]
 
             WGS, WGS_tot = self.get_wgs(self.Args['NxNrm1'])
-            self._get_m1_knl(self.queue, (WGS_tot, ), (WGS, ),*args).wait()
+            evnt = self._get_m1_knl(self.queue, (WGS_tot, ), (WGS, ),*args)
+            self.complete(evnt)
 
     def _get_mm1_scl(self, fld, comp='x'):
         # Note: for scalar the X component of buffer will be used
@@ -285,225 +309,316 @@ class TransformerMethodsCL(GenericMethodsCL):
                + [self.DataDev[arg].data for arg in arg_str]
 
         WGS, WGS_tot = self.get_wgs(self.Args['NxNrm1'])
-        self._get_m1_knl(self.queue, (WGS_tot, ), (WGS, ),*args).wait()
+        evnt = self._get_m1_knl(self.queue, (WGS_tot, ), (WGS, ),*args)
+        self.complete(evnt)
 
-    def _transform_forward(self, dht_arg, arg_in, arg_out, phs_shft):
+    def _transform_forward(self, flds_in, flds_out, stacks, phs_shft):
         dir = 0
-        WGS, WGS_tot = self.get_wgs(self.Args['NxNrm1'])
-
-        # DHT of 0 mode into a temporal array
-        self.DataDev['fld_buff0_d'][:] = self.DataDev[arg_in+'0'][1:]
-        self._ddot(self.DataDev['fld_buff1_d'], self.DataDev[dht_arg+'0'],
-                   self.DataDev['fld_buff0_d'])
-        enqueue_barrier(self.queue)
-
-        # FFT of 0 mode casted to complex dtype
-        self.DataDev[arg_out+'0'][:] = self.DataDev['fld_buff1_d'].\
-                                        astype(np.complex128)
-        enqueue_barrier(self.queue)
-        self._fft(self.DataDev[arg_out+'0'], self.DataDev[arg_out+'0'], dir)
-
-        # Phase shift of the result
-        phs_str = [arg_out+'0', 'NxNrm1', 'Nx']
-        phs_args = [self.DataDev[arg].data for arg in phs_str]
-        phs_args += [phs_shft.data, ]
-        self._multiply_by_phase_knl(self.queue, (WGS_tot, ), (WGS,),
-                                    *phs_args).wait()
-
-        # Same for m>0 modes
-        for m in range(1,self.Args['M']+1):
-            arg_in_m = arg_in + str(m)
-            arg_out_m = arg_out + str(m)
-
-            # DHT of m mode into a temporal array
-            self.DataDev['fld_buff0_c'][:] = self.DataDev[arg_in_m][1:]
-            self._cdot(self.DataDev[arg_out_m], self.DataDev[dht_arg+str(m)],
-                       self.DataDev['fld_buff0_c'])
-            enqueue_barrier(self.queue)
-
-            # FFT of m mode
-            self._fft(self.DataDev[arg_out_m], self.DataDev[arg_out_m], dir)
-
-            # Phase shift of the result
-            phs_str = [arg_out_m, 'NxNrm1', 'Nx']
-            phs_args = [self.DataDev[arg].data for arg in phs_str]
-            phs_args += [phs_shft.data, ]
-            self._multiply_by_phase_knl(self.queue, (WGS_tot, ), (WGS, ),
-                                        *phs_args).wait()
-
-    def _transform_backward(self, dht_arg, arg_in, arg_out, phs_shft):
-        dir = 1
-        WGS, WGS_tot = self.get_wgs(self.Args['NxNrm1'])
-
-        # Copy and phase-shift the field
-        self.DataDev['fld_buff0_c'][:] = self.DataDev[arg_in+'0']
-
-        phs_str = ['NxNrm1', 'Nx']
-        phs_args = [self.DataDev[arg].data for arg in phs_str]
-        phs_args = [self.DataDev['fld_buff0_c'].data, ] + phs_args \
-                   + [phs_shft.data, ]
-
-        self._multiply_by_phase_knl(self.queue, (WGS_tot, ), (WGS, ),
-                                    *phs_args).wait()
-
-        # FFT of 0 mode and casting result to double dtype
-        self._fft(self.DataDev['fld_buff0_c'], self.DataDev['fld_buff0_c'], dir)
-        self.cast_array_c2d(self.DataDev['fld_buff0_c'],
-                            self.DataDev['fld_buff0_d'])
-
-        # DHT of 0 mode
-        self._ddot(self.DataDev['fld_buff1_d'], self.DataDev[dht_arg+'0'],
-                   self.DataDev['fld_buff0_d'])
-        enqueue_barrier(self.queue)
-        self.DataDev[arg_out+'0'][1:] = self.DataDev['fld_buff1_d']
-
-        # Same for m>0 modes
-        for m in range(1, self.Args['M']+1):
-            arg_in_m = arg_in + str(m)
-            arg_out_m = arg_out + str(m)
-
-            # Copy and phase-shift the field
-            self.DataDev['fld_buff0_c'][:] = self.DataDev[arg_in_m]
-            phs_str = ['NxNrm1', 'Nx']
-            phs_args = [self.DataDev[arg].data for arg in phs_str]
-            phs_args = [self.DataDev['fld_buff0_c'].data, ] + phs_args \
-                       + [phs_shft.data, ]
-            self._multiply_by_phase_knl(self.queue, (WGS_tot, ), (WGS, ),
-                                        *phs_args).wait()
-
-            # FFT of m mode into a temporal array
-            self._fft(self.DataDev['fld_buff0_c'], self.DataDev['fld_buff0_c'],
-                      dir)
-
-            # DHT of m mode
-            self._cdot(self.DataDev['fld_buff1_c'],
-                       self.DataDev[dht_arg+str(m)],
-                       self.DataDev['fld_buff0_c'])
-            enqueue_barrier(self.queue)
-            self.DataDev[arg_out_m][1:] = self.DataDev['fld_buff1_c']
+        M = self.Args['M']
+        Nx = self.Args['Nx']
 
-    def _half_transform_backward(self, dht_arg, arg_in, arg_out, phs_shft):
-        dir = 1
-        WGS, WGS_tot = self.get_wgs(self.Args['NxNrm1'])
-
-        # Copy and phase-shift the field
-        self.DataDev['fld_buff0_c'][:] = self.DataDev[arg_in+'0']
-
-        phs_str = ['NxNrm1', 'Nx']
-        phs_args = [self.DataDev[arg].data for arg in phs_str]
-        phs_args = [self.DataDev['fld_buff0_c'].data, ] + phs_args \
-                   + [phs_shft.data, ]
+        # DHT of 0 mode into a temporal stack
+        self._copy_stack(self._stack_fld_d_knl, stacks['d0'],
+                         flds_in, [0, ], Nx)
+        stacks['ddot'](stacks['d1'], self.DataDev['DHT_m0'], stacks['d0'])
 
-        self._multiply_by_phase_knl(self.queue, (WGS_tot, ), (WGS, ),
-                                    *phs_args).wait()
+        # 0 mode is casted to complex dtype into the 0-th place of stack
+        self.cast_array_r2c(stacks['d1'], stacks['c1'])
 
-        # FFT of 0 mode and casting result to double dtype
-        self._fft(self.DataDev['fld_buff0_c'], self.DataDev['fld_buff0_c'], dir)
-        self.cast_array_c2d(self.DataDev['fld_buff0_c'],
-                            self.DataDev['fld_buff0_d'])
+        # DHT of m>0 modes
+        if M > 0:
+            self._copy_stack(self._stack_fld_c_knl, stacks['c0'],
+                             flds_in, range(1, M+1), Nx)
+            stacks['cdot'](stacks['c1_dht'], self.DataDev['DHT_mp'],
+                           stacks['c0_dht'])
 
-        self.DataDev[arg_out+'0'][1:] = self.DataDev['fld_buff0_d']
+        # FFT of all modes with the phase shift of the result
+        stacks['fft'][dir](stacks['c0'], stacks['c1'], phs_shft)
 
-        # Same for m>0 modes
-        for m in range(1, self.Args['M']+1):
-            arg_in_m = arg_in + str(m)
-            arg_out_m = arg_out + str(m)
+        self._copy_stack(self._unstack_fld_c_knl, stacks['c0'],
+                         flds_out, range(M+1), 0)
 
-            # Copy and phase-shift the field
-            self.DataDev['fld_buff0_c'][:] = self.DataDev[arg_in_m]
-            phs_str = ['NxNrm1', 'Nx']
-            phs_args = [self.DataDev[arg].data for arg in phs_str]
-            phs_args = [self.DataDev['fld_buff0_c'].data, ] + phs_args \
-                       + [phs_shft.data, ]
-            self._multiply_by_phase_knl(self.queue, (WGS_tot, ), (WGS, ),
-                                        *phs_args).wait()
+    def _transform_backward(self, flds_in, flds_out, stacks, phs_shft):
+        dir = 1
+        M = self.Args['M']
+        Nx = self.Args['Nx']
+
+        # FFT of all modes with the phase shift of the fields
+        self._copy_stack(self._stack_fld_c_knl, stacks['c1'],
+                         flds_in, range(M+1), 0)
+        stacks['fft'][dir](stacks['c0'], stacks['c1'], phs_shft)
+
+        # DHT of 0 mode casted to double dtype
+        self.cast_array_c2d(stacks['c0'], stacks['d0'],
+                            arr_size=stacks['d0'].size)
+        stacks['ddot'](stacks['d1'], self.DataDev['DHT_inv_m0'],
+                       stacks['d0'])
+        self._copy_stack(self._unstack_fld_d_knl, stacks['d1'],
+                         flds_out, [0, ], Nx)
+
+        # DHT of m>0 modes
+        if M > 0:
+            stacks['cdot'](stacks['c1_dht'], self.DataDev['DHT_inv_mp'],
+                           stacks['c0_dht'])
+            self._copy_stack(self._unstack_fld_c_knl, stacks['c1'],
+                             flds_out, range(1, M+1), Nx)
+
+    def _half_transform_backward(self, flds_in, flds_out, stacks, phs_shft):
+        dir = 1
+        M = self.Args['M']
+        Nx = self.Args['Nx']
 
-            # FFT of m mode into a temporal array
-            self._fft(self.DataDev['fld_buff0_c'], self.DataDev['fld_buff0_c'],
-                      dir)
+        # FFT of all modes with the phase shift of the fields
+        self._copy_stack(self._stack_fld_c_knl, stacks['c1'],
+                         flds_in, range(M+1), 0)
+        stacks['fft'][dir](stacks['c0'], stacks['c1'], phs_shft)
 
-            self.DataDev[arg_out_m][1:] = self.DataDev['fld_buff0_c']
+        # 0 mode is casted to double dtype
+        self._copy_stack(self._unstack_fld_c2d_knl, stacks['c0'],
+                         flds_out, [0, ], Nx)
+        self._copy_stack(self._unstack_fld_c_knl, stacks['c0'],
+                         flds_out, range(1, M+1), Nx)
 
-    def _half_transform_forward(self, dht_arg, arg_in, arg_out, phs_shft):
+    def _half_transform_forward(self, flds_in, flds_out, stacks, phs_shft):
         dir = 0
+        M = self.Args['M']
+        Nx = self.Args['Nx']
+
+        # 0 mode is casted to complex dtype
+        self._copy_stack(self._stack_fld_d2c_knl, stacks['c1'],
+                         flds_in, [0, ], Nx)
+        self._copy_stack(self._stack_fld_c_knl, stacks['c1'],
+                         flds_in, range(1, M+1), Nx)
+
+        # FFT of all modes with the phase shift of the result
+        stacks['fft'][dir](stacks['c0'], stacks['c1'], phs_shft)
+
+        self._copy_stack(self._unstack_fld_c_knl, stacks['c0'],
+                         flds_out, range(M+1), 0)
+
+    def _copy_stack(self, knl, stack, flds, modes, fld_offset):
+        """
+        Copy the fields to or from the stack with the kernel `knl`.
+        Fields `flds` are the names without the mode number, and
+        `fld_offset` allows to skip the guard row
+        """
         WGS, WGS_tot = self.get_wgs(self.Args['NxNrm1'])
+        Nfld = len(flds)
+
+        evnts = []
+        for m in modes:
+            for i_fld in range(Nfld):
+                evnts.append(knl(self.queue, (WGS_tot, ), (WGS, ),
+                                 stack.data,
+                                 self.DataDev[flds[i_fld] + str(m)].data,
+                                 np.uint32(i_fld), np.uint32(m),
+                                 np.uint32(Nfld), np.uint32(self.Args['Nx']),
+                                 np.uint32(self.Args['NxNrm1']),
+                                 np.uint32(fld_offset)))
+
+        if len(evnts) == 0:
+            return
 
-        self.DataDev[arg_out+'0'][:] = self.DataDev[arg_in+'0'][1:].\
-                                        astype(np.complex128)
-        self._fft(self.DataDev[arg_out+'0'], self.DataDev[arg_out+'0'], dir)
-
-        # Phase shift of the result
-        phs_str = [arg_out+'0', 'NxNrm1', 'Nx']
-        phs_args = [self.DataDev[arg].data for arg in phs_str]
-        phs_args += [phs_shft.data, ]
-        self._multiply_by_phase_knl(self.queue, (WGS_tot, ), (WGS,),
-                                    *phs_args).wait()
-
-        # Same for m>0 modes
-        for m in range(1,self.Args['M']+1):
-            arg_in_m = arg_in + str(m)
-            arg_out_m = arg_out + str(m)
-
-            self.DataDev[arg_out_m][:] = self.DataDev[arg_in_m][1:]
-            self._fft(self.DataDev[arg_out_m], self.DataDev[arg_out_m], dir)
-
-            # Phase shift of the result
-            phs_str = [arg_out_m, 'NxNrm1', 'Nx']
-            phs_args = [self.DataDev[arg].data for arg in phs_str]
-            phs_args += [phs_shft.data, ]
-            self._multiply_by_phase_knl(self.queue, (WGS_tot, ), (WGS, ),
-                                        *phs_args).wait()
-
+        evnt = enqueue_barrier(self.queue, wait_for=evnts)
+        return self.complete(evnt)
+
+    def _multiply_by_phase(self, arr, phs_shft):
+        WGS, WGS_tot = self.get_wgs(arr.size)
+        evnt = self._multiply_by_phase_knl(self.queue, (WGS_tot, ), (WGS, ),
+                                           arr.data, np.uint32(arr.size),
+                                           np.uint32(self.Args['Nx']),
+                                           phs_shft.data)
+        return self.complete(evnt)
+
+    def _get_fld_stacks(self, Nfld):
+        """
+        Get the stacks for the group of Nfld fields, along with the
+        DHT and FFT methods compiled for them. Stacks are the views on
+        the buffers, which are reallocated if Nfld exceeds their capacity.
+        Stacks follow the fields precision (see fld_precision_types)
+        """
+        if Nfld in self._fld_stacks:
+            return self._fld_stacks[Nfld]
+
+        M = self.Args['M']
+        Nrm1 = self.Args['Nr'] - 1
+        Nx = self.Args['Nx']
+
+        if Nfld > self._fld_stacks_capacity:
+            Nfld_max = max(Nfld, 2*len(self.Args['vec_comps']))
+            self._fld_stacks_capacity = Nfld_max
+            self._fld_stacks = {}
+
+            buff_dtypes = {'d':self.fld_dtype, 'c':self.fld_cdtype}
+            buff_sizes = {'d':Nrm1*Nfld_max*Nx, 'c':(M+1)*Nrm1*Nfld_max*Nx}
+            for buff_i in range(2):
+                for buff_dtype in buff_dtypes.keys():
+                    arg_str = '_'.join(('fld', 'stack'+str(buff_i),
+                                        buff_dtype))
+                    self.DataDev[arg_str] = self.dev_arr(
+                        shape=buff_sizes[buff_dtype],
+                        dtype=buff_dtypes[buff_dtype])
+
+        stacks = {}
+        for buff_i in range(2):
+            arg_str = 'fld_stack' + str(buff_i)
+            stacks['d'+str(buff_i)] = self.DataDev[arg_str + '_d']\
+                [:Nrm1*Nfld*Nx].reshape(Nrm1, Nfld*Nx)
+            stacks['c'+str(buff_i)] = self.DataDev[arg_str + '_c']\
+                [:(M+1)*Nrm1*Nfld*Nx].reshape(M+1, Nrm1, Nfld, Nx)
+
+            # matrices of m>0 modes for the DHT
+            stacks['c'+str(buff_i)+'_dht'] = stacks['c'+str(buff_i)]\
+                .reshape(M+1, Nrm1, Nfld*Nx)[1:]
+
+        stacks['ddot'] = self._make_dot(self.DataDev['DHT_m0'],
+                                        stacks['d0'], stacks['d1'])
+        if M > 0:
+            stacks['cdot'] = self._make_dot(self.DataDev['DHT_mp'],
+                                            stacks['c0_dht'],
+                                            stacks['c1_dht'])
+        stacks['fft'] = [self._make_fft(stacks['c0'], dir)
+                         for dir in range(2)]
+
+        self._fld_stacks[Nfld] = stacks
+        return stacks
 
     def _prepare_dot(self):
         input_transform = self.dev_arr(dtype=np.double,
                                        shape=(self.Args['Nr']-1,
                                               self.Args['Nr']-1))
 
+        self._ddot = self._make_dot(input_transform,
+                                    self.DataDev['fld_buff0_d'],
+                                    self.DataDev['fld_buff1_d'])
+        self._cdot = self._make_dot(input_transform,
+                                    self.DataDev['fld_buff0_c'],
+                                    self.DataDev['fld_buff1_c'])
+
+    def _make_dot(self, a, b, c):
+        """
+        Get the matrix product c = a.b, which is called as dot(c, a, b).
+        Products are accumulated in the dtype of a and b, and cast to
+        the dtype of c if it is of lower precision
+        """
         if self.comm.dot_method=='Reikna':
-            self._ddot = MatrixMul(input_transform,
-                                   self.DataDev['fld_buff0_d'],
-                                   out_arr=self.DataDev['fld_buff1_d'] \
-                                  ).compile(self.thr, fast_math=True)
-
-            self._cdot = MatrixMul(input_transform,
-                                   self.DataDev['fld_buff0_c'],
-                                   out_arr=self.DataDev['fld_buff1_c'], \
-                                  ).compile(self.thr, fast_math=True)
+            dtype_acc = np.result_type(a.dtype, b.dtype)
+            if c.dtype == dtype_acc:
+                return MatrixMul(a, b, out_arr=c).compile(self.thr,
+                                                          fast_math=True)
+
+            # cast is fused into the output of the product
+            out_t = Type(dtype_acc, shape=c.shape)
+            dot = MatrixMul(a, b, out_arr=out_t)
+            cast_tr = self._make_cast_transformation(out_t, c)
+            dot.parameter.output.connect(cast_tr, cast_tr.input,
+                                         arr_out=cast_tr.output)
+            return dot.compile(self.thr, fast_math=True)
 
         elif self.comm.dot_method=='NumPy':
             def dot_wrp(c, a, b):
-                c_host = np.dot(a.get(), b.get())
-                c[:] = to_device(self.queue, c_host)
-
-            self._ddot = dot_wrp
-            self._cdot  = dot_wrp
+                c_host = np.matmul(a.get(), b.get())
+                c[:] = to_device(self.queue, c_host.astype(c.dtype))
+            return dot_wrp
+
+    def _make_fft(self, target_arr, dir):
+        """
+        Get the FFT along the last axis of arrays like target_arr,
+        which is called as fft(arr_out, arr_in, phs_shft). The phase
+        shift is applied to the output of forward FFT (dir=0) and to
+        the input of backward one (dir=1)
+        """
+        fft_axis = len(target_arr.shape) - 1
 
-    def _prepare_fft(self):
         if self.comm.fft_method=='pyFFTW':
             from pyfftw import empty_aligned, FFTW
 
-            target_shape = self.DataDev['fld_buff0_c'].shape
-
-            self.arr_fft_in = empty_aligned(target_shape,
-                                            dtype=np.complex128, n=16)
-            self.arr_fft_out = empty_aligned(target_shape,
-                                             dtype=np.complex128, n=16)
-            self._fft_knl = [FFTW(input_array=self.arr_fft_in,
-                              output_array=self.arr_fft_out,
-                              direction = 'FFTW_FORWARD', threads=4,
-                              axes=(1, )),
-                             FFTW(input_array=self.arr_fft_in,
-                              output_array=self.arr_fft_out,
-                              direction = 'FFTW_BACKWARD', threads=4,
-                              axes=(1, ))]
-            def _fft(arr_out, arr, dir):
-                self.arr_fft_in[:] = arr.get()
-                self._fft_knl[dir]()
-                arr_out[:] = to_device(self.queue, self.arr_fft_out)
+            target_shape = target_arr.shape
+
+            arr_fft_in = empty_aligned(target_shape,
+                                       dtype=target_arr.dtype, n=16)
+            arr_fft_out = empty_aligned(target_shape,
+                                        dtype=target_arr.dtype, n=16)
+
+            fft_dir = ['FFTW_FORWARD', 'FFTW_BACKWARD'][dir]
+            fft_knl = FFTW(input_array=arr_fft_in,
+                           output_array=arr_fft_out,
+                           direction = fft_dir, threads=4,
+                           axes=(fft_axis, ))
+
+            def _fft(arr_out, arr, phs_shft):
+                if dir == 1:
+                    self._multiply_by_phase(arr, phs_shft)
+                arr_fft_in[:] = arr.get()
+                fft_knl()
+                arr_out[:] = to_device(self.queue, arr_fft_out)
+                if dir == 0:
+                    self._multiply_by_phase(arr_out, phs_shft)
                 return arr_out
-            self._fft = _fft
+            return _fft
 
         elif self.comm.fft_method=='Reikna':
-            fft = FFT(self.DataDev['fld_buff0_c'], axes=(1,))
-            self._fft = fft.compile(self.thr)
+            fft = FFT(target_arr, axes=(fft_axis, ))
+            phase_tr = self._make_phase_transformation(target_arr,
+                self.DataDev['phs_shft_' + str(dir)])
+
+            # phase shift is fused into the output or input of FFT
+            if dir == 0:
+                fft.parameter.output.connect(phase_tr, phase_tr.input,
+                    arr_out=phase_tr.output, phs_shft=phase_tr.phs_shft)
+            elif dir == 1:
+                fft.parameter.input.connect(phase_tr, phase_tr.output,
+                    arr_in=phase_tr.input, phs_shft=phase_tr.phs_shft)
+
+            fft_knl = fft.compile(self.thr)
+
+            def _fft(arr_out, arr, phs_shft):
+                if dir == 0:
+                    fft_knl(arr_out=arr_out, input=arr,
+                            phs_shft=phs_shft, inverse=dir)
+                elif dir == 1:
+                    fft_knl(output=arr_out, arr_in=arr,
+                            phs_shft=phs_shft, inverse=dir)
+                return arr_out
+            return _fft
+
+    def _make_cast_transformation(self, in_t, arr):
+        """
+        Reikna transformation casting the array to the type of arr
+        (complex values are cast by their components)
+        """
+        out_t = Type.from_value(arr)
+        if np.iscomplexobj(arr):
+            store = "COMPLEX_CTR(${out_ctype})(val.x, val.y)"
+        else:
+            store = "(${out_ctype})val"
+
+        return Transformation(
+            [Parameter('output', Annotation(out_t, 'o')),
+             Parameter('input', Annotation(in_t, 'i'))],
+            """
+            ${input.ctype} val = ${input.load_same};
+            ${output.store_same}(""" + store + """);
+            """,
+            render_kwds=dict(out_ctype=out_t.ctype))
+
+    def _make_phase_transformation(self, arr, phs_shft):
+        """
+        Reikna transformation multiplying the array by the phase
+        along its last axis
+        """
+        arr_t = Type.from_value(arr)
+        phs_t = Type.from_value(phs_shft)
+        x_axis = len(arr.shape) - 1
+
+        return Transformation(
+            [Parameter('output', Annotation(arr_t, 'o')),
+             Parameter('input', Annotation(arr_t, 'i')),
+             Parameter('phs_shft', Annotation(phs_t, 'i'))],
+            """
+            ${output.store_same}(${mul}(${input.load_same},
+                                        ${phs_shft.load_idx}(${idxs[x_axis]})));
+            """,
+            render_kwds=dict(x_axis=x_axis,
+                             mul=functions.mul(arr_t.dtype, phs_t.dtype,
+                                               out_dtype=arr_t.dtype)))
@@ -14,8 +14,8 @@ class Particles(ParticleMethodsCL):
         self.set_global_working_group_size()
 
         self.DataDev = {}
-        self.init_particle_methods()
         self._process_configs(configs_in)
+        self.init_particle_methods()
 
         self.send_args_to_dev()
         self._init_data_on_dev()
@@ -28,6 +28,21 @@ class Particles(ParticleMethodsCL):
             self.index_sort(grid)
             self.flag_sorted = True
 
+    def push_and_sort_parts(self, grid, mode='half'):
+        if self.Args['Np'] == 0 or 'Immobile' in self.Args.keys():
+            self.sort_parts(grid)
+            return
+
+        if mode=='half':
+            which_dt = 'dt_2'
+        else:
+            which_dt = 'dt'
+
+        self.index_sort(grid, push_dt=which_dt)
+        self.flag_sorted = True
+        self.align_by_policy()
+        self.compact_by_policy()
+
     def add_particles(self, domain_in=None, beam_in=None, source=None):
         # To be removed
         if source is None:
@@ -50,12 +65,79 @@ class Particles(ParticleMethodsCL):
 
         self.align_and_damp(comps_align=comps_align)
 
+    def compact_parts(self):
+        if self.Args['Np'] == 0:
+            return
+        if 'Immobile' in self.Args.keys():
+            comps_compact = ['x', 'y', 'z','w']
+        else:
+            comps_compact = ['x', 'y', 'z', 'px', 'py', 'pz',
+                             'g_inv', 'w']
+
+        self.compact_and_damp(comps_compact=comps_compact)
+
     def _process_configs(self, configs_in):
         self.Args = configs_in
 
         self.Args['Np'] = 0
         self.Args['Np_stay'] = 0
 
+        # particles are stored in the buffers of Np_capacity size,
+        # which is multiplied by CapacityGrowth when exceeded
+        self.Args['Np_capacity'] = 0
+        if 'CapacityGrowth' not in self.Args:
+            self.Args['CapacityGrowth'] = 1.5
+
+        # sorting is updated only for the particles changed their cells,
+        # unless their fraction exceeds SortMoversMax
+        if 'SortIncremental' not in self.Args:
+            self.Args['SortIncremental'] = True
+        if 'SortMoversMax' not in self.Args:
+            self.Args['SortMoversMax'] = 0.25
+
+        # particles components are stored either as separate arrays
+        # ('SoA') or as the packed records ('AoS'). The packed layout
+        # is experimental: it is kept in double precision, and in the
+        # tests (examples/test_particle_layout.py) it is slower than
+        # SoA, so 'SoA' should be used unless AoS is measured faster
+        # on the given device
+        if 'Layout' not in self.Args:
+            self.Args['Layout'] = 'SoA'
+        if self.Args['Layout'] not in ['SoA', 'AoS']:
+            print("Layout {} is not known, 'SoA' is used".
+                  format(self.Args['Layout']))
+            self.Args['Layout'] = 'SoA'
+
+        # packed records are kept in double precision
+        if self.Args['Layout'] == 'AoS' and self.part_precision != 'double':
+            raise ValueError("Layout 'AoS' supports only the 'double' "
+                             "particles precision, and '{}' is given".
+                             format(self.part_precision))
+
+        # particles are aligned at the injection, and optionally
+        # every AlignEvery sorts or when the locality of the sorted
+        # particles in memory (sort_locality) exceeds AlignLocality.
+        # With AlignSingleBuffer the components are aligned one by one
+        # through a scratch array of one component, and copied back,
+        # instead of the ping-pong buffers of all components. It trades
+        # the speed (extra copy) for the memory, and it is not in place
+        if 'AlignEvery' not in self.Args:
+            self.Args['AlignEvery'] = 0
+        if 'AlignLocality' not in self.Args:
+            self.Args['AlignLocality'] = None
+        if 'AlignSingleBuffer' not in self.Args:
+            self.Args['AlignSingleBuffer'] = False
+        self.sorts_since_align = 0
+
+        # particles which left the grid are removed at the alignment,
+        # and optionally by the compaction every CompactEvery sorts or
+        # when their fraction exceeds CompactFraction
+        if 'CompactEvery' not in self.Args:
+            self.Args['CompactEvery'] = 0
+        if 'CompactFraction' not in self.Args:
+            self.Args['CompactFraction'] = None
+        self.sorts_since_compact = 0
+
         if 'dt' not in self.Args:
             self.Args['dt'] = 1.
 
@@ -92,11 +174,16 @@ class Particles(ParticleMethodsCL):
         self.Args['right_lim'] = 0.0
 
         self.flag_sorted = False
+        self.flag_sort_valid = False
 
         self.Args['w2pC'] = 4 * np.pi**2 * m_e * c**2 * epsilon_0 * 1e6 / e
 
         self.Args['dont_send'] = ['InjectorSource','charge','mass',
-                                  'dens','Immobile, w2pC']
+                                  'dens','Immobile, w2pC', 'Np_capacity',
+                                  'CapacityGrowth', 'SortIncremental',
+                                  'SortMoversMax', 'Layout', 'AlignEvery',
+                                  'AlignLocality', 'AlignSingleBuffer',
+                                  'CompactEvery', 'CompactFraction']
         self.Args['dont_keep'] = []
 
     def _init_data_on_dev(self):
@@ -105,8 +192,24 @@ class Particles(ParticleMethodsCL):
         else:
             args_strs =  ['x', 'y', 'z', 'px', 'py', 'pz', 'w','g_inv']
 
+        if self.Args['Layout'] == 'AoS':
+            self.DataDev['rec_buff'] = self.dev_arr(shape=0, dtype=np.double)
+            self.DataDev['rec_swap'] = None
+            self._set_record_views(0)
+            args_strs = []
+
         for arg in args_strs:
-            self.DataDev[arg] = self.dev_arr(shape=0,dtype=np.double)
+            if arg in ['x', 'y', 'z']:
+                dtype = np.double
+            else:
+                dtype = self.part_dtype
+
+            self.DataDev[arg + '_buff'] = self.dev_arr(shape=0, dtype=dtype)
+            self.DataDev[arg + '_swap'] = None
+            self.DataDev[arg] = self.DataDev[arg + '_buff'][:0]
+
+        self.DataDev['num_movers'] = self.dev_arr(val=0, dtype=np.uint32)
+        self.DataDev['num_jumps'] = self.dev_arr(val=0, dtype=np.uint32)
 
         for arg in ['cell_offset', 'indx_in_cell',
                     'sort_indx', 'sum_in_cell']:
@@ -1,10 +1,8 @@
 import numpy as np
 from time import time
-from pyopencl import enqueue_barrier
 
-loop_steps = ['frame', 'push-x', 'sort', 'depose',
-              'transform', 'smooth', 'data_copy',
-              'grad', 'push-eb', 'damp-eb', 'restore_B',
+loop_steps = ['frame', 'exchange', 'push-x + sort', 'depose',
+              'transform', 'smooth', 'push-eb', 'damp-eb', 'restore_B',
               'gather + push-p']
 
 def timer_plot(Timer):
@@ -36,6 +34,9 @@ class PIC_loop:
         self.frames = frames
         self.diags = diags
 
+        # subdomain of the decomposed simulation (see Decomposition)
+        self.decomp = self.mainsolver.Args.get('Decomposition')
+
         self.timit = timit
         self.it = 0
 
@@ -51,7 +52,8 @@ class PIC_loop:
 
     def timer_record(self, method_str):
         if self.timit is True:
-            enqueue_barrier(self.mainsolver.comm.queue)
+            # host needs to wait for the queue in the asynchronous mode
+            self.mainsolver.comm.queue.finish()
             self.Timer[method_str] += time() - self.t_start
 
     def step(self):
@@ -67,14 +69,15 @@ class PIC_loop:
 
         self.timer_record('frame')
 
-        for parts in self.species:
+        if self.decomp is not None:
             self.timer_start()
-            parts.push_coords(mode='half')
-            self.timer_record('push-x')
+            self.decomp.migrate_particles(self.species, self.mainsolver)
+            self.timer_record('exchange')
 
+        for parts in self.species:
             self.timer_start()
-            parts.sort_parts(grid=self.mainsolver)
-            self.timer_record('sort')
+            parts.push_and_sort_parts(grid=self.mainsolver, mode='half')
+            self.timer_record('push-x + sort')
 
         self.timer_start()
         for solver in self.solvers:
@@ -83,18 +86,19 @@ class PIC_loop:
 
         for parts in self.species:
             self.timer_start()
-            parts.push_coords(mode='half')
-            self.timer_record('push-x')
-
-            self.timer_start()
-            parts.sort_parts(grid=self.mainsolver)
-            self.timer_record('sort')
+            parts.push_and_sort_parts(grid=self.mainsolver, mode='half')
+            self.timer_record('push-x + sort')
 
         for solver in self.solvers:
             self.timer_start()
             solver.depose_charge(species=self.species)
             self.timer_record('depose')
 
+            if self.decomp is not None:
+                self.timer_start()
+                self.decomp.exchange_sources(solver)
+                self.timer_record('exchange')
+
             self.timer_start()
             solver.fb_transform(scals=['rho', ], vects=['J', ], dir=0)
             self.timer_record('transform')
@@ -104,19 +108,7 @@ class PIC_loop:
             self.timer_record('smooth')
 
             self.timer_start()
-            for m in range(0,solver.Args['M']+1):
-                for comp in solver.Args['vec_comps']:
-                    arg_str = comp +'_fb_m'+str(m)
-                    solver.DataDev['dN0'+arg_str][:] = \
-                        solver.DataDev['dN1'+arg_str]
-            self.timer_record('data_copy')
-
-            self.timer_start()
-            solver.field_grad('rho','dN1')
-            self.timer_record('grad')
-
-            self.timer_start()
-            solver.push_fields()
+            solver.push_fields(grad_scl='rho')
             self.timer_record('push-eb')
 
             self.timer_start()
@@ -131,6 +123,14 @@ class PIC_loop:
             solver.fb_transform(vects=['E', 'B'], dir=1)
             self.timer_record('transform')
 
+            # spectral sources and fields are kept for the diagnostics
+            # of the next iteration, and the real space E and B are
+            # modified by the gather
+            solver.mark_fields(['rho', ] + [fld + comp
+                               for fld in ['J', 'E', 'B']
+                               for comp in solver.Args['vec_comps']],
+                               'fb', self.it+1, species=self.species)
+
             self.timer_start()
             solver.gather_and_push(species=self.species)
             self.timer_record('gather + push-p')
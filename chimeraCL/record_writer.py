@@ -0,0 +1,107 @@
+"""
+    Records writer for the diagnostics of ChimeraCL (used by
+    Diagnostics, ReducedDiagnostics and Checkpoint).
+
+    The device data of a record is copied into the pinned buffers of
+    a slot without blocking, and the record is written by the owner
+    function write_record(record) after the copies are complete. In
+    the asynchronous mode the records are written by the background
+    thread while the simulation continues, and up to MaxPending
+    records may wait for it (then the next record waits for a free
+    slot). The slot is released also when the write fails, and the
+    error is raised by the next new_record or finish.
+
+    Example:
+      writer = RecordWriter(write_record, asynchronous=True)
+
+      record = writer.new_record(it)
+      record['data'] = writer.stage(record, solver, 'Ex_m0',
+                                    solver.DataDev['Ex_m0'])
+      writer.submit(record)
+"""
+
+from threading import Thread
+from queue import Queue
+from pyopencl import wait_for_events
+
+class RecordWriter:
+    def __init__(self, write_record, asynchronous=False, max_pending=2):
+        self._write_record = write_record
+        self.asynchronous = asynchronous
+
+        self._slots = Queue()
+        for i_slot in range(max_pending):
+            self._slots.put({})
+
+        # error of the background writer
+        self._error = None
+
+        if self.asynchronous:
+            self._records = Queue()
+            self._writer = Thread(target=self._run_writer, daemon=True)
+            self._writer.start()
+
+    def new_record(self, it):
+        """
+        Get the new record of the iteration it with a free slot
+        """
+        self.raise_error()
+        return {'iteration': it, 'slot': self._slots.get(), 'events': []}
+
+    def stage(self, record, owner, name, arr):
+        """
+        Enqueue the copy of the device array into the pinned buffer
+        of the record slot, and get its view. The buffers are reused
+        by the next records, and grow when needed
+        """
+        slot = record['slot']
+        if name not in slot or slot[name].size < arr.size \
+          or slot[name].dtype != arr.dtype:
+            size = int(1.25 * arr.size) if name in slot else arr.size
+            slot[name] = owner.host_arr(shape=(size, ), dtype=arr.dtype)
+
+        record['events'].append(owner.get_async(arr, slot[name]))
+        return slot[name][:arr.size].reshape(arr.shape)
+
+    def submit(self, record):
+        """
+        Write the record, or pass it to the background thread
+        """
+        if self.asynchronous:
+            self._records.put(record)
+        else:
+            self._write(record)
+
+    def finish(self):
+        """
+        Wait until all records are written
+        """
+        if self.asynchronous:
+            self._records.join()
+        self.raise_error()
+
+    def raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _run_writer(self):
+        # the writer keeps running after an error, which is
+        # kept to be raised in the main thread
+        while True:
+            record = self._records.get()
+            try:
+                self._write(record)
+            except Exception as error:
+                self._error = error
+            finally:
+                self._records.task_done()
+
+    def _write(self, record):
+        # host waits for the copies of this record only
+        try:
+            if len(record['events']) > 0:
+                wait_for_events(record['events'])
+            self._write_record(record)
+        finally:
+            self._slots.put(record['slot'])
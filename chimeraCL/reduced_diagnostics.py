@@ -0,0 +1,346 @@
+"""
+    Reduced diagnostics module for ChimeraCL.
+    Computes the integrated quantities on the device and appends
+    them as the rows of the time series in one hdf5 file
+    ("reduced.h5"), where each quantity is a dataset with the record
+    index along the first axis. The reductions of a record are
+    collected in one device array, which is copied to the host by a
+    single non-blocking transfer:
+      - "/iteration" and "/time";
+      - "/fields/energy" is the energy of the electromagnetic field
+        in each azimuthal mode (shape (Nrecords, M+1)), which is
+        summed over the spectral fields;
+      - "/laser/centroid" and "/laser/energy" are the centroid and
+        energy of the fields LaserFields (e.g. ['Ey', 'Ez']);
+      - "/species/species_ID/" contains the charge, weighted means
+        and rms of the coordinates, momenta and gamma, normalized
+        emittances in y and z, and the histograms "hist_<comp>" with
+        the bins edges in their attribute "edges".
+
+    Species['Selections'] follow the format of Diagnostics, and
+    Species['Histograms'] are given as [comp, vmin, vmax, Nbins],
+    where comp is a particle component or 'gamma'. As in Diagnostics,
+    with Asynchronous=True the records are written in the background.
+
+    NB: Energy is in the units of epsilon_0*(m_e*c*omega/e)**2/k**3,
+        where k and omega are defined by the space normalisation;
+        charge is in pC/lambda[um] (as the weights of Diagnostics).
+"""
+
+import numpy as np
+import h5py
+import os
+import atexit
+from functools import partial
+from scipy.special import jn_zeros, jn
+
+from .record_writer import RecordWriter
+
+class ReducedDiagnostics:
+    def __init__(self, configs_in, solver, species=[],
+                 path='diags_reduced'):
+
+        self.Args = configs_in
+        self.solver = solver
+        self.species = species
+
+        self.path = os.getcwd() + '/' + path + '/'
+        self.fname = self.path + 'reduced.h5'
+
+        self._process_configs()
+
+        if os.path.exists(self.path) == False:
+            os.makedirs(self.path)
+        elif self.Args['Append'] == False and os.path.exists(self.fname):
+            os.remove(self.fname)
+
+        # rows of the records are kept on the host by the writer,
+        # and written to the file by Flush rows
+        self._rows = []
+        self._first_write = True
+        self._writer = RecordWriter(self._write_record,
+                                    asynchronous=self.Args['Asynchronous'],
+                                    max_pending=self.Args['MaxPending'])
+        atexit.register(self.finish)
+
+        # volumes of the nodes (nodes below the axis are not counted)
+        Rgrid = self.solver.Args['Rgrid']
+        self._dV = self.solver.dev_arr(
+            2*np.pi * self.solver.Args['dx'] * self.solver.Args['dr']
+            * Rgrid * (Rgrid > 0))
+        self._prof = self.solver.dev_arr(dtype=np.double,
+                                         shape=self.solver.Args['Nx'])
+
+        # Parseval weights of the spectral fields (see Transformer):
+        # the Bessel modes J_m(kr*r) are orthogonal on [0, R] with the
+        # norms R**2/2*J_{m+1}(kr*R)**2, and the backward FFT has the
+        # factor 1/Nx
+        Nx, Nr = self.solver.Args['Nx'], self.solver.Args['Nr']
+        R = Rgrid[-1] + 0.5*self.solver.Args['dr']
+        self._weights_fb, self._prof_fb = [], []
+        for m in range(self.solver.Args['M']+1):
+            kr_R = jn_zeros(m, Nr-1)
+            self._weights_fb.append(self.solver.dev_arr(
+                np.pi * R**2 * jn(m+1, kr_R)**2 * self.solver.Args['dx']
+                / Nx))
+            self._prof_fb.append(self.solver.dev_arr(dtype=np.double,
+                                                     shape=(Nx, 1)))
+
+        # device array collecting the reductions of a record
+        self._batch = None
+
+    def _process_configs(self):
+        if 'FieldEnergy' not in self.Args:
+            self.Args['FieldEnergy'] = True
+
+        if 'LaserFields' not in self.Args:
+            self.Args['LaserFields'] = ['Ey', 'Ez']
+
+        if 'Species' not in self.Args:
+            self.Args['Species'] = {}
+
+        if 'Selections' not in self.Args['Species']:
+            self.Args['Species']['Selections'] = []
+
+        if 'Histograms' not in self.Args['Species']:
+            self.Args['Species']['Histograms'] = []
+
+        if 'Flush' not in self.Args:
+            self.Args['Flush'] = 10
+
+        if 'Append' not in self.Args:
+            self.Args['Append'] = False
+
+        if 'Asynchronous' not in self.Args:
+            self.Args['Asynchronous'] = False
+
+        if 'MaxPending' not in self.Args:
+            self.Args['MaxPending'] = 2
+
+    def make_record(self, it):
+        self._writer.raise_error()
+        if np.mod(it, self.Args['Interval']) != 0:
+            return
+
+        self.record = self._writer.new_record(it)
+        self.record['row'] = {'iteration': it,
+                              'time': it*self.solver.Args['dt']}
+
+        # reductions are collected as the device arrays, and the
+        # rows are filled by the writers from their host copies
+        self.record['vals'] = []
+        self.record['writers'] = []
+
+        if self.Args['FieldEnergy']:
+            self.add_field_energy()
+
+        if len(self.Args['LaserFields']) > 0:
+            self.solver.update_fields(self.Args['LaserFields'], it)
+            self.add_laser()
+
+        for species_index in np.arange(len(self.species)):
+            self.add_species(species_index)
+
+        self._stage_vals()
+        self._writer.submit(self.record)
+
+    def finish(self):
+        """
+        Wait for the writer, and write the records kept on the host
+        """
+        self._writer.finish()
+        self.flush()
+
+    def add_field_energy(self):
+        # spectral fields E and B are current at each iteration
+        for m in range(self.solver.Args['M']+1):
+            self.solver.set_to(self._prof_fb[m], 0)
+
+            factor = 0.5 if m == 0 else 0.25
+            for fld in ['E', 'B']:
+                for comp in self.solver.Args['vec_comps']:
+                    self.solver.sum_sq_cols(
+                        self.solver.DataDev[fld + comp + '_fb_m' + str(m)],
+                        self._weights_fb[m], self._prof_fb[m],
+                        factor=factor)
+
+            energy = self.solver.dev_arr(dtype=np.double, shape=1)
+            self.solver.sum_rows(self._prof_fb[m], energy)
+            self._add_vals('fields/energy_m' + str(m), energy)
+
+        self.record['writers'].append(self._write_field_energy)
+
+    def add_laser(self):
+        for m in range(self.solver.Args['M']+1):
+            self._fields_profile(self.Args['LaserFields'], m, add=(m>0))
+
+        # grid may be moved before the record is written
+        self._add_vals('laser/profile', self._prof)
+        self.record['writers'].append(partial(self._write_laser,
+            np.copy(self.solver.Args['Xgrid'])))
+
+    def add_species(self, species_index):
+        part = self.species[species_index]
+        h5_path = 'species/species_' + str(species_index) + '/'
+        selections = self.Args['Species']['Selections']
+
+        if 'Immobile' in part.Args.keys():
+            comps = ['x', 'y', 'z']
+        else:
+            comps = ['x', 'y', 'z', 'px', 'py', 'pz', 'gamma']
+
+        # number, weight, and weighted sums of the components, their
+        # squares and the products for the emittances
+        moments = [(), ('w', )] + [('w', comp) for comp in comps] \
+                  + [('w', comp, comp) for comp in comps]
+        if 'px' in comps:
+            moments += [('w', 'y', 'py'), ('w', 'z', 'pz')]
+
+        self._add_vals(h5_path + 'moments',
+                       part.select_moments(selections, moments))
+
+        for comp, vmin, vmax, Nbins in self.Args['Species']['Histograms']:
+            if comp in comps:
+                self._add_vals(h5_path + 'hist_' + comp,
+                    part.select_histogram(selections, comp, vmin, vmax,
+                                          Nbins))
+
+        self.record['writers'].append(partial(self._write_species,
+            h5_path, comps, moments, part.Args['w2pC']))
+
+    def _add_vals(self, name, arr):
+        self.record['vals'].append((name, arr))
+
+    def _stage_vals(self):
+        # reductions are copied into one device array, which is
+        # copied to the host without blocking
+        size = sum(arr.size for name, arr in self.record['vals'])
+        if self._batch is None or self._batch.size != size:
+            self._batch = self.solver.dev_arr(dtype=np.double,
+                                              shape=max(size, 1))
+
+        offsets, offset = {}, 0
+        for name, arr in self.record['vals']:
+            self.solver.copy_to(arr, self._batch, offset)
+            offsets[name] = (offset, arr.size)
+            offset += arr.size
+
+        batch_host = self._writer.stage(self.record, self.solver, 'batch',
+                                        self._batch)
+        self.record['vals'] = {name: batch_host[offset:offset+size]
+                               for name, (offset, size) in offsets.items()}
+
+    def _write_record(self, record):
+        # called by the writer when the copies of the record are complete
+        for writer in record['writers']:
+            writer(record['vals'], record['row'])
+
+        self._rows.append(record['row'])
+        if len(self._rows) >= self.Args['Flush']:
+            self.flush()
+
+    def _write_field_energy(self, vals, row):
+        row['fields/energy'] = np.array(
+            [vals['fields/energy_m' + str(m)][0]
+             for m in range(self.solver.Args['M']+1)])
+
+    def _write_laser(self, Xgrid, vals, row):
+        # profile is small, and it is summed on the host
+        prof = vals['laser/profile']
+        energy = 0.5 * prof.sum()
+        if energy > 0:
+            centroid = (prof * Xgrid).sum() / prof.sum()
+        else:
+            centroid = 0.
+
+        row['laser/energy'] = energy
+        row['laser/centroid'] = centroid
+
+    def _write_species(self, h5_path, comps, moments, w2pC, vals, row):
+        sums = dict(zip(moments, vals[h5_path + 'moments']))
+        w_tot = sums[('w', )]
+
+        row[h5_path + 'Np'] = int(round(sums[()]))
+        row[h5_path + 'charge'] = w_tot * w2pC
+
+        for comp in ['x', 'y', 'z', 'px', 'py', 'pz', 'gamma']:
+            mean, rms = 0., 0.
+            if comp in comps and w_tot != 0:
+                mean = sums[('w', comp)] / w_tot
+                rms = sums[('w', comp, comp)] / w_tot
+                rms = np.sqrt(max(rms - mean**2, 0.))
+            row[h5_path + 'mean_' + comp] = mean
+            row[h5_path + 'rms_' + comp] = rms
+
+        for comp in ['y', 'z']:
+            emitt = 0.
+            if 'p' + comp in comps and w_tot != 0:
+                rms = row[h5_path + 'rms_' + comp]
+                rms_p = row[h5_path + 'rms_p' + comp]
+                corr = sums[('w', comp, 'p' + comp)] / w_tot \
+                       - row[h5_path + 'mean_' + comp] \
+                       * row[h5_path + 'mean_p' + comp]
+                emitt = np.sqrt(max((rms*rms_p)**2 - corr**2, 0.))
+            row[h5_path + 'emittance_' + comp] = emitt
+
+        for comp, vmin, vmax, Nbins in self.Args['Species']['Histograms']:
+            key = h5_path + 'hist_' + comp
+            if key in vals:
+                row[key] = vals[key] * w2pC
+            else:
+                row[key] = np.zeros(Nbins)
+
+    def _fields_profile(self, flds, m, add=False):
+        # longitudinal profile of the squared fields of the mode m
+        # integrated over the volume (m>0 modes are averaged over
+        # the angle with the factor 1/2)
+        if add == False:
+            self.solver.set_to(self._prof, 0)
+
+        factor = 1. if m == 0 else 0.5
+        for fld in flds:
+            self.solver.sum_sq_cols(self.solver.DataDev[fld+'_m'+str(m)],
+                                    self._dV, self._prof, factor=factor)
+
+    def flush(self):
+        """
+        Append the kept records to the file. On the first write in the
+        Append mode, all datasets are truncated to the rows before the
+        iteration of the first record (e.g. on the restart)
+        """
+        if len(self._rows) == 0:
+            return
+
+        keys = list(self._rows[0].keys())
+        with h5py.File(self.fname, 'a') as h5_file:
+            if self._first_write and 'iteration' in h5_file:
+                iterations = h5_file['iteration'][()]
+                Nkeep = int((iterations < self._rows[0]['iteration']).sum())
+
+                # including the quantities, which are not recorded now
+                def truncate(name, item):
+                    if isinstance(item, h5py.Dataset):
+                        item.resize(Nkeep, axis=0)
+                h5_file.visititems(truncate)
+
+            for key in keys:
+                vals = np.array([row[key] for row in self._rows])
+                if key not in h5_file:
+                    h5_file.create_dataset(key,
+                        shape=(0, ) + vals.shape[1:], dtype=vals.dtype,
+                        maxshape=(None, ) + vals.shape[1:], chunks=True)
+
+                dset = h5_file[key]
+                N0 = dset.shape[0]
+                dset.resize(N0 + vals.shape[0], axis=0)
+                dset[N0:] = vals
+
+            for comp, vmin, vmax, Nbins in \
+              self.Args['Species']['Histograms']:
+                for key in keys:
+                    if key.endswith('/hist_' + comp):
+                        h5_file[key].attrs['edges'] = \
+                            np.linspace(vmin, vmax, Nbins+1)
+
+        self._first_write = False
+        self._rows = []
@@ -22,21 +22,156 @@ class Solver(Grid, Transformer, SolverMethodsCL):
         self.DataDev = {}
         self._init_grid_data_on_dev()
         self.init_transformer()
+        self._init_solver_data_on_dev()
 
         self._make_ms_coefficients()
         self.send_args_to_dev()
 
-    def push_fields(self):
-        self.advance_fields(vecs=['E', 'G', 'J', 'dN0', 'dN1'])
+        # fields which data is current in the spectral ('fb') and
+        # real space for the iteration 'it', and the species deposited
+        # into the sources (see mark_fields)
+        self.fields_state = {'it': None, 'fb': [], 'real': [],
+                             'species': []}
+
+    def push_fields(self, grad_scl=None):
+        """
+        Advance the fields by one step. If the scalar `grad_scl` is
+        given, its gradient is computed into dN1 by the same kernel,
+        and the previous one is kept in dN0 by swapping the buffers
+        """
+        if grad_scl is None:
+            self.advance_fields(vecs=['E', 'G', 'J', 'dN0', 'dN1'])
+        else:
+            self.swap_fields('dN0', 'dN1')
+            self.advance_fields_grad(grad_scl,
+                                     vecs=['E', 'G', 'J', 'dN0', 'dN1'])
+
+    def mark_fields(self, flds, space, it, species=None):
+        """
+        Record that the data of the fields (e.g. 'rho', 'Ex') in the
+        space 'fb' or 'real' is current for the iteration it, and the
+        sources are deposited from the given species. Records of the
+        other iterations are dropped
+        """
+        if self.fields_state['it'] != it:
+            self.fields_state = {'it': it, 'fb': [], 'real': [],
+                                 'species': []}
+
+        if species is not None:
+            # other sources are not current anymore
+            if list(species) != self.fields_state['species']:
+                for space_srcs in ('fb', 'real'):
+                    self.fields_state[space_srcs] = \
+                        [fld for fld in self.fields_state[space_srcs]
+                         if fld!='rho' and fld[0]!='J']
+            self.fields_state['species'] = list(species)
+
+        for fld in flds:
+            if fld not in self.fields_state[space]:
+                self.fields_state[space].append(fld)
+
+    def update_fields(self, flds, it, species=[]):
+        """
+        Make the real space data of the fields current for the
+        iteration it. Only the sources, which are not current in the
+        spectral space for these species, are deposited, and the
+        missing fields are transformed together
+        """
+        if self.fields_state['it'] != it:
+            self.mark_fields([], 'fb', it)
+
+        flds_real = [fld for fld in flds
+                     if not self._is_current(fld, 'real', species)]
+        flds_src = [fld for fld in flds_real
+                    if (fld=='rho' or fld[0]=='J')
+                    and not self._is_current(fld, 'fb', species)]
+
+        if len(flds_src) > 0:
+            # all components of J are deposited together
+            scals, vects = [], []
+            if 'rho' in flds_src:
+                self.depose_charge(species)
+                scals.append('rho')
+            if len(flds_src) > len(scals):
+                self.depose_currents(species)
+                vects.append('J')
+
+            decomp = self.Args.get('Decomposition')
+            if decomp is not None:
+                decomp.exchange_sources(self, flds=scals+vects)
+
+            flds_fb = scals + ['J' + comp for comp in self.Args['vec_comps']
+                               if 'J' in vects]
+            self.fb_transform(scals=flds_fb, dir=0)
+            self.fields_smooth(flds=flds_fb)
+            self.mark_fields(flds_fb, 'fb', it, species=species)
+
+        if len(flds_real) > 0:
+            self.fb_transform(scals=flds_real, dir=1)
+            self.mark_fields(flds_real, 'real', it)
+
+    def _is_current(self, fld, space, species):
+        # sources of the other species are not current
+        if (fld=='rho' or fld[0]=='J') and \
+          list(species) != self.fields_state['species']:
+            return False
+        return fld in self.fields_state[space]
+
+    def get_state(self):
+        """
+        Get the device arrays and the host values which define the
+        state of the solver (used by Checkpoint): the spectral fields
+        with the gradients history, the sources kept for the
+        diagnostics, and the grid position of the moving frame
+        """
+        flds = ['rho', ] + [fld + comp
+                            for fld in ['E', 'G', 'B', 'J', 'dN0', 'dN1']
+                            for comp in self.Args['vec_comps']]
+
+        state_dev = {}
+        for fld in flds:
+            for m in range(self.Args['M']+1):
+                fld_arg = fld + '_fb_m' + str(m)
+                state_dev[fld_arg] = self.DataDev[fld_arg]
+
+        state_host = {}
+        for arg in ['Xmin', 'Xmax', 'Xgrid']:
+            state_dev['dev_' + arg] = self.DataDev[arg]
+            state_host[arg] = np.copy(self.Args[arg])
+
+        return state_dev, state_host
+
+    def set_state(self, state):
+        """
+        Set the state of the solver from the host data of get_state
+        """
+        for key in state.keys():
+            if key[:4] == 'dev_':
+                self.set_from_host(self.DataDev[key[4:]], state[key])
+            elif '_fb_m' in key:
+                self.set_from_host(self.DataDev[key], state[key])
+
+        for arg in ['Xmin', 'Xmax']:
+            self.Args[arg] = float(state[arg])
+        self.Args['Xgrid'] = np.copy(state['Xgrid'])
+
+    def swap_fields(self, fld0, fld1):
+        # only the references are swapped, and the kernels get
+        # the buffers from DataDev at each launch
+        for m in range(self.Args['M']+1):
+            for comp in self.Args['vec_comps']:
+                arg0 = fld0 + comp + '_fb_m' + str(m)
+                arg1 = fld1 + comp + '_fb_m' + str(m)
+                self.DataDev[arg0], self.DataDev[arg1] = \
+                    self.DataDev[arg1], self.DataDev[arg0]
 
     def damp_fields(self):
-        self.fb_transform(vects=['E', 'G'], dir=1, mode='half')
-        self.profile_edges(['E', 'G'])
-        self.fb_transform(vects=['E', 'G'], dir=0, mode='half')
+        flds = [fld + comp for fld in ['E', 'G']
+                for comp in self.Args['vec_comps']]
+        self.profile_edges_fb(flds)
 
     def restore_B_fb(self):
-        self.field_rot('G', 'B')
-        self.field_poiss_vec('B')
+        self.field_rot_poiss('G', 'B')
 
     def _make_ms_coefficients(self):
         for m in range(self.Args['M']+1):
@@ -17,13 +17,14 @@ class Transformer(TransformerMethodsCL):
     def fb_transform(self, scals=[], vects=[], dir=0, mode='full'):
         """
         Warper for the Fourier-Bessel transforms of the groups
-        of vectors and scalars
+        of vectors and scalars, which are transformed together
         """
-        for sclr in scals:
-            self.transform_field(sclr, dir=dir, mode=mode)
+        flds = list(scals)
         for vect in vects:
             for comp in self.Args['vec_comps']:
-                self.transform_field(vect+comp, dir=dir, mode=mode)
+                flds.append(vect+comp)
+
+        self.transform_fields(flds, dir=dir, mode=mode)
 
     def _make_spectral_axes(self):
         """
@@ -96,6 +97,14 @@ class Transformer(TransformerMethodsCL):
             self.Args['dont_keep'].append('dDHT_plus_m'+str(m))
             self.Args['dont_keep'].append('dDHT_minus_m'+str(m))
 
+        # stack the m>0 modes transforms for the batched DHT
+        if self.Args['M'] > 0:
+            for dht_arg in ['DHT_mp', 'DHT_inv_mp']:
+                self.Args[dht_arg] = np.array([
+                    self.Args[dht_arg[:-1] + str(m)]
+                    for m in range(1, self.Args['M']+1)])
+                self.Args['dont_keep'].append(dht_arg)
+
 
     def _init_transformer_data_on_dev(self):
         # list the names of all scalar and vector fields components
@@ -118,9 +127,11 @@ class Transformer(TransformerMethodsCL):
             self.DataDev['buff_fb_m-1_' + comp] = self.dev_arr(val=0,
                 dtype=np.complex128, shape=(self.Args['Nr']-1, self.Args['Nx']))
 
-        # allocate the buffer to keep phase shift data exp(i*kx*x0)
-        self.DataDev['phs_shft'] = self.dev_arr(dtype=np.complex128,val=0,
-                                                shape=self.Args['Nx'])
+        # allocate the buffers to keep phase shift data exp(-/+i*kx*x0)
+        # for the forward and backward transforms
+        for dir in range(2):
+            self.DataDev['phs_shft_' + str(dir)] = self.dev_arr(
+                dtype=np.complex128, val=0, shape=self.Args['Nx'])
 
         # allocate the auxilary field buffers
         buff_dtypes = {'d':np.double, 'c':np.complex128}
@@ -16,6 +16,8 @@ from chimeraCL.solver import Solver
 from chimeraCL.frame import Frame
 from chimeraCL.laser import add_gausian_pulse
 from chimeraCL.diagnostics import Diagnostics
+from chimeraCL.reduced_diagnostics import ReducedDiagnostics
+from chimeraCL.checkpoint import Checkpoint
 from chimeraCL.pic_loop import PIC_loop
 
 ########################################
@@ -26,12 +28,25 @@ from chimeraCL.pic_loop import PIC_loop
 # Simulation steps
 Nsteps = 20000
 
+# Checkpoints (the run is continued from the last one with the
+# argument 'restart')
+restart = 'restart' in sys.argv
+checkpoint_in = {'Interval': 2000}
+
 # Diagnostics
 diag_in = {'Interval': 1000,
+           'Append': restart,
+           'Asynchronous': True,
+           'Compression': 'gzip',
            'ScalarFields': ['rho', 'Ex', 'Ez'],
            'Species':{'Components': ['x', 'y', 'z', 'w', 'px'],
                        'Selections': [['px', 5, None], ]} }
 
+diag_reduced_in = {'Interval': 50,
+                   'Append': restart,
+                   'Species':{'Selections': [['px', 5, None], ],
+                              'Histograms': [['gamma', 1, 400, 200], ]} }
+
 # Grid
 xmin, xmax = -100., 40.
 rmin, rmax = 0., 50.
@@ -102,8 +117,16 @@ frame = Frame(frame_in)
 diag = Diagnostics(solver=solver, species=[eons, ],
                    frame=frame, configs_in = diag_in)
 
+diag_reduced = ReducedDiagnostics(diag_reduced_in, solver, species=[eons, ])
+
+checkpoint = Checkpoint(checkpoint_in, solvers=[solver, ],
+                        species=[eons, ions])
+
 loop = PIC_loop(solvers=[solver, ], species=[eons, ions],
-                frames=[frame, ], diags = [diag, ])
+                frames=[frame, ], diags = [checkpoint, diag, diag_reduced])
+
+if restart:
+    checkpoint.restore(loop)
 
 ############################################
 ############ RUN THE SIMULATION ############
@@ -116,6 +139,9 @@ while loop.it<Nsteps+1:
         sys.stdout.write("\rstep {:d} of {:d}".format(loop.it, Nsteps))
         sys.stdout.flush()
 
+diag.finish()
+diag_reduced.finish()
+checkpoint.finish()
 comm.queue.finish()
 t0 = time() - t0
 print("\nTotal time is {:g} mins \nMean step time is {:g} ms ".\
@@ -0,0 +1,106 @@
+import numpy as np
+import os
+import sys
+import shutil
+from copy import deepcopy
+
+from chimeraCL.methods.generic_methods_cl import Communicator
+from chimeraCL.particles import Particles
+from chimeraCL.solver import Solver
+from chimeraCL.frame import Frame
+from chimeraCL.laser import add_gausian_pulse
+from chimeraCL.pic_loop import PIC_loop
+from chimeraCL.checkpoint import Checkpoint
+
+
+def run_test(Nsteps=60, Interval=20, answers=[], verb=False):
+    """
+    Run the simulation with the checkpoints, restart it from the
+    first one with the new objects, and compare the final states,
+    which should be identical. The first run keeps 2 checkpoints,
+    and the restarted one (Keep=0) only the last one
+    """
+    comm = Communicator(answers=answers)
+
+    loop, checkpoint, objs = make_simulation(comm, Interval, Keep=2)
+    while loop.it < Nsteps:
+        loop.step()
+    checkpoint.finish()
+    state_full = get_states(objs)
+    its_full = checkpoint.list_iterations()
+
+    loop, checkpoint, objs = make_simulation(comm, Interval, Keep=0)
+    it_restart = checkpoint.restore(loop, it=its_full[0])
+    while loop.it < Nsteps:
+        loop.step()
+    checkpoint.finish()
+    state_restart = get_states(objs)
+    its_restart = checkpoint.list_iterations()
+
+    shutil.rmtree(checkpoint.path)
+
+    differ = [key for key in state_full.keys()
+              if not np.array_equal(state_full[key], state_restart[key])]
+
+    if verb:
+        print("Checkpoints {} are kept, and {} after the restart from {}".
+              format(its_full, its_restart, it_restart))
+        print("States differ in {} of {} arrays".format(len(differ),
+                                                        len(state_full)))
+    return differ, its_full, its_restart
+
+
+def make_simulation(comm, Interval, Keep):
+    grid_in = {'Xmin': -20., 'Xmax': 20., 'Nx': 200,
+               'Rmin': 0., 'Rmax': 16., 'Nr': 40, 'M': 1,
+               'DampCells': 20, 'dt': 0.2}
+    solver = Solver(grid_in, comm)
+    add_gausian_pulse(solver, laser={'k0': 1., 'a0': 3., 'x0': 0.,
+                                     'Lx': 5., 'R': 6., 'x_foc': 30.})
+
+    eons_in = {'Nppc': (2, 2, 4), 'dx': solver.Args['dx'],
+               'dr': solver.Args['dr'], 'dt': solver.Args['dt'],
+               'dens': 0.01, 'charge': -1}
+    ions_in = deepcopy(eons_in)
+    ions_in['charge'] = 1
+    ions_in['Immobile'] = True
+
+    eons = Particles(eons_in, comm)
+    ions = Particles(ions_in, comm)
+    ions.Args['InjectorSource'] = eons
+
+    frame = Frame({'Velocity': 1., 'dt': solver.Args['dt'], 'Steps': 20,
+                   'DensityProfiles': [{'coord': 'x',
+                                        'points': [-100, 20.1, 40, 5e5],
+                                        'values': [0, 0, 1, 1]}]})
+
+    checkpoint = Checkpoint({'Interval': Interval, 'Keep': Keep},
+                            solvers=[solver, ], species=[eons, ions],
+                            path='checkpoints_test')
+    loop = PIC_loop(solvers=[solver, ], species=[eons, ions],
+                    frames=[frame, ], diags=[checkpoint, ])
+    return loop, checkpoint, [solver, eons, ions]
+
+
+def get_states(objs):
+    # device and host states of the solvers and species
+    states = {}
+    for i_obj, obj in enumerate(objs):
+        state_dev, state_host = obj.get_state()
+        for key, arr in state_dev.items():
+            states[str(i_obj) + '/' + key] = arr.get() if arr.size \
+                                             else np.array([])
+        for key, val in state_host.items():
+            states[str(i_obj) + '/' + key] = np.array(val)
+    return states
+
+
+if __name__ == "__main__":
+    from numpy import array,int32
+    conv_to_list = lambda str_var: list(array( str_var.split(':')).\
+                                          astype(int32))
+
+    if len(sys.argv)>1:
+        run_test(answers=conv_to_list(sys.argv[-1]),verb=True)
+    else:
+        run_test(verb=True)
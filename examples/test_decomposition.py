@@ -0,0 +1,118 @@
+import numpy as np
+import sys
+from copy import deepcopy
+
+from chimeraCL.methods.generic_methods_cl import Communicator
+from chimeraCL.particles import Particles
+from chimeraCL.solver import Solver
+from chimeraCL.frame import Frame
+from chimeraCL.laser import add_gausian_pulse
+from chimeraCL.pic_loop import PIC_loop
+from chimeraCL.decomposition import Decomposition
+
+
+grid_in = {'Xmin': -20., 'Xmax': 20., 'Nx': 200,
+           'Rmin': 0., 'Rmax': 16., 'Nr': 40, 'M': 1,
+           'DampCells': 20, 'dt': 0.2}
+
+# laser is set on the local grids, so it is placed
+# inside the last subdomain
+laser = {'k0': 1., 'a0': 0.3, 'x0': 12., 'Lx': 1.5, 'R': 6., 'x_foc': 0.}
+
+
+def run_test(Nsub=2, Guards=32, Nsteps=150, Transport='threads',
+             answers=[], verb=False):
+    """
+    Compare the decomposed run with the run in one domain. With the
+    Transport 'MPI' the subdomains are the processes, e.g.
+      mpirun -np 2 python test_decomposition.py MPI
+    and the results are compared by the rank 0
+    """
+    decomp = Decomposition({'Nsub': Nsub, 'Guards': Guards,
+                            'Transport': Transport})
+    Nsub = decomp.Args['Nsub']
+
+    results = {}
+    decomp.run(lambda rank: run_domain(rank, decomp, Nsteps,
+                                       answers, results))
+
+    if Transport == 'MPI':
+        results_ranks = decomp.comm_mpi.gather(results, root=0)
+        if decomp.comm_mpi.rank > 0:
+            return None
+        for results_rank in results_ranks:
+            results.update(results_rank)
+
+    results_ref = {}
+    run_domain(0, None, Nsteps, answers, results_ref)
+    result_ref = results_ref[0]
+
+    # fields of the subdomains are assembled without the guards
+    Ez = np.zeros_like(result_ref['Ez'])
+    ix_start = 0
+    for rank in range(Nsub):
+        G_l, G_r = [Guards * (rank > 0), Guards * (rank < Nsub-1)]
+        Ez_loc = results[rank]['Ez'][:, G_l:results[rank]['Ez'].shape[1]-G_r]
+        Ez[:, ix_start:ix_start+Ez_loc.shape[1]] = Ez_loc
+        ix_start += Ez_loc.shape[1]
+
+    err = np.abs(Ez - result_ref['Ez']).max() / \
+          np.abs(result_ref['Ez']).max()
+    Np = [results[rank]['Np'] for rank in range(Nsub)]
+
+    if verb:
+        print("Difference of the field Ez is {:g}".format(err))
+        print("Particles {} in the subdomains {}, and {} in one domain".
+              format(sum(Np), Np, result_ref['Np']))
+    return err, sum(Np) - result_ref['Np']
+
+
+def run_domain(rank, decomp, Nsteps, answers, results):
+    comm = Communicator(answers=answers)
+
+    grid_loc = deepcopy(grid_in)
+    if decomp is not None:
+        grid_loc = decomp.split_configs(grid_loc, rank)
+    solver = Solver(grid_loc, comm)
+    add_gausian_pulse(solver, laser=laser)
+
+    eons_in = {'Nppc': (2, 2, 4), 'dx': solver.Args['dx'],
+               'dr': solver.Args['dr'], 'dt': solver.Args['dt'],
+               'dens': 0.01, 'charge': -1}
+    ions_in = deepcopy(eons_in)
+    ions_in['charge'] = 1
+    ions_in['Immobile'] = True
+
+    eons = Particles(eons_in, comm)
+    ions = Particles(ions_in, comm)
+    ions.Args['InjectorSource'] = eons
+
+    frame = Frame({'Velocity': 1., 'dt': solver.Args['dt'], 'Steps': 20,
+                   'DensityProfiles': [{'coord': 'x',
+                                        'points': [-100, 20.1, 40, 5e5],
+                                        'values': [0, 0, 1, 1]}]})
+
+    loop = PIC_loop(solvers=[solver, ], species=[eons, ions],
+                    frames=[frame, ])
+    while loop.it < Nsteps:
+        loop.step()
+
+    results[rank] = {'Ez': solver.DataDev['Ez_m0'].get(),
+                     'Np': eons.Args['Np'] + ions.Args['Np']}
+
+
+if __name__ == "__main__":
+    from numpy import array,int32
+    conv_to_list = lambda str_var: list(array( str_var.split(':')).\
+                                          astype(int32))
+
+    Transport = 'threads'
+    if 'MPI' in sys.argv:
+        sys.argv.remove('MPI')
+        Transport = 'MPI'
+
+    if len(sys.argv)>1:
+        run_test(Transport=Transport,
+                 answers=conv_to_list(sys.argv[-1]),verb=True)
+    else:
+        run_test(Transport=Transport, verb=True)
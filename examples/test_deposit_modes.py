@@ -0,0 +1,230 @@
+import numpy as np
+import sys
+
+from chimeraCL.methods.generic_methods_cl import Communicator
+from chimeraCL.particles import Particles
+from chimeraCL.grid import Grid
+
+
+def shape_factors_numpy(d, order):
+    # weights of the nodes (ShapeOffset, ..) for the distance d from cell
+    if order == 1:
+        return [1-d, d]
+    elif order == 2:
+        sel = d < 0.5
+        return [sel * 0.5*(0.5-d)**2,
+                sel * (0.75-d**2) + ~sel * 0.5*(1.5-d)**2,
+                sel * 0.5*(0.5+d)**2 + ~sel * (0.75-(1-d)**2),
+                ~sel * 0.5*(d-0.5)**2]
+    elif order == 3:
+        return [(1-d)**3/6, (4-6*d**2+3*d**3)/6,
+                (4-6*(1-d)**2+3*(1-d)**3)/6, d**3/6]
+
+
+def depose_modes_numpy(parts, grid):
+    # reference projection of the particles charge onto the modes
+    x, y, z, w = [parts.DataDev[arg].get() for arg in ['x', 'y', 'z', 'w']]
+    Nx, Nr, M, order, offset = [grid.Args[arg] for arg in
+        ['Nx', 'Nr', 'M', 'ShapeOrder', 'ShapeOffset']]
+
+    r = np.sqrt(y*y + z*z)
+    sX1 = (x - grid.Args['Xmin']) * grid.Args['dx_inv']
+    sR1 = (r - grid.Args['Rmin']) * grid.Args['dr_inv']
+    ix = np.floor(sX1).astype(np.int64)
+    ir = np.floor(sR1).astype(np.int64)
+    sX = shape_factors_numpy(sX1 - ix, order)
+    sR = shape_factors_numpy(sR1 - ir, order)
+
+    # particles are deposed only from the inner cells
+    sel = (ix > 0) * (ix < Nx - 2) * (ir < Nr - 2)
+    exp_m1 = (y + 1j*z) / r
+    wp = w * parts.Args['charge']
+
+    flds = [np.zeros(Nr*Nx, dtype=np.complex128) for m in range(M+1)]
+    for m in range(M+1):
+        for i in range(len(sR)):
+            ir_dep = ir + offset + i
+            # the node below the axis is folded as in treat_axis
+            sgn = 1 - 2*(ir_dep < 0)
+            ir_dep = np.where(ir_dep < 0, 1 - ir_dep, ir_dep)
+            for j in range(len(sX)):
+                i_dep = ix + offset + j + Nx*ir_dep
+                np.add.at(flds[m], i_dep[sel],
+                          (sgn * wp * sR[i] * sX[j] * exp_m1**m)[sel])
+    return [fld.reshape(Nr, Nx) for fld in flds]
+
+
+def gather_push_numpy(parts, grid, p_init):
+    # reference gathering of the modes fields and push of the momenta
+    x, y, z = [parts.DataDev[arg].get() for arg in ['x', 'y', 'z']]
+    Nx, Nr, M, order, offset = [grid.Args[arg] for arg in
+        ['Nx', 'Nr', 'M', 'ShapeOrder', 'ShapeOffset']]
+
+    r = np.sqrt(y*y + z*z)
+    sX1 = (x - grid.Args['Xmin']) * grid.Args['dx_inv']
+    sR1 = (r - grid.Args['Rmin']) * grid.Args['dr_inv']
+    ix = np.floor(sX1).astype(np.int64)
+    ir = np.floor(sR1).astype(np.int64)
+    sX = shape_factors_numpy(sX1 - ix, order)
+    sR = shape_factors_numpy(sR1 - ir, order)
+
+    # only the particles of the inner cells are pushed
+    sel = (ix > 0) * (ix < Nx - 2) * (ir < Nr - 2)
+    exp_m1 = (y - 1j*z) / r
+
+    flds = {}
+    for fld in ['E', 'B']:
+        for comp in ['x', 'y', 'z']:
+            val = np.zeros(x.size)
+            for m in range(M+1):
+                fld_m = grid.DataDev[fld + comp + '_m' + str(m)].get().ravel()
+                for i in range(len(sR)):
+                    ir_gat = ir + offset + i
+                    # the node below the axis is mirrored as in warp_axis
+                    sgn = 1 - 2*(ir_gat < 0)*(m > 0)
+                    ir_gat = np.where(ir_gat < 0, 1 - ir_gat, ir_gat)
+                    for j in range(len(sX)):
+                        i_gat = (ix + offset + j + Nx*ir_gat) * sel
+                        val += (1 + (m > 0)) * sgn * sR[i] * sX[j] \
+                               * (fld_m[i_gat] * exp_m1**m).real
+            flds[fld + comp] = val
+
+    e_p = np.array([flds['E' + comp] for comp in ['x', 'y', 'z']])
+    b_p = np.array([flds['B' + comp] for comp in ['x', 'y', 'z']])
+    u_p = np.array(p_init)
+    dt_2 = 0.5 * parts.Args['FactorPush']
+
+    um = u_p + dt_2 * e_p
+    t = dt_2 * b_p / np.sqrt(1 + (um**2).sum(axis=0))
+    s = 2 * t / (1 + (t**2).sum(axis=0))
+    u0 = um + np.cross(um, t, axis=0)
+    up = um + np.cross(u0, s, axis=0)
+    return list(np.where(sel, up + dt_2 * e_p, u_p))
+
+
+def run_test(Ms=(1, 2, 3), orders=(1, 2, 3), fld_precision='double',
+             answers=[], verb=False):
+    comm = Communicator(answers=answers, fld_precision=fld_precision)
+    grid_in = {'Xmin': -20., 'Xmax': 20., 'Nx': 161,
+               'Rmin': 0., 'Rmax': 16., 'Nr': 33}
+
+    err_ref, err_modes, err_gather, err_push = 0, 0, 0, 0
+    for order in orders:
+        grids = []
+        for M in Ms:
+            for tiles in [True, False]:
+                grid_in_M = grid_in.copy()
+                grid_in_M.update({'M': M, 'ShapeOrder': order,
+                                  'DepositTiles': tiles})
+                grids.append(Grid(grid_in_M, comm))
+
+        parts = Particles({'Nppc': (2, 2, 4), 'dt': 0.2,
+                           'dx': grids[0].Args['dx'],
+                           'dr': grids[0].Args['dr']}, comm)
+        parts.make_new_domain({'Xmin': -20., 'Xmax': 20.,
+                               'Rmin': 0., 'Rmax': 16.,
+                               'dpx': 0.1, 'dpy': 0.1, 'dpz': 0.1})
+        parts.add_new_particles()
+        parts.sort_parts(grid=grids[0])
+
+        errs = compare_grids(grids, parts)
+        err_ref = max(err_ref, errs[0])
+        err_modes = max(err_modes, errs[1])
+        err_gather = max(err_gather, errs[2])
+        err_push = max(err_push, errs[3])
+
+    comm.thr.synchronize()
+    if verb:
+        print("Fields precision is {}".format(fld_precision))
+        print("Error of deposition against reference is {:g}".
+              format(err_ref))
+        print("Error in shared modes is {:g} (depose) and {:g} (gather)".
+              format(err_modes, err_gather))
+        print("Error of gather and push against reference is {:g}".
+              format(err_push))
+    return err_ref, err_modes, err_gather, err_push
+
+
+def compare_grids(grids, parts):
+    # generated kernels are compared with the reference projection
+    err_ref = 0
+    for grid in grids:
+        for m in range(grid.Args['M']+1):
+            grid.set_to(grid.DataDev['rho_m'+str(m)], 0)
+        grid.depose_scalar(parts, 'w', 'rho', parts.Args['charge'])
+
+        # errors are normalized to m=0 since higher modes of
+        # a uniform plasma are close to zero
+        rho_ref = depose_modes_numpy(parts, grid)
+        rho_norm = np.abs(rho_ref[0]).max()
+        for m in range(grid.Args['M']+1):
+            rho = grid.DataDev['rho_m'+str(m)].get()
+            err_ref = max(err_ref, np.abs(rho-rho_ref[m]).max()/rho_norm)
+
+    # modes shared by the grids should be equal for the charge,
+    # currents and the gathered momenta, which are also compared
+    # with the reference gathering and push
+    for grid in grids:
+        grid.depose_charge([parts,])
+        grid.depose_currents([parts,])
+
+    err_modes = 0
+    grid0 = grids[0]
+    for grid in grids[1:]:
+        for m in range(grid0.Args['M']+1):
+            for fld in ['rho', 'Jx', 'Jy', 'Jz']:
+                arg = fld + '_m' + str(m)
+                val0 = grid0.DataDev[arg].get()
+                val = grid.DataDev[arg].get()
+                fld_norm = np.abs(grid0.DataDev[fld + '_m0'].get()).max()
+                err_modes = max(err_modes, np.abs(val-val0).max()/fld_norm)
+
+    # each field component is taken from a different current
+    fld_srcs = {'Ex': 'Jx', 'Ey': 'Jy', 'Ez': 'Jz',
+                'Bx': 'Jz', 'By': 'Jx', 'Bz': 'Jy'}
+    p_init = [parts.DataDev[arg].get() for arg in ['px', 'py', 'pz']]
+    for grid in grids:
+        for m in range(grid.Args['M']+1):
+            for fld in ['E', 'B']:
+                for comp in grid.Args['vec_comps']:
+                    arg = fld + comp + '_m' + str(m)
+                    if m > grid0.Args['M']:
+                        grid.set_to(grid.DataDev[arg], 0)
+                    else:
+                        grid.DataDev[arg][:] = \
+                            grid0.DataDev[fld_srcs[fld+comp] + '_m' + str(m)]
+
+    p_out = []
+    err_push = 0
+    for grid in grids:
+        for arg, val in zip(['px', 'py', 'pz'], p_init):
+            parts.DataDev[arg][:] = val
+        grid._gather_and_push(parts, ['E', 'B'])
+        p_out.append([parts.DataDev[arg].get()
+                      for arg in ['px', 'py', 'pz']])
+
+        # errors are normalized to the change of the momenta
+        p_ref = gather_push_numpy(parts, grid, p_init)
+        for k in range(3):
+            dp_norm = np.abs(p_ref[k] - p_init[k]).max()
+            err_push = max(err_push,
+                           np.abs(p_out[-1][k] - p_ref[k]).max() / dp_norm)
+
+    err_gather = max(np.abs(p_out[0][k]-p_out[i][k]).max() /
+                     np.abs(p_out[0][k]).max()
+                     for i in range(1, len(grids)) for k in range(3))
+
+    return err_ref, err_modes, err_gather, err_push
+
+if __name__ == "__main__":
+    from numpy import array,int32
+    conv_to_list = lambda str_var: list(array( str_var.split(':')).\
+                                          astype(int32))
+
+    # deposition buffers are float32 with the 'single' fields precision
+    for fld_precision in ['double', 'single']:
+        if len(sys.argv)>1:
+            run_test(fld_precision=fld_precision,
+                     answers=conv_to_list(sys.argv[-1]),verb=True)
+        else:
+            run_test(fld_precision=fld_precision, verb=True)
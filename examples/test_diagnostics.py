@@ -0,0 +1,110 @@
+import numpy as np
+import h5py
+import os
+import sys
+import shutil
+
+from chimeraCL.methods.generic_methods_cl import Communicator
+from chimeraCL.particles import Particles
+from chimeraCL.solver import Solver
+from chimeraCL.frame import Frame
+from chimeraCL.laser import add_gausian_pulse
+from chimeraCL.pic_loop import PIC_loop
+from chimeraCL.diagnostics import Diagnostics
+
+
+def run_test(Nsteps=40, answers=[], verb=False):
+    """
+    Compare the outputs of the synchronous and asynchronous
+    diagnostics of the same run for both layouts, and check that
+    the error of the background writer is raised by finish, while
+    the next records are still written
+    """
+    comm = Communicator(answers=answers)
+    solver = Solver({'Xmin': -20., 'Xmax': 20., 'Nx': 200,
+                     'Rmin': 0., 'Rmax': 16., 'Nr': 40, 'M': 1,
+                     'DampCells': 20, 'dt': 0.2}, comm)
+    add_gausian_pulse(solver, laser={'k0': 1., 'a0': 0.3, 'x0': 12.,
+                                     'Lx': 1.5, 'R': 6., 'x_foc': 0.})
+
+    eons = Particles({'Nppc': (2, 2, 4), 'dx': solver.Args['dx'],
+                      'dr': solver.Args['dr'], 'dt': solver.Args['dt'],
+                      'dens': 0.01, 'charge': -1}, comm)
+    frame = Frame({'Velocity': 1., 'dt': solver.Args['dt'], 'Steps': 20,
+                   'DensityProfiles': [{'coord': 'x',
+                                        'points': [-100, 20.1, 40, 5e5],
+                                        'values': [0, 0, 1, 1]}]})
+
+    diags = {}
+    for layout in ('files', 'series'):
+        for mode in ('sync', 'async'):
+            diags[layout, mode] = Diagnostics(
+                {'Interval': 10, 'ScalarFields': ['rho', ],
+                 'VectorFields': ['E', 'J'], 'Layout': layout,
+                 'Asynchronous': mode == 'async', 'MaxPending': 1,
+                 'Species': {'Components': ['x', 'y', 'z', 'px', 'w']}},
+                solver, species=[eons, ], frame=frame,
+                path='diags_test/' + layout + '_' + mode)
+
+    loop = PIC_loop(solvers=[solver, ], species=[eons, ],
+                    frames=[frame, ], diags=list(diags.values()))
+    while loop.it < Nsteps:
+        loop.step()
+
+    same = {}
+    for layout in ('files', 'series'):
+        for diag in diags[layout, 'sync'], diags[layout, 'async']:
+            diag.finish()
+        same[layout] = read_diags(diags[layout, 'sync'].path) \
+                       == read_diags(diags[layout, 'async'].path)
+
+    # writer fails when its folder is removed, and the error is
+    # raised in this thread, while the failed record frees its slot
+    diag = diags['files', 'async']
+    shutil.rmtree(diag.path)
+    diag.make_record(loop.it)
+    try:
+        diag.finish()
+        error_raised = False
+    except OSError:
+        error_raised = True
+
+    os.makedirs(diag.path)
+    diag.make_record(loop.it)
+    diag.finish()
+    written_after = len(os.listdir(diag.path)) == 1
+
+    shutil.rmtree(os.getcwd() + '/diags_test')
+
+    if verb:
+        for layout in ('files', 'series'):
+            print("Synchronous and asynchronous {} are {}".format(
+                  layout, 'same' if same[layout] else 'different'))
+        print("Error of the writer is raised: {}, and the next record "
+              "is written: {}".format(error_raised, written_after))
+    return same, error_raised, written_after
+
+
+def read_diags(path):
+    # all datasets of the output files, with the file names in paths
+    data = {}
+    def read_item(name, item):
+        if isinstance(item, h5py.Dataset):
+            data[fname + '/' + name] = item[()]
+
+    for fname in sorted(os.listdir(path)):
+        with h5py.File(path + fname, 'r') as h5_file:
+            h5_file.visititems(read_item)
+
+    return {key: np.asarray(val).tobytes() for key, val in data.items()}
+
+
+if __name__ == "__main__":
+    from numpy import array,int32
+    conv_to_list = lambda str_var: list(array( str_var.split(':')).\
+                                          astype(int32))
+
+    if len(sys.argv)>1:
+        run_test(answers=conv_to_list(sys.argv[-1]),verb=True)
+    else:
+        run_test(verb=True)
@@ -0,0 +1,86 @@
+import numpy as np
+import sys
+from time import time
+
+from chimeraCL.methods.generic_methods_cl import Communicator
+from chimeraCL.particles import Particles
+from chimeraCL.grid import Grid
+
+
+def run_test(layouts=('SoA', 'AoS'), Nsteps=20, answers=[], verb=False):
+    """
+    Compare the particles layouts, which should give the same results,
+    and measure their steps times. The packed layout ('AoS') is
+    experimental, and it is to be chosen only if it is faster here
+    """
+    comm = Communicator(answers=answers)
+    grid_in = {'Xmin': -20., 'Xmax': 20., 'Nx': 321,
+               'Rmin': 0., 'Rmax': 16., 'Nr': 65, 'M': 1}
+    grid = Grid(grid_in, comm)
+
+    species = []
+    for layout in layouts:
+        parts = Particles({'Nppc': (2, 2, 4), 'dt': 0.1,
+                           'dx': grid.Args['dx'], 'dr': grid.Args['dr'],
+                           'Layout': layout}, comm)
+        species.append(parts)
+
+    # particles are generated once and copied to the other layouts
+    species[0].make_new_domain({'Xmin': -15., 'Xmax': 15.,
+                                'Rmin': 0., 'Rmax': 12.,
+                                'dpx': 0.5, 'dpy': 0.5, 'dpz': 0.5})
+    for parts in species:
+        parts.add_new_particles(source=species[0])
+
+    # fields are set to some non-zero values for the gather
+    for m in range(grid.Args['M']+1):
+        for fld in ['E', 'B']:
+            for comp in grid.Args['vec_comps']:
+                arg = fld + comp + '_m' + str(m)
+                grid.DataDev[arg][:] = 1e-2 * (m+1)
+
+    timings, results = [], []
+    for parts in species:
+        run_steps(grid, parts, 1)
+        comm.thr.synchronize()
+
+        t0 = time()
+        run_steps(grid, parts, Nsteps)
+        comm.thr.synchronize()
+        timings.append((time() - t0) / Nsteps)
+
+        results.append([np.sort(parts.get_comp(comp))
+                        for comp in ['x', 'px', 'w']])
+
+    err = max(np.abs(results[0][k]-res[k]).max() /
+              np.abs(results[0][k]).max()
+              for res in results[1:] for k in range(3))
+
+    if verb:
+        print("Difference between the layouts is {:g}".format(err))
+        for layout, t_step in zip(layouts, timings):
+            print("{} layout: {:g} ms per step".format(layout, 1e3*t_step))
+    return err, timings
+
+
+def run_steps(grid, parts, Nsteps):
+    # the steps of the particles loop, without the fields solver
+    for it in range(Nsteps):
+        parts.push_and_sort_parts(grid=grid, mode='half')
+        grid.depose_currents(species=[parts, ])
+        parts.push_and_sort_parts(grid=grid, mode='half')
+        grid.depose_charge(species=[parts, ])
+        grid.gather_and_push(species=[parts, ])
+        parts.align_parts()
+        parts.free_mp()
+
+
+if __name__ == "__main__":
+    from numpy import array,int32
+    conv_to_list = lambda str_var: list(array( str_var.split(':')).\
+                                          astype(int32))
+
+    if len(sys.argv)>1:
+        run_test(answers=conv_to_list(sys.argv[-1]),verb=True)
+    else:
+        run_test(verb=True)
@@ -0,0 +1,133 @@
+import numpy as np
+import h5py
+import sys
+import shutil
+
+from chimeraCL.methods.generic_methods_cl import Communicator
+from chimeraCL.particles import Particles
+from chimeraCL.solver import Solver
+from chimeraCL.laser import add_gausian_pulse
+from chimeraCL.reduced_diagnostics import ReducedDiagnostics
+
+
+def run_test(answers=[], verb=False):
+    """
+    Compare the reduced diagnostics of the laser and the particles
+    with the same quantities computed on the host. The field energy
+    summed over the spectral fields is compared with the integral of
+    the real space fields, which differs by the discretization
+    """
+    comm = Communicator(answers=answers)
+    solver = Solver({'Xmin': -20., 'Xmax': 20., 'Nx': 200,
+                     'Rmin': 0., 'Rmax': 16., 'Nr': 40, 'M': 1,
+                     'DampCells': 20, 'dt': 0.2}, comm)
+    add_gausian_pulse(solver, laser={'k0': 1., 'a0': 1., 'x0': 2.,
+                                     'Lx': 3., 'R': 5., 'x_foc': 0.})
+
+    parts = Particles({'Nppc': (2, 2, 2), 'dt': solver.Args['dt'],
+                       'dx': solver.Args['dx'], 'dr': solver.Args['dr'],
+                       'dens': 0.01, 'charge': -1}, comm)
+    parts.make_new_domain({'Xmin': -10., 'Xmax': 10.,
+                           'Rmin': 0., 'Rmax': 6.,
+                           'dpx': 0.5, 'dpy': 0.2, 'dpz': 0.2})
+    parts.add_new_particles()
+
+    selections = [['x', -5., 8.], ['px', -0.4, None]]
+    histograms = [['x', -10., 10., 20], ['gamma', 1., 1.2, 16]]
+    diag = ReducedDiagnostics({'Interval': 1, 'Flush': 1,
+                               'Species': {'Selections': selections,
+                                           'Histograms': histograms}},
+                              solver, species=[parts, ],
+                              path='diags_reduced_test')
+    diag.make_record(0)
+    diag.finish()
+
+    with h5py.File(diag.fname, 'r') as h5_file:
+        reduced = {}
+        h5_file.visititems(lambda name, item: reduced.update(
+            {name: item[-1]}) if isinstance(item, h5py.Dataset) else None)
+    shutil.rmtree(diag.path)
+
+    reduced_host = get_reduced_host(solver, parts, selections, histograms)
+
+    errors = {}
+    for key, val in reduced_host.items():
+        errors[key] = np.abs(reduced[key] - val).max() \
+                      / max(np.abs(val).max(), 1e-300)
+
+    if verb:
+        for key in sorted(errors.keys()):
+            print("{}: relative difference {:.2e}".format(key, errors[key]))
+    return errors
+
+
+def get_reduced_host(solver, parts, selections, histograms):
+    reduced = {}
+    M = solver.Args['M']
+    dx, dr = solver.Args['dx'], solver.Args['dr']
+    Rgrid = solver.Args['Rgrid']
+    dV = 2*np.pi * dx * dr * Rgrid * (Rgrid > 0)
+
+    # squared fields of the modes integrated over the volume
+    def energy_real(flds, m):
+        factor = 1. if m == 0 else 0.5
+        return 0.5 * factor * sum(
+            (np.abs(solver.DataDev[fld + '_m' + str(m)].get())**2
+             * dV[:, None]).sum(axis=0) for fld in flds)
+
+    solver.fb_transform(vects=['E', 'B'], dir=1)
+    flds = [fld + comp for fld in ['E', 'B'] for comp in ['x', 'y', 'z']]
+    reduced['fields/energy'] = np.array([energy_real(flds, m).sum()
+                                         for m in range(M+1)])
+
+    prof = sum(energy_real(['Ey', 'Ez'], m) for m in range(M+1))
+    reduced['laser/energy'] = prof.sum()
+    reduced['laser/centroid'] = (prof * solver.Args['Xgrid']).sum() \
+                                / prof.sum()
+
+    data = {comp: parts.get_comp(comp)
+            for comp in ['x', 'y', 'z', 'px', 'py', 'pz', 'g_inv', 'w']}
+    data['gamma'] = 1. / data.pop('g_inv')
+
+    select = np.ones(data['x'].size, dtype=bool)
+    for comp, vmin, vmax in selections:
+        if vmin is not None: select *= data[comp] > vmin
+        if vmax is not None: select *= data[comp] < vmax
+    data = {comp: data[comp][select] for comp in data.keys()}
+
+    h5_path = 'species/species_0/'
+    w = data['w']
+    reduced[h5_path + 'Np'] = w.size
+    reduced[h5_path + 'charge'] = w.sum() * parts.Args['w2pC']
+
+    for comp in ['x', 'y', 'z', 'px', 'py', 'pz', 'gamma']:
+        mean = np.average(data[comp], weights=w)
+        reduced[h5_path + 'mean_' + comp] = mean
+        reduced[h5_path + 'rms_' + comp] = np.sqrt(
+            np.average((data[comp] - mean)**2, weights=w))
+
+    for comp in ['y', 'z']:
+        cov = np.cov(data[comp], data['p' + comp], aweights=w, bias=True)
+        reduced[h5_path + 'emittance_' + comp] = \
+            np.sqrt(np.linalg.det(cov))
+
+    # bins are found as in the histogram kernel
+    for comp, vmin, vmax, Nbins in histograms:
+        bins = np.floor((data[comp] - vmin) * (Nbins / (vmax - vmin)))
+        inside = (bins >= 0) * (bins < Nbins)
+        reduced[h5_path + 'hist_' + comp] = np.bincount(
+            bins[inside].astype(int), weights=w[inside], minlength=Nbins) \
+            * parts.Args['w2pC']
+
+    return reduced
+
+
+if __name__ == "__main__":
+    from numpy import array,int32
+    conv_to_list = lambda str_var: list(array( str_var.split(':')).\
+                                          astype(int32))
+
+    if len(sys.argv)>1:
+        run_test(answers=conv_to_list(sys.argv[-1]),verb=True)
+    else:
+        run_test(verb=True)
@@ -0,0 +1,79 @@
+import numpy as np
+import sys
+
+from chimeraCL.methods.generic_methods_cl import Communicator
+from chimeraCL.particles import Particles
+from chimeraCL.grid import Grid
+
+
+def run_test(answers=[], verb=False):
+    """
+    Compare the incremental sort with the full one, for the pushes
+    which move the particles to the other cells below and above
+    SortMoversMax, and push some of them out of the grid
+    """
+    comm = Communicator(answers=answers)
+    grid_in = {'Xmin': -20., 'Xmax': 20., 'Nx': 161,
+               'Rmin': 0., 'Rmax': 16., 'Nr': 33, 'M': 0}
+    grid = Grid(grid_in, comm)
+
+    # the steps dt (in the units of the cell size) give the fractions
+    # of movers below and above SortMoversMax, and the long steps move
+    # the particles near the right edge out of the grid
+    cases = [('few movers', 0.3, 0.25), ('many movers', 0.8, 0.25),
+             ('leaving the grid', 4., 1.), ('leaving the grid', 4., 0.25)]
+
+    results = []
+    for case, dt, movers_max in cases:
+        parts = Particles({'Nppc': (2, 2, 2), 'dt': dt * grid.Args['dx'],
+                           'dx': grid.Args['dx'], 'dr': grid.Args['dr'],
+                           'SortMoversMax': movers_max}, comm)
+        parts.make_new_domain({'Xmin': -18., 'Xmax': 19.5,
+                               'Rmin': 0., 'Rmax': 15.,
+                               'dpx': 1., 'dpy': 0.2, 'dpz': 0.2})
+        parts.add_new_particles()
+
+        parts.index_sort(grid)
+        parts.index_sort(grid, push_dt='dt')
+        assert parts.flag_sort_valid
+
+        movers = parts.DataDev['num_movers'].get().item() / parts.Args['Np']
+        sorted_inc = get_sorting(parts)
+
+        # the full sort of the same particles
+        parts.flag_sort_valid = False
+        parts.index_sort(grid)
+        sorted_full = get_sorting(parts)
+
+        parts.sync_num_stay()
+        Np_out = parts.Args['Np'] - parts.Args['Np_stay']
+        same = all(np.array_equal(a, b)
+                   for a, b in zip(sorted_inc, sorted_full))
+        results.append(same)
+
+        if verb:
+            print("{}: {:.1%} movers (max {:.0%}), {} particles out, "
+                  "sorts are {}".format(case, movers, movers_max, Np_out,
+                                        'same' if same else 'different'))
+
+    return results
+
+
+def get_sorting(parts):
+    # offsets of the cells, and the particles of each cell in the
+    # order of indices (the order within the cells is not defined)
+    cell_offset = parts.DataDev['cell_offset'].get()
+    sort_indx = parts.DataDev['sort_indx'].get()
+    cells = np.repeat(np.arange(cell_offset.size-1), np.diff(cell_offset))
+    return cell_offset, sort_indx[np.lexsort((sort_indx, cells))]
+
+
+if __name__ == "__main__":
+    from numpy import array,int32
+    conv_to_list = lambda str_var: list(array( str_var.split(':')).\
+                                          astype(int32))
+
+    if len(sys.argv)>1:
+        run_test(answers=conv_to_list(sys.argv[-1]),verb=True)
+    else:
+        run_test(verb=True)
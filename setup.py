@@ -32,6 +32,7 @@ setup(
     tests_require=[],
     cmdclass={},
     install_requires=install_requires,
+    extras_require={'mpi': ['mpi4py']},
     include_package_data=True,
     platforms='any',
     url='https://github.com/hightower8083/chimeraCL',